@@ -2,18 +2,42 @@
 对一条 9 维 IMU 数据做一次分类预测：
 python predict_class.py -550 61 933 1525 1098 1647 -27718 18235 -54108
 """
-import argparse, os, joblib, numpy as np, torch
+import argparse, os, sys, functools, joblib, numpy as np, torch
+from sklearn.preprocessing import StandardScaler, LabelEncoder
 from motionClassifier import IMUNet
 
 BASE = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_PATH = os.path.join(BASE, "weights", "imu_net.bundle")  # built by build_artifact_bundle.py
 
+sys.path.append(os.path.dirname(BASE))  # code_backend/, for lib.artifacts
+from lib.artifacts import load_bundle
 
+
+def _load_from_bundle():
+    """scaler, label encoder and network weights from the single memory-mapped bundle"""
+    bundle = load_bundle(BUNDLE_PATH)
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(bundle["scaler/mean"])
+    scaler.scale_ = np.array(bundle["scaler/scale"])
+    scaler.n_features_in_ = len(scaler.mean_)
+    le = LabelEncoder()
+    le.classes_ = np.array(bundle.meta["classes"])
+    # load_state_dict copies into the parameters, so copying out of the read-only map here is free
+    state = {name[len("model/"):]: torch.from_numpy(np.array(bundle[name])) for name in bundle.names("model/")}
+    return state, scaler, le
+
+
+@functools.lru_cache(maxsize=None)
 def load_resources():
-    scaler = joblib.load(os.path.join(BASE, "weights/scaler.pkl"))
-    le = joblib.load(os.path.join(BASE, "weights/label_encoder.pkl"))
     device = torch.device("cpu")
+    if os.path.exists(BUNDLE_PATH):
+        state, scaler, le = _load_from_bundle()
+    else:
+        scaler = joblib.load(os.path.join(BASE, "weights/scaler.pkl"))
+        le = joblib.load(os.path.join(BASE, "weights/label_encoder.pkl"))
+        state = torch.load(os.path.join(BASE, "weights", "best_imu_net.pt"), map_location=device)
     model = IMUNet(in_dim=9, n_classes=len(le.classes_)).to(device)
-    model.load_state_dict(torch.load(os.path.join(BASE, "weights", "best_imu_net.pt"), map_location=device))
+    model.load_state_dict(state)
     model.eval()
     return model, scaler, le, device
 
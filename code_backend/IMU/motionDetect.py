@@ -12,8 +12,6 @@ from bleak import BleakClient, BleakError
 from _pridictClass import load_resources, predict
 
 
-model, scaler, le, device = load_resources()
-
 DEVICE_ADDRESS  = "E5796C3F-1C80-8E92-A222-0EEF42F6ED28"
 CUSTOM_SVC_UUID = "4A981234-1CC4-E7C1-C757-F1267DD021E8"
 CUSTOM_WRT_CHAR_UUID = "4A981235-1CC4-E7C1-C757-F1267DD021E8"
@@ -87,7 +85,7 @@ async def sample_once(class_name: str):
             append_row(imu_buf + [class_name])
             saved += 1
             raw = imu_buf
-            label = predict(raw, model, scaler, le, device)
+            label = predict(raw, *load_resources())  # loaded once, on the first sample
             print(f"Record as {saved:03d}: {imu_buf}, label is predict as {label}")
             imu_buf = [None] * 9
             last_update_time = time.time()
@@ -5,9 +5,19 @@ import numpy as np
 import csv
 import json
 import os
+import sys
+import threading
+import time
 from bleak import BleakClient
 import paho.mqtt.client as mqtt
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BASE_DIR))  # code_backend/, for lib.artifacts
+from lib.artifacts import load_bundle
+from lib.delta import DeltaReceiver
+from lib.wire import WireDecoder, is_binary
+from lib.pipeline import Stage, keep_newest
+
 # MQTT configuration
 BROKER = "10.166.179.5"
 PORT = 1883
@@ -22,6 +32,16 @@ BLE_ADDRESS = "D2:26:F4:24:FE:5A"
 # CSV save path
 CSV_PATH = "imu_data.csv"
 
+# Inference stage: BLE collection + model run off the MQTT thread, newest coordinates per cow.
+# One worker, since every job talks to the same BLE device and shares the IMU buffer.
+IMU_WORKERS = 1
+IMU_QUEUE_SIZE = 100   # cows waiting; beyond this the cow that has waited longest is dropped
+STATS_INTERVAL = 60    # seconds between stage latency reports
+
+# Model weights: single memory-mapped bundle (build_artifact_bundle.py) if present, else the torch checkpoint
+MODEL_PATH = os.path.join(BASE_DIR, "imu_model.pt")
+BUNDLE_PATH = os.path.join(BASE_DIR, "imu_model.bundle")
+
 # Model label mapping
 LABEL_MAP = {0: "drink", 1: "sleep", 2: "forward", 3: "fall"}
 REVERSE_LABEL_MAP = {v: k for k, v in LABEL_MAP.items()}
@@ -47,14 +67,33 @@ class BiLSTMWithMultiHeadAttention(nn.Module):
         attn_out, _ = self.attn(lstm_out, lstm_out, lstm_out)
         return self.fc(attn_out.mean(dim=1))
 
-# loading model
-model = BiLSTMWithMultiHeadAttention()
-model.load_state_dict(torch.load("imu_model.pt", map_location="cpu"))
-model.eval()
+# loading model, once, on the first prediction
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                model = BiLSTMWithMultiHeadAttention()
+                if os.path.exists(BUNDLE_PATH):
+                    bundle = load_bundle(BUNDLE_PATH)
+                    # load_state_dict copies into the parameters, so copying out of the read-only map is free
+                    state = {name: torch.from_numpy(np.array(bundle[name])) for name in bundle.names()}
+                else:
+                    state = torch.load(MODEL_PATH, map_location="cpu")
+                model.load_state_dict(state)
+                model.eval()
+                _model = model
+    return _model
 
 imu_buf = [None] * 6
 saved_rows = 0
 latest_coord = {}  # cow_id -> [x, y, is_out]
+receiver = DeltaReceiver("RSSI_IMU")  # /modelPublish sends changed cows only, plus periodic keyframes
+decoder = WireDecoder()  # binary /modelPublish frames (lib/wire.py)
 
 # BLE notification parsing
 def parse_notification(txt):
@@ -92,7 +131,7 @@ def predict_behavior():
     data = np.array([[float(x) for x in row] for row in recent]).reshape(1, 20, 6).astype(np.float32)
     with torch.no_grad():
         input_tensor = torch.from_numpy(data)
-        output = model(input_tensor)
+        output = get_model()(input_tensor)
         pred_label = torch.argmax(output, dim=1).item()
         return LABEL_MAP[pred_label]
 
@@ -100,44 +139,62 @@ def predict_behavior():
 def is_boundary(x, y):
     return x in {1, 16} or y in {1, 8}  # Boundary determination for 8x16 area
 
-# Main logic after receiving coordinates
-def on_message(client, userdata, msg):
-    global saved_rows
-    payload = json.loads(msg.payload.decode())
-    print("Received:", payload)
+# BLE collection and inference for one cow, on the stage worker
+def collect_and_predict(job):
+    client, cow_id, x, y, original_status = job
 
-    for cow_id, (x, y, original_status) in payload.items():
-        latest_coord[cow_id] = [x, y, original_status]
+    async def collect():
+        global saved_rows
+        saved_rows = 0
+
+        async with BleakClient(BLE_ADDRESS) as ble_client:
+            await ble_client.start_notify(READ_UUID, handle_notification)
+            await ble_client.write_gatt_char(WRITE_UUID, b"s")
+            while saved_rows < 20:
+                await asyncio.sleep(0.1)
+            await ble_client.stop_notify(READ_UUID)
 
-        async def collect_and_predict():
-            global saved_rows
-            saved_rows = 0
+    asyncio.run(collect())
+    action = predict_behavior()
+    print(f"Predicted behavior: {action}")
 
-            async with BleakClient(BLE_ADDRESS) as ble_client:
-                await ble_client.start_notify(READ_UUID, handle_notification)
-                await ble_client.write_gatt_char(WRITE_UUID, b"s")
-                while saved_rows < 20:
-                    await asyncio.sleep(0.1)
-                await ble_client.stop_notify(READ_UUID)
+    if action == "forward" and is_boundary(x, y):
+        predicted_status = -1  # 出界
+    elif action in REVERSE_LABEL_MAP:
+        predicted_status = REVERSE_LABEL_MAP[action]
+    else:
+        predicted_status = -2
 
-            action = predict_behavior()
-            print(f"Predicted behavior: {action}")
+    description = STATUS_DESCRIPTION.get(predicted_status, "unknown state")
+    print(f"The {cow_id} now is {description}")
 
-            if action == "forward" and is_boundary(x, y):
-                predicted_status = -1  # 出界
-            elif action in REVERSE_LABEL_MAP:
-                predicted_status = REVERSE_LABEL_MAP[action]
-            else:
-                predicted_status = -2
+    result = {cow_id: [x, y, original_status, predicted_status]}
+    client.publish(PUB_TOPIC, json.dumps(result))
+    print("Published:", result)
 
-            description = STATUS_DESCRIPTION.get(predicted_status, "unknown state")
-            print(f"The {cow_id} now is {description}")
+imu_stage = Stage("imu", collect_and_predict, workers=IMU_WORKERS, maxsize=IMU_QUEUE_SIZE,
+                  merge=keep_newest, overflow="drop_oldest")
 
-            result = {cow_id: [x, y, original_status, predicted_status]}
-            client.publish(PUB_TOPIC, json.dumps(result))
-            print("Published:", result)
+# Main logic after receiving coordinates: decode and queue, the stage worker does the rest
+def on_message(client, userdata, msg):
+    try:
+        if is_binary(msg.payload):
+            _, message = decoder.decode(msg.payload)
+            if message is None:
+                return  # dictionary frame
+        else:
+            message = json.loads(msg.payload.decode())
+        payload, keyframe = receiver.receive(message)
+    except ValueError as e:
+        print(f"Ignoring undecodable message: {e}")
+        return
+    print("Received keyframe:" if keyframe else "Received:", payload)
+    if keyframe:
+        latest_coord.clear()
 
-        asyncio.run(collect_and_predict())
+    for cow_id, (x, y, original_status) in payload.items():
+        latest_coord[cow_id] = [x, y, original_status]
+        imu_stage.put(cow_id, (client, cow_id, x, y, original_status))
 
 # Start MQTT client
 def main():
@@ -145,8 +202,16 @@ def main():
     client.on_message = on_message
     client.connect(BROKER, PORT, 60)
     client.subscribe(SUB_TOPIC)
+    imu_stage.start()
+    client.loop_start()
     print("Listening for /modelPublish messages...")
-    client.loop_forever()
+    try:
+        while True:
+            time.sleep(STATS_INTERVAL)
+            print(f"IMU stage stats: {imu_stage.stats()}")
+    finally:
+        client.loop_stop()
+        imu_stage.stop()
 
 if __name__ == "__main__":
     main()
@@ -7,7 +7,8 @@ from pyModbusTCP.client import ModbusClient
 from logging.handlers import RotatingFileHandler
 
 from lib.buzzer_modbusTCP import BuzzerModbus
-from lib.listen_event import alarm_dictionary, start_mqtt_listener, _dict_lock
+from lib.alarm_store import ENTER, EXIT, RESYNC, STALE, UPDATE
+from lib.listen_event import alarm_store, start_mqtt_listener
 from lib import publisher
 
 
@@ -68,16 +69,17 @@ def alarm_send_sms(cow_id, grid, isOutside):
         json_data = {
             "cow_id": str(cow_id),
             "grid": str(grid),
-            "isOutside": isOutside  # "On" or "Back"
+            "isOutside": isOutside  # "On", "Back" or "Stale"
         }
 
     json_payload = json.dumps(json_data, default=str)
-    result = publisher.push_message(BROKER, BROKER_PORT, USERNAME, PASSWORD, SMS_TOPIC, json_payload)
+    result = publisher.push_message(BROKER, BROKER_PORT, USERNAME, PASSWORD, SMS_TOPIC, json_payload,
+                                    durable=True)
+    # push_message only queues (the outbox sends it once the broker is reachable), result[1] is always None
     if result[0] == 0:
-        logging.info(f"Sent SMS to {cow_id}: {isOutside}")
+        logging.info(f"Queued SMS to {cow_id}: {isOutside}")
     else:
-        logging.error(f"Failed to send SMS to {cow_id}: {isOutside}, Error code: {result[0]}")
-    logging.info(f"Sent SMS to {cow_id}: {isOutside}")
+        logging.error(f"Failed to queue SMS to {cow_id}: {isOutside}, Error code: {result[0]}")
 
 
 def sendAlarm():
@@ -88,6 +90,7 @@ def sendAlarm():
     """
     global last_alarm_dic
     setup_logging()
+    publisher.start()  # resend SMS a previous run left unacknowledged without waiting for the next alarm
     try:
         start_mqtt_listener()
         logging.info("Successfully listen to event -> alarm_dictionary")
@@ -115,21 +118,51 @@ def sendAlarm():
     buzzer_on = False  # default -> not ring
     last_time_update = 0
 
+    # alarm events from listen_event: wake on enter/exit instead of copying the dict every second
+    subscription = alarm_store.subscribe()
+    last_alarm_dic = dict(subscription.initial)  # {'cow1': [1,1]}: cows already told "On" by SMS
+    for cow_id, grid in last_alarm_dic.items():
+        alarm_send_sms(cow_id, grid, "On")
+
     while True:
         try:
             current_time = time.time()
 
-            # get_alarm_dictionary() expected payload:{'cow1': [1,1]} or {}
-            with _dict_lock:
-                alarm_dic = alarm_dictionary.copy()  # get the alarm cows info here, need MQTT listen
-            current_alarm_count = len(alarm_dic)  # count how many cows in alarm
-            logging.info(f"(Alarm count: {current_alarm_count})")
+            # buzzer control: the forced-off refresh below decides how long we may wait for an event
+            timeout = None if last_alarm_dic else max(0.0, last_time_update + POOLING_INTERVAL - current_time)
+            event = subscription.get(timeout=timeout)
+
+            if event is not None:
+                # sms control
+                try:
+                    if event.kind == ENTER:
+                        alarm_send_sms(event.key, event.value, "On")
+                        last_alarm_dic[event.key] = event.value
+                    elif event.kind == UPDATE:
+                        last_alarm_dic[event.key] = event.value
+                    elif event.kind == EXIT:
+                        alarm_send_sms(event.key, last_alarm_dic.pop(event.key, event.previous), "Back")
+                    elif event.kind == STALE:
+                        # no news from this cow for ALARM_TTL: not known to be back, say so explicitly
+                        logging.warning(f"Alarm for {event.key} expired without a position update")
+                        alarm_send_sms(event.key, last_alarm_dic.pop(event.key, event.previous), "Stale")
+                    elif event.kind == RESYNC:
+                        # events were dropped: diff against the full state, as the polling loop did
+                        for cow_id, grid in event.value.items():
+                            if cow_id not in last_alarm_dic:
+                                alarm_send_sms(cow_id, grid, "On")
+                        for cow_id, grid in last_alarm_dic.items():
+                            if cow_id not in event.value:
+                                alarm_send_sms(cow_id, grid, "Back")
+                        last_alarm_dic = dict(event.value)
+                except Exception as e:
+                    logging.error(f"SMS handling error: {e}")
+                logging.info(f"(Alarm count: {len(last_alarm_dic)})")
 
             # alarm_dic -> {}
-            if current_alarm_count == 0:
-                # buzzer control
+            if not last_alarm_dic:
                 # force buzzer off
-                logging.info(current_time - last_time_update)
+                current_time = time.time()
                 if current_time - last_time_update >= POOLING_INTERVAL:
                     last_time_update = current_time
                     try:
@@ -147,48 +180,18 @@ def sendAlarm():
                     except ConnectionError as e:
                         logging.error(f"Failed to turn off buzzer: {e}")
 
-                # sms control
-                try:
-                    # sms payload, need to cancel the last alarm one
-                    if last_alarm_dic:
-                        for cow_id, grid in last_alarm_dic.items():
-                            alarm_send_sms(cow_id, grid, "Back")
-                        logging.info("Sent SMS clear for all previously alarmed cows")
-                    last_alarm_dic = {}  # Clear last_alarm_dic after sending
-                except Exception as e:
-                    logging.error(f"Sms clear sent error: {e}")
-
             # alarm_dic -> {'cow1': [1, 1]}
-            elif current_alarm_count != 0:
-
-                # buzzer control
-                if not buzzer_on:
-                    try:
-                        # buzzer.set_on()
-                        logging.info(f"Turn on the buzzer")
-                    except Exception as e:
-                        logging.error(f"Failed to turn on the buzzer: {e}")
-                buzzer_on = True
-
+            elif not buzzer_on:
                 try:
-                    for cow_id, grid in alarm_dic.items():
-                        # sms control
-                        if cow_id not in last_alarm_dic:
-                            alarm_send_sms(cow_id, grid, "On")
-
-                    # Find cleared alarms (cows in last_alarm_dic but not in current alarm_dic)
-                    for cow_id, grid in last_alarm_dic.items():
-                        if cow_id not in alarm_dic:
-                            alarm_send_sms(cow_id, grid, "Back")
-
-                    last_alarm_dic = alarm_dic.copy()
+                    # buzzer.set_on()
+                    logging.info(f"Turn on the buzzer")
                 except Exception as e:
-                    logging.error(f"SMS handling error: {e}")
+                    logging.error(f"Failed to turn on the buzzer: {e}")
+                buzzer_on = True
 
         except Exception as e:
             logging.error(f"Failed in while loop: {e}")
-
-        time.sleep(1)
+            time.sleep(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+"""
+ConfigCache refresh cost: pd.read_sql + iterrows (old) vs lib.db_rows tuples (new).
+Each path runs in a fresh interpreter, so import time and peak RSS are its own.
+Run from code_backend/: python benchmarks/bench_config_refresh.py [n_devices] [db_uri]
+(default: a throwaway SQLite file shaped like the MySQL tables)
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+N_DEVICES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+N_REFRESHES = 20
+
+CONFIG_QUERY = "SELECT config_name, value FROM system_config"
+LCD_QUERY = "SELECT ip, modbus_tcp_port, mute FROM network_infrastracture_list WHERE device_type = 'annunciator'"
+DEVICE_QUERY = "SELECT j_code, label, holder, device_type FROM device_list WHERE j_code IS NOT NULL"
+
+
+def make_sqlite(path, n_devices):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE system_config (config_name TEXT, value TEXT)"))
+        conn.execute(text("CREATE TABLE network_infrastracture_list "
+                          "(ip TEXT, modbus_tcp_port INT, mute INT, device_type TEXT)"))
+        conn.execute(text("CREATE TABLE device_list (j_code TEXT, label TEXT, holder TEXT, device_type TEXT)"))
+        conn.execute(text("INSERT INTO system_config VALUES (:k, :v)"),
+                      [{'k': f'key_{i}', 'v': str(i)} for i in range(20)])
+        conn.execute(text("INSERT INTO network_infrastracture_list VALUES (:ip, 502, 0, 'annunciator')"),
+                      [{'ip': f'192.168.2.{20 + i}'} for i in range(8)])
+        conn.execute(text("INSERT INTO device_list VALUES (:j, :l, :h, :t)"),
+                      [{'j': f'J{i:05d}', 'l': f'Bed {i}', 'h': None if i % 7 == 0 else f'Holder {i}',
+                        't': 'PB' if i % 2 else 'TrackerD'} for i in range(n_devices)])
+    return f'sqlite:///{path}'
+
+
+def refresh_pandas(engine):
+    import pandas as pd
+    df_config = pd.read_sql(CONFIG_QUERY, engine)
+    config = dict(zip(df_config['config_name'], df_config['value']))
+    df_lcd = pd.read_sql(LCD_QUERY, engine)
+    lcd = [{'ip': row['ip'], 'port': int(row['modbus_tcp_port']), 'mute': int(row['mute']) == 0}
+           for _, row in df_lcd.iterrows()]
+    df_device = pd.read_sql(DEVICE_QUERY, engine)
+    devices = {row['j_code']: {'label': row['label'] if pd.notna(row['label']) else 'Unknown',
+                               'holder': row['holder'] if pd.notna(row['holder']) else 'Unknown'}
+               for _, row in df_device.iterrows()}
+    return config, lcd, devices
+
+
+def refresh_rows(engine):
+    from lib import db_rows
+    config = db_rows.fetch_dict(engine, CONFIG_QUERY)
+    lcd = [{'ip': ip, 'port': int(port), 'mute': int(mute) == 0}
+           for ip, port, mute in db_rows.stream(engine, LCD_QUERY)]
+    devices = {j_code: {'label': label if label is not None else 'Unknown',
+                        'holder': holder if holder is not None else 'Unknown'}
+               for j_code, label, holder, _ in db_rows.stream(engine, DEVICE_QUERY)}
+    return config, lcd, devices
+
+
+def worker(path, db_uri):
+    started = time.perf_counter()
+    from sqlalchemy import create_engine
+    refresh = refresh_pandas if path == 'pandas' else refresh_rows
+    engine = create_engine(db_uri)
+    config, lcd, devices = refresh(engine)  # imports pandas (or not) and warms the connection pool
+    first_ms = (time.perf_counter() - started) * 1000
+    times = []
+    for _ in range(N_REFRESHES):
+        t = time.perf_counter()
+        refresh(engine)
+        times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{path:>8} {len(devices):>8} {first_ms:>12.1f} {times[len(times) // 2]:>13.2f} {rss_mb:>12.1f}")
+
+
+def main():
+    if len(sys.argv) > 3 and sys.argv[3] == '--worker':
+        worker(sys.argv[4], sys.argv[2])
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_uri = sys.argv[2] if len(sys.argv) > 2 else make_sqlite(os.path.join(tmp, 'config.db'), N_DEVICES)
+        print(f"{'path':>8} {'devices':>8} {'first ms':>12} {'refresh ms':>13} {'peak RSS MB':>12}")
+        for path in ('pandas', 'rows'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), str(N_DEVICES), db_uri, '--worker', path],
+                           check=True)
+
+
+if __name__ == "__main__":
+    main()
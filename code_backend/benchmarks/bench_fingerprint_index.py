@@ -0,0 +1,82 @@
+"""
+Query latency of the fingerprint index kinds against fingerprint count, and their accuracy
+compared with the current knn_model.pkl.
+Run from code_backend/: python benchmarks/bench_fingerprint_index.py [max_rows]
+"""
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+
+from build_fingerprint_index import load_fingerprints  # noqa: E402
+from lib.fingerprint_index import FingerprintIndex, INDEX_KINDS  # noqa: E402
+
+DB_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+N_SINGLE = 200    # single-cow queries timed one by one
+N_BATCH = 1000    # cows in one batched query
+NOISE_DB = 2.0    # synthetic survey runs: real fingerprints plus gaussian noise
+
+
+def synthetic_db(X, y, n_rows, rng):
+    rows = rng.integers(0, len(X), n_rows)
+    return X[rows] + rng.normal(0, NOISE_DB, (n_rows, X.shape[1])), y[rows]
+
+
+def time_queries(predict, queries):
+    start = time.perf_counter()
+    for q in queries[:N_SINGLE]:
+        predict(q[None, :])
+    single = (time.perf_counter() - start) / N_SINGLE
+    start = time.perf_counter()
+    predict(queries[:N_BATCH])
+    batch = (time.perf_counter() - start) / N_BATCH
+    return single * 1e6, batch * 1e6
+
+
+def latency_table(X, y, n_classes, n_neighbors, max_rows, rng):
+    queries = X[rng.integers(0, len(X), N_BATCH)] + rng.normal(0, NOISE_DB, (N_BATCH, X.shape[1]))
+    print("Query latency in microseconds per cow (single query / inside a batch of 1000)")
+    print(f"{'rows':>10} " + " ".join(f"{name:>22}" for name in ('brute',) + INDEX_KINDS))
+    for n_rows in [n for n in DB_SIZES if n <= max_rows]:
+        db_X, db_y = synthetic_db(X, y, n_rows, rng)
+        cells = []
+        brute = KNeighborsClassifier(n_neighbors=n_neighbors, algorithm='brute').fit(db_X, db_y)
+        cells.append(time_queries(brute.predict, queries))
+        for kind in INDEX_KINDS:
+            index = FingerprintIndex.build(db_X, db_y, n_classes, kind=kind, n_neighbors=n_neighbors)
+            index.save('/tmp/bench_fingerprint_index.pkl')
+            index = FingerprintIndex.load('/tmp/bench_fingerprint_index.pkl')
+            cells.append(time_queries(index.predict, queries))
+        print(f"{n_rows:>10} " + " ".join(f"{s:>10.1f} / {b:>9.2f}" for s, b in cells))
+    os.remove('/tmp/bench_fingerprint_index.pkl')
+
+
+def accuracy_table(X, y, n_classes, n_neighbors):
+    model = joblib.load('model/weight/knn_model.pkl')
+    X_eval, y_eval, _, _ = load_fingerprints('dataset/fingerprint_dataset.csv')
+    reference = model.predict(X_eval)
+    print(f"\nAccuracy on dataset/fingerprint_dataset.csv ({len(X_eval)} rows), index built from knn_model.pkl")
+    print(f"{'model':>12} {'accuracy':>9} {'agrees w/ knn_model':>20}")
+    print(f"{'knn_model':>12} {(reference == y_eval).mean():>9.4f} {1.0:>20.4f}")
+    for kind in INDEX_KINDS:
+        pred = FingerprintIndex.build(X, y, n_classes, kind=kind, n_neighbors=n_neighbors).predict(X_eval)
+        print(f"{kind:>12} {(pred == y_eval).mean():>9.4f} {(pred == reference).mean():>20.4f}")
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else DB_SIZES[-1]
+    rng = np.random.default_rng(0)
+    X, y, n_classes, n_neighbors = load_fingerprints('knn')
+    latency_table(X, y, n_classes, n_neighbors, max_rows, rng)
+    accuracy_table(X, y, n_classes, n_neighbors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Modbus transactions and wall time per annunciator frame:
+  per-call   switch_page + write_line x2 (+ title/time), every register sent each time (as before)
+  shadow     the same calls, diffed against the shadow registers
+  frame      one write_frame() per screen
+Against a simulated device that answers each request after RTT_MS, or a real one.
+Run from code_backend/: python benchmarks/bench_lcd_frame.py [rtt_ms] [ip port]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.TwoLineLCD_ModbusTCP import LCDDisplayModbus  # noqa: E402
+
+RTT_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+N_TICKS = 60
+RED = LCDDisplayModbus.DISPLAY_RED
+
+
+class SimulatedClient:
+    """Holds the registers and sleeps one RTT per request, like pyModbusTCP's blocking calls."""
+
+    def __init__(self, rtt_ms):
+        self.rtt = rtt_ms / 1000.0
+        self.is_open = False
+        self.unit_id = 1
+        self.registers = {}
+
+    def open(self):
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def write_single_register(self, address, value):
+        return self.write_multiple_registers(address, [value])
+
+    def write_multiple_registers(self, address, values):
+        time.sleep(self.rtt)
+        self.registers.update(zip(range(address, address + len(values)), values))
+        return True
+
+
+def make_client():
+    if len(sys.argv) > 3:
+        from pyModbusTCP.client import ModbusClient
+        return ModbusClient(host=sys.argv[2], port=int(sys.argv[3]), timeout=3)
+    return SimulatedClient(RTT_MS)
+
+
+def scenarios():
+    """name -> list of frames; a frame is (mode, line1, line2, color)."""
+    scroll = [('alarm', f"{i}. Bed {i}", f"Ward {'AB'[i % 2]}", RED) for i in range(1, 4)] * (N_TICKS // 3)
+    return {
+        'alarm scroll': scroll,
+        'same alarm': [('alarm', '1. Bed 1', 'Ward A', RED)] * N_TICKS,
+        'clock tick': [('clock', '', '', RED)] * N_TICKS,
+        'alarm/clear': [('alarm', '1. Bed 1', 'Ward A', RED), ('blank', '', '', RED)] * (N_TICKS // 2),
+    }
+
+
+def render_calls(lcd, frame):
+    mode, line1, line2, color = frame
+    if mode == 'clock':
+        lcd.switch_page(0)
+        lcd.set_title('Ramsay Health')
+        lcd.set_current_time()
+    elif mode == 'alarm':
+        lcd.switch_page(1)
+        lcd.write_line(1, line1.ljust(16), color)
+        lcd.write_line(2, line2.ljust(16), color)
+    else:
+        lcd.switch_page(1)
+        lcd.write_line(1, " " * 16, RED)
+        lcd.write_line(2, " " * 16, RED)
+        lcd.switch_page(0)
+
+
+def render_per_call(lcd, frame):
+    # 每次调用前清空影子寄存器 = 旧实现：每次都发送全部寄存器
+    real_write = lcd._write
+
+    def write_all(desired, what):
+        lcd.invalidate()
+        real_write(desired, what)
+    lcd._write = write_all
+    try:
+        render_calls(lcd, frame)
+    finally:
+        lcd._write = real_write
+
+
+def render_frame(lcd, frame):
+    mode, line1, line2, color = frame
+    if mode == 'clock':
+        lcd.write_frame(page=0, title='Ramsay Health', clock=True)
+    elif mode == 'alarm':
+        lcd.write_frame(page=1, line1=line1, line2=line2, colors=(color, color))
+    else:
+        lcd.write_frame(page=0, line1='', line2='', colors=(RED, RED))
+
+
+def main():
+    print(f"{N_TICKS} frames per scenario, " +
+          (f"device {sys.argv[2]}:{sys.argv[3]}" if len(sys.argv) > 3 else f"simulated RTT {RTT_MS:.1f} ms"))
+    print(f"{'scenario':>14} {'path':>9} {'requests/frame':>15} {'ms/frame':>9}")
+    for name, frames in scenarios().items():
+        for path, render in [('per-call', render_per_call), ('shadow', render_calls), ('frame', render_frame)]:
+            lcd = LCDDisplayModbus(make_client())
+            start = time.perf_counter()
+            for frame in frames:
+                render(lcd, frame)
+            elapsed = (time.perf_counter() - start) * 1000
+            lcd.close()
+            print(f"{name:>14} {path:>9} {lcd.transactions / len(frames):>15.2f} {elapsed / len(frames):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput of the batched KNN path against the original per-cow path.
+Run from code_backend/: python benchmarks/bench_predict_batch.py
+"""
+import os
+import sys
+import time
+from collections import Counter, defaultdict, deque
+
+import joblib
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+
+import predict_and_publish as pp  # noqa: E402
+
+HERD_SIZES = [10, 100, 1000, 10000]
+MISSING_RATE = 0.1
+REPEAT = 3
+
+# the original module-level artifacts used by the per-cow path
+model = joblib.load('model/weight/knn_model.pkl')
+grid_encoder = joblib.load('model/weight/grid_label_encoder.pkl')
+label_map = joblib.load('model/weight/grid_to_label_mapping.pkl')
+col_mean_map = joblib.load('model/weight/global_column_means.pkl')
+grid_mean_map = joblib.load('model/weight/grid_mean_map.pkl')
+per_cow_history = defaultdict(lambda: deque(maxlen=pp.GRID_HISTORY_LEN))
+
+
+def make_message(n_cows, rng):
+    fingerprints = pd.read_csv('dataset/fingerprint_dataset.csv')[pp.rssi_cols].to_numpy(dtype=float)
+    rows = fingerprints[rng.integers(0, len(fingerprints), n_cows)]
+    rows[rng.random(rows.shape) < MISSING_RATE] = np.nan
+    return {f"cow{i}": [None if np.isnan(v) else float(v) for v in row] for i, row in enumerate(rows)}
+
+
+def predict_per_cow(input_data):
+    """The original one-Series-per-cow implementation, kept here as the baseline."""
+    payload = {}
+    for cow_id, rssi_vector in input_data.items():
+        rssi_series = pd.Series(rssi_vector, index=pp.rssi_cols, dtype=float)
+        if rssi_series.isna().any():
+            history = per_cow_history[cow_id]
+            fallback_grid = Counter(history).most_common(1)[0][0] if history else None
+            for col in rssi_series.index:
+                if pd.isna(rssi_series[col]):
+                    if fallback_grid and fallback_grid in grid_mean_map.index:
+                        rssi_series[col] = grid_mean_map.at[fallback_grid, col]
+                    else:
+                        rssi_series[col] = col_mean_map.get(col, pp.SPECIAL_FILL_VALUE)
+        pred_grid_encoded = model.predict(rssi_series.values.reshape(1, -1))[0]
+        pred_grid = grid_encoder.inverse_transform([pred_grid_encoded])[0]
+        is_out = 1 if label_map.get(pred_grid) == 'out' else 0
+        per_cow_history[cow_id].append(pred_grid)
+        grid_x, grid_y = map(int, pred_grid.split('_'))
+        payload[cow_id] = [grid_x, grid_y, is_out]
+    return payload
+
+
+def best_of(fn, message):
+    best = float('inf')
+    for _ in range(REPEAT):
+        per_cow_history.clear()
+        pp.cow_grid_history.clear()
+        start = time.perf_counter()
+        fn(message)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    pp.get_positioning()
+    print(f"{'cows/msg':>10} {'per-cow cows/s':>16} {'batch cows/s':>14} {'speedup':>9}")
+    for n_cows in HERD_SIZES:
+        message = make_message(n_cows, rng)
+        t_single = best_of(predict_per_cow, message)
+        t_batch = best_of(pp.predict_batch, message)
+        print(f"{n_cows:>10} {n_cows / t_single:>16.0f} {n_cows / t_batch:>14.0f} {t_single / t_batch:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Publish latency seen by predict_and_publish: connect-per-message vs the publisher's queue (the
+caller only pays for the enqueue; the flusher thread does the network I/O).
+Run from code_backend/: python benchmarks/bench_publish_latency.py [broker] [port]
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import publisher  # noqa: E402
+
+BROKER = sys.argv[1] if len(sys.argv) > 1 else '10.166.179.5'
+PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+TOPIC = "/modelPublish/bench"
+N_MESSAGES = 500
+N_COWS = 100
+
+
+def connect_per_message(message):
+    client = mqtt.Client()
+    client.connect(BROKER, PORT, keepalive=60)
+    client.publish(TOPIC, message)
+    client.disconnect()
+
+
+def queued(message):
+    publisher.push_message(BROKER, PORT, None, None, TOPIC, message)
+
+
+def measure(fn, message):
+    latencies = np.empty(N_MESSAGES)
+    for i in range(N_MESSAGES):
+        start = time.perf_counter()
+        fn(message)
+        latencies[i] = time.perf_counter() - start
+    return latencies * 1000
+
+
+def main():
+    message = json.dumps({f"cow{i}": [i % 16, i % 8, 0] for i in range(N_COWS)})
+    publisher.liblog.disabled = True
+    queued(message)  # open the pooled connection outside the measurement
+    publisher.flush()
+
+    print(f"{N_MESSAGES} messages of {len(message)} bytes to {BROKER}:{PORT}")
+    print(f"{'path':>20} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, fn in [("connect-per-message", connect_per_message), ("queued publish", queued)]:
+        latencies = measure(fn, message)
+        publisher.flush()
+        print(f"{name:>20} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+GridSmoother on the shipped grid layout: checks that an isolated one-reading jump to any
+neighbouring grid is suppressed and that a real move is followed within a few readings, then
+measures is_out flips and step time on simulated boundary jitter.
+Run from code_backend/: python benchmarks/bench_smoothing.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
+
+import predict_and_publish as pp  # noqa: E402
+from lib.smoothing import GridSmoother, adjacency  # noqa: E402
+
+MAX_READINGS_TO_MOVE = 4
+N_COWS = 2000
+N_STEPS = 200
+JITTER = 0.15  # share of readings reported in a neighbouring grid
+
+
+def check_isolated_jumps(grid_xy):
+    """Every (grid, neighbour) pair: 5 readings in grid, 1 in neighbour, 1 in grid -> never published."""
+    adj = adjacency(grid_xy)
+    assert adj.any(axis=1).all(), "grid without neighbours"
+    pairs = np.argwhere(adj)
+    smoother = GridSmoother(grid_xy, pp.SMOOTH_STAY_PROB, pp.SMOOTH_HIT_PROB)
+    rows = np.arange(len(pairs))
+    home, jump = pairs[:, 0], pairs[:, 1]
+    for _ in range(5):
+        smoother.step(rows, home)
+    jumped = smoother.step(rows, jump)
+    back = smoother.step(rows, home)
+    leaked = (jumped != home) | (back != home)
+    assert not leaked.any(), f"isolated jumps published: {[tuple(grid_xy[i]) for i in home[leaked]]}"
+
+    smoother.clear()
+    for _ in range(5):
+        smoother.step(rows, home)
+    needed = np.zeros(len(pairs), dtype=np.int64)  # readings in the neighbour before the cow is moved
+    for k in range(1, MAX_READINGS_TO_MOVE + 1):
+        moved = smoother.step(rows, jump)
+        needed[(needed == 0) & (moved == jump)] = k
+    assert (needed > 0).all(), f"moves not followed within {MAX_READINGS_TO_MOVE} readings"
+    print(f"isolated jumps suppressed on all {len(pairs)} neighbour pairs; "
+          f"readings needed to follow a move: {dict(zip(*(a.tolist() for a in np.unique(needed, return_counts=True))))}")
+
+
+def jitter(grid_xy, grid_is_out):
+    adj = adjacency(grid_xy)
+    rng = np.random.default_rng(0)
+    # cows sitting in a grid that touches a grid on the other side of the fence
+    boundary = np.flatnonzero([(grid_is_out[adj[g]] != grid_is_out[g]).any() for g in range(len(adj))])
+    truth = rng.choice(boundary, N_COWS)
+    smoother = GridSmoother(grid_xy, pp.SMOOTH_STAY_PROB, pp.SMOOTH_HIT_PROB)
+    rows = np.arange(N_COWS)
+    raw_flips = smooth_flips = wrong = 0
+    last_raw = last_smooth = grid_is_out[truth]
+    elapsed = 0.0
+    for _ in range(N_STEPS):
+        codes = truth.copy()
+        noisy = rng.random(N_COWS) < JITTER
+        codes[noisy] = [rng.choice(np.flatnonzero(adj[g])) for g in truth[noisy]]
+        started = time.perf_counter()
+        smoothed = smoother.step(rows, codes)
+        elapsed += time.perf_counter() - started
+        raw_flips += int((grid_is_out[codes] != last_raw).sum())
+        smooth_flips += int((grid_is_out[smoothed] != last_smooth).sum())
+        wrong += int((smoothed != truth).sum())
+        last_raw, last_smooth = grid_is_out[codes], grid_is_out[smoothed]
+    print(f"{N_COWS} boundary cows x {N_STEPS} steps, {JITTER:.0%} jitter: is_out flips raw {raw_flips}, "
+          f"smoothed {smooth_flips}; smoothed grid wrong {wrong / (N_COWS * N_STEPS):.2%}; "
+          f"{elapsed / N_STEPS * 1000:.2f} ms/step")
+
+
+def main():
+    positioning = pp.get_positioning()
+    grid_xy = np.asarray(positioning.grid_xy)
+    grid_is_out = np.asarray(positioning.grid_is_out)
+    check_isolated_jumps(grid_xy)
+    jitter(grid_xy, grid_is_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Encode / decode cost and size of /BLEPublish and /modelPublish payloads: JSON vs lib.wire binary frames.
+Run from code_backend/: python benchmarks/bench_wire_format.py [n_cows]
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.wire import KIND_POSITION, KIND_RSSI, WireDecoder, WireEncoder  # noqa: E402
+
+N_COWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+N_ROUNDS = 200
+
+
+def make_payloads(rng):
+    cows = [f"cow{i}" for i in range(N_COWS)]
+    rssi = rng.integers(-100, -40, size=(N_COWS, 6)).astype(float)
+    rssi[rng.random((N_COWS, 6)) < 0.05] = np.nan
+    rssi_payload = {c: [None if np.isnan(v) else float(v) for v in row] for c, row in zip(cows, rssi)}
+    xy = rng.integers(0, 16, size=(N_COWS, 2))
+    position_payload = {c: [int(x), int(y), int(x > 12)] for c, (x, y) in zip(cows, xy)}
+    return rssi_payload, position_payload
+
+
+def per_call_us(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(N_ROUNDS):
+        fn()
+    return (time.perf_counter() - start) / N_ROUNDS * 1e6
+
+
+def compare(name, kind, payload):
+    message = json.dumps(payload)
+    encoder = WireEncoder(kind)
+    dictionary, frame = encoder.encode(payload)
+    decoder = WireDecoder()
+    decoder.decode(dictionary)
+
+    rows = [
+        ('json', per_call_us(lambda: json.dumps(payload)), per_call_us(lambda: json.loads(message)),
+         len(message)),
+        ('binary', per_call_us(lambda: encoder.encode(payload)), per_call_us(lambda: decoder.decode(frame)),
+         len(frame)),
+        ('binary records', float('nan'), per_call_us(lambda: decoder.records(frame)), len(frame)),
+    ]
+    print(f"\n{name}, {N_COWS} cows (dictionary frame {len(dictionary)} bytes, sent once)")
+    print(f"{'format':<16}{'encode us':>12}{'decode us':>12}{'bytes':>10}")
+    for fmt, enc, dec, size in rows:
+        print(f"{fmt:<16}{enc:>12.1f}{dec:>12.1f}{size:>10}")
+
+
+def main():
+    rssi_payload, position_payload = make_payloads(np.random.default_rng(0))
+    compare("/BLEPublish RSSI", KIND_RSSI, rssi_payload)
+    compare("/modelPublish positions", KIND_POSITION, position_payload)
+    print("\n'binary records' is the zero-copy numpy.frombuffer view, before building the {cow_id: ...} dict")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Pack model artifacts into single memory-mappable bundles (see lib/artifacts.py)
+
+python build_artifact_bundle.py                                # every bundle
+python build_artifact_bundle.py positioning --version 2025.08  # model/weight/positioning.bundle only
+
+positioning  model/weight/*.pkl (+ fingerprint_index.pkl if built)  -> model/weight/positioning.bundle
+imu          IMU/weights/best_imu_net.pt, scaler.pkl, label_encoder.pkl -> IMU/weights/imu_net.bundle
+imu_2        IMU_2/imu_model.pt                                      -> IMU_2/imu_model.bundle
+
+Services pick a bundle up automatically when it exists and fall back to the original files otherwise.
+Rebuild the bundle whenever the source artifacts are retrained.
+"""
+import argparse
+import os
+import time
+
+import joblib
+
+from lib.artifacts import write_bundle
+from lib.positioning import PositioningModel
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGETS = ('positioning', 'imu', 'imu_2')
+
+
+def build_positioning(version):
+    import predict_and_publish
+
+    positioning = PositioningModel.from_pickles(predict_and_publish.WEIGHT_DIR, predict_and_publish.rssi_cols,
+                                                predict_and_publish.SPECIAL_FILL_VALUE)
+    return predict_and_publish.BUNDLE_PATH, positioning.write_bundle(predict_and_publish.BUNDLE_PATH, version)
+
+
+def _state_dict_arrays(path, prefix=''):
+    import torch
+
+    state = torch.load(path, map_location='cpu')
+    return {prefix + name: tensor.detach().cpu().numpy() for name, tensor in state.items()}
+
+
+def build_imu(version):
+    weights = os.path.join(BASE_DIR, 'IMU', 'weights')
+    scaler = joblib.load(os.path.join(weights, 'scaler.pkl'))
+    le = joblib.load(os.path.join(weights, 'label_encoder.pkl'))
+    arrays = _state_dict_arrays(os.path.join(weights, 'best_imu_net.pt'), prefix='model/')
+    arrays.update({'scaler/mean': scaler.mean_, 'scaler/scale': scaler.scale_})
+    path = os.path.join(weights, 'imu_net.bundle')
+    return path, write_bundle(path, arrays, {'classes': [str(c) for c in le.classes_]}, version=version)
+
+
+def build_imu_2(version):
+    arrays = _state_dict_arrays(os.path.join(BASE_DIR, 'IMU_2', 'imu_model.pt'))
+    path = os.path.join(BASE_DIR, 'IMU_2', 'imu_model.bundle')
+    return path, write_bundle(path, arrays, version=version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack model artifacts into memory-mappable bundles")
+    parser.add_argument('targets', nargs='*', help=f"any of {', '.join(TARGETS)} (default: all)")
+    parser.add_argument('--version', default=time.strftime('%Y.%m.%d'))
+    args = parser.parse_args()
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    builders = {'positioning': build_positioning, 'imu': build_imu, 'imu_2': build_imu_2}
+    for target in args.targets or TARGETS:
+        path, manifest = builders[target](args.version)
+        print(f"{target}: {path} version={manifest['version']} "
+              f"arrays={len(manifest['arrays'])} hash={manifest['content_hash'][:12]}")
+
+
+if __name__ == "__main__":
+    main()
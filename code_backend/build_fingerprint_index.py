@@ -0,0 +1,84 @@
+"""
+Offline step: turn the RSSI fingerprint set into a prebuilt index for predict_and_publish.py
+
+python build_fingerprint_index.py                          # KD-tree over the fingerprints of knn_model.pkl
+python build_fingerprint_index.py --kind ball_tree
+python build_fingerprint_index.py --kind ivf --n-probe 8   # quantized, approximate
+python build_fingerprint_index.py --source dataset/fingerprint_dataset.csv
+"""
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from lib.fingerprint_index import FingerprintIndex, INDEX_KINDS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHT_DIR = os.path.join(BASE_DIR, 'model', 'weight')
+INDEX_PATH = os.path.join(WEIGHT_DIR, 'fingerprint_index.pkl')
+
+rssi_cols = ['RSSI_0_0', 'RSSI_0_8', 'RSSI_8_0', 'RSSI_8_8', 'RSSI_16_0', 'RSSI_16_8']
+RECALL_SAMPLE = 2000
+
+
+def load_fingerprints(source):
+    """
+    source: 'knn' for the fingerprints stored inside knn_model.pkl, or a survey CSV with
+    Grid,Label,RSSI_... columns (as produced from dataSampling.py runs).
+    return: X (n, 6) float, y (n,) encoded grid, n_classes, n_neighbors
+    """
+    model = joblib.load(os.path.join(WEIGHT_DIR, 'knn_model.pkl'))
+    grid_encoder = joblib.load(os.path.join(WEIGHT_DIR, 'grid_label_encoder.pkl'))
+    n_classes = len(grid_encoder.classes_)
+    if source == 'knn':
+        return np.asarray(model._fit_X), np.asarray(model._y), n_classes, model.n_neighbors
+
+    df = pd.read_csv(source)
+    df = df[df['Grid'].isin(grid_encoder.classes_)]
+    grid_mean_map = joblib.load(os.path.join(WEIGHT_DIR, 'grid_mean_map.pkl'))
+    col_mean_map = joblib.load(os.path.join(WEIGHT_DIR, 'global_column_means.pkl'))
+    X = df[rssi_cols].to_numpy(dtype=float)
+    fill = grid_mean_map.reindex(index=df['Grid'], columns=rssi_cols).to_numpy(dtype=float)
+    fill = np.where(np.isnan(fill), [col_mean_map[c] for c in rssi_cols], fill)
+    X = np.where(np.isnan(X), fill, X)
+    return X, grid_encoder.transform(df['Grid']), n_classes, model.n_neighbors
+
+
+def report_recall(index, X, n_neighbors):
+    """Share of the exact k nearest neighbours the approximate index also returns."""
+    from sklearn.neighbors import KDTree
+
+    sample = X[np.random.default_rng(0).choice(len(X), min(RECALL_SAMPLE, len(X)), replace=False)]
+    exact = KDTree(X).query(sample, k=n_neighbors, return_distance=False)
+    # ivf keeps its rows in bucket order, compare by fingerprint values instead of row ids
+    approx_rows = np.asarray(index.codes)[index.kneighbors(sample)]
+    exact_rows = np.clip(np.rint(X[exact]), -128, 127).astype(np.int8)
+    hits = (approx_rows[:, :, None, :] == exact_rows[:, None, :, :]).all(axis=3).any(axis=2)
+    print(f"recall@{n_neighbors} on {len(sample)} fingerprints: {hits.mean():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the fingerprint index used by predict_and_publish.py")
+    parser.add_argument('--kind', choices=INDEX_KINDS, default='kd_tree')
+    parser.add_argument('--source', default='knn', help="'knn' (default) or a fingerprint CSV path")
+    parser.add_argument('--leaf-size', type=int, default=30)
+    parser.add_argument('--n-lists', type=int, default=None, help="ivf buckets, default sqrt(n)")
+    parser.add_argument('--n-probe', type=int, default=8, help="ivf buckets scanned per query")
+    parser.add_argument('--out', default=INDEX_PATH)
+    args = parser.parse_args()
+
+    X, y, n_classes, n_neighbors = load_fingerprints(args.source)
+    index = FingerprintIndex.build(X, y, n_classes, kind=args.kind, n_neighbors=n_neighbors,
+                                   leaf_size=args.leaf_size, n_lists=args.n_lists, n_probe=args.n_probe)
+    print(f"Built {args.kind} index over {len(index)} fingerprints ({n_classes} grids, k={n_neighbors})")
+    if args.kind == 'ivf':
+        report_recall(index, X, n_neighbors)
+
+    index.save(args.out)
+    print(f"Saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ def main(topic, payload):
     Payload:
         {"cow_id": "cow1", "grid": "[-3, 12]", "isOutside": "On"}
         {"cow_id": "cow1", "grid": "[-3, 12]", "isOutside": "Back"}
+        {"cow_id": "cow1", "grid": "[-3, 12]", "isOutside": "Stale"}  # no position update since the alarm
     """
 
     logger.info(f"Received message on topic {topic}: {payload}")
@@ -34,9 +35,14 @@ def main(topic, payload):
 
     cow_id = data.get("cow_id", "Unknown Cow")
     isOutside = data.get("isOutside", "Unknown isOutside")
-    if isOutside == "On":
-        isOutside = "Outside the fence"
-    content = f"the {cow_id} now is {isOutside}"
+    if isOutside == "Stale":
+        # the alarm expired without the cow being seen again: it is not known to be back inside
+        grid = data.get("grid", "unknown grid")
+        content = f"the {cow_id} has not been located for a while, last seen outside the fence at {grid}"
+    else:
+        if isOutside == "On":
+            isOutside = "Outside the fence"
+        content = f"the {cow_id} now is {isOutside}"
     phone_number_list = ['0402386294', '0403290319', '0401602408', '0466615511', '0450063062']
     # phone_number_list = ['0402386294']
     for phone_number in phone_number_list:
@@ -1,17 +1,23 @@
 import threading
 import time
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
 from sqlalchemy import create_engine
-import pandas as pd
 import json
 import atexit
-from pyModbusTCP.client import ModbusClient
 
+from lib import db_rows
+from lib import metrics
 from lib import publisher
 from lib import listen_event
 from lib import logger
 from lib.TwoLineLCD_ModbusTCP import LCDDisplayModbus
-from lib.buzzer_modbusTCP import BuzzerModbus
+from lib.annunciator import ALARM, BLANK, CLOCK, AnnunciatorSet, DisplayState
+from lib.device_registry import DeviceRegistry
+from lib.modbus_sessions import ModbusSessions
+from lib.table_watch import TableWatcher, checksum_marker, updated_at_marker, version_table_marker
 from datetime import datetime
+from lib.metrics import LATENCY_MS_BUCKETS
 
 log_info, log_error, log_debug = logger.log_info, logger.log_error, logger.log_debug
 
@@ -22,26 +28,75 @@ engine = create_engine(DB_URI, echo=False, pool_size=5, max_overflow=10, pool_ti
 LCD_SLAVE_ID = 1
 BUZZER_SLAVE_ID = 2
 
+CLOCK_REFRESH_INTERVAL = 10  # 时间页面（标题+时间）刷新间隔，同时强制关闭已启用的 buzzer
+RECOVER_INTERVAL = 60  # 离线设备重连的最长退避间隔（秒）
+
 DATABASE_BROKER = '192.168.2.2'
 DATABASE_PORT = 1883
 USERNAME = ''
 PASSWORD = ''
 TOPIC = "jassi/sms"
 
+METRICS_PORT = 9102  # Prometheus text at http://127.0.0.1:9102/metrics, None to disable
+
+lcd_loop_hist = metrics.histogram('lcd_loop_ms', LATENCY_MS_BUCKETS, 'One pass of the LCD/buzzer loop')
+sms_queued_total = metrics.counter('sms_queued_total', 'SMS alarms and clears queued on TOPIC')
+
+# ConfigCache 增量刷新（lib/table_watch.py）：先查版本标记，标记没变就不读表，变了只取变化的行
+# 'checksum'：CHECKSUM TABLE，无需改表结构
+# 'updated_at'：三张表都有 updated_at 列时使用，只读取新修改的行
+# 'version_table'：由触发器维护的 config_version(table_name, version) 表
+CONFIG_CHANGE_MARKER = 'checksum'
+
+# table -> (SELECT ... FROM table, WHERE 条件或 None, 主键列)；updated_at 标记使用同样的条件
+CONFIG_QUERIES = {
+    'system_config': ("SELECT config_name, value FROM system_config", None, 0),
+    'network_infrastracture_list': ("SELECT ip, modbus_tcp_port, mute FROM network_infrastracture_list",
+                                    "device_type = 'annunciator'", (0, 1)),
+    'device_list': ("SELECT j_code, label, holder, device_type FROM device_list", "j_code IS NOT NULL", 0),
+}
+
+
+def make_table_watcher(table):
+    select, where, key = CONFIG_QUERIES[table]
+    query = f"{select} WHERE {where}" if where else select
+    since_query = None
+    if CONFIG_CHANGE_MARKER == 'updated_at':
+        marker = updated_at_marker(table, where=where)
+        since_query = query + (" AND" if where else " WHERE") + " updated_at >= :since"
+    elif CONFIG_CHANGE_MARKER == 'version_table':
+        marker = version_table_marker(table)
+    else:
+        marker = checksum_marker(table)
+    return TableWatcher(engine, table, query, key=key, marker=marker, since_query=since_query)
+
+
 alarm_duration = {}
 sent_sms_flags = {}
 
 pre_title = "None"
 
+class ConfigSnapshot(NamedTuple):
+    """某一时刻的完整配置，发布后不再修改；读者拿到引用即可，无需加锁"""
+    config: Mapping            # config_name -> 值（只读）
+    lcd_devices: tuple         # ({'ip', 'port', 'mute'} 只读映射, ...)
+    devices: DeviceRegistry    # j_code / label 索引，发布后不再改动
+    version: int
+    updated_at: float          # time.time()，0 表示还没从数据库加载过
+
+
 class ConfigCache:
+    """
+    写时复制：刷新线程在锁外查库，基于旧快照构建新的 ConfigSnapshot，然后一次赋值替换引用。
+    读者只读取当前引用，从不等待数据库 I/O，也不会自己触发刷新。
+    """
     _instance = None
-    _lock = threading.Lock()
-    _config = None
-    _lcd_devices = None
-    _device_info = {}  # 存储 j_code -> {"label": ..., "holder": ...}
-    _device_changed = False  # 标记 device_info 是否变更
-    _last_update = 0
+    _refresh_lock = threading.Lock()  # 只串行化刷新者，读者不使用
+    _loaded = threading.Event()  # 第一次刷新（无论成败）完成后置位
+    _snapshot = None
     _update_interval = 10
+    _watchers = None  # table -> TableWatcher
+    _listeners = []  # fn(table, upserts, removals)，只通知变化的 key
     _default_config = {
         'lcd_display_in_green_time': 30,
         'lcd_display_in_yellow_time': 60,
@@ -66,130 +121,135 @@ class ConfigCache:
             cls._update()
             time.sleep(cls._update_interval)
 
+    @classmethod
+    def add_listener(cls, fn):
+        """fn(table, upserts, removals) 在刷新发现变化后调用：upserts 为 {key: 行}，removals 为被删除的 key 列表"""
+        cls._listeners.append(fn)
+
+    @classmethod
+    def _build_config(cls, config_dict):
+        new_config = {}
+        for key, default in cls._default_config.items():
+            value = config_dict.get(key, default)
+            if key in ['sms_destination_pb', 'sms_destination_tracker']:
+                if isinstance(value, str) and value:
+                    new_config[key] = tuple(num.strip() for num in value.split('-'))
+                else:
+                    new_config[key] = (str(default),)
+            elif key == 'lcd_static_title':
+                new_config[key] = value
+            else:
+                new_config[key] = float(value) if value is not None else float(default)
+        return MappingProxyType(new_config)
+
+    @classmethod
+    def snapshot(cls) -> ConfigSnapshot:
+        """当前快照；数据库还没加载成功时为默认配置、无设备"""
+        snap = cls._snapshot
+        if snap is None:
+            snap = cls._snapshot = ConfigSnapshot(cls._build_config({}), (), DeviceRegistry(), 0, 0)
+        return snap
+
+    @classmethod
+    def wait_loaded(cls, timeout=None):
+        """启动时等待第一次刷新完成（成功或失败），返回是否已完成"""
+        cls.get_instance()
+        return cls._loaded.wait(timeout)
+
     @classmethod
     def _update(cls):
-        with cls._lock:
+        changes = []
+        with cls._refresh_lock:
+            old = cls.snapshot()
+            config, lcd_devices, devices = old.config, old.lcd_devices, old.devices
             try:
+                if cls._watchers is None:
+                    cls._watchers = {table: make_table_watcher(table) for table in CONFIG_QUERIES}
+
                 # 更新 system_config
-                sql_query = "SELECT config_name, value FROM system_config;"
-                df_config = pd.read_sql(sql_query, engine)
-                config_dict = dict(zip(df_config['config_name'], df_config['value']))
-                new_config = {}
-                for key, default in cls._default_config.items():
-                    value = config_dict.get(key, default)
-                    if key in ['sms_destination_pb', 'sms_destination_tracker']:
-                        if isinstance(value, str) and value:
-                            new_config[key] = [num.strip() for num in value.split('-')]
-                        else:
-                            new_config[key] = [str(default)]
-                    elif key == 'lcd_static_title':
-                        new_config[key] = value
-                    else:
-                        new_config[key] = float(value) if value is not None else float(default)
+                watcher = cls._watchers['system_config']
+                upserts, removals = watcher.poll()
+                if upserts or removals:
+                    changes.append(('system_config', upserts, removals))
+                    new_config = cls._build_config(dict(watcher.rows.values()))
+                    if new_config != config:
+                        config = new_config
+                        log_info("forward_msg_to_lcd", f"Updated config: {dict(config)}")
 
                 # 更新 lcd_devices
-                sql_query_lcd = """
-                    SELECT ip, modbus_tcp_port, mute 
-                    FROM network_infrastracture_list 
-                    WHERE device_type = 'annunciator';
-                """
-                df_lcd = pd.read_sql(sql_query_lcd, engine)
-                new_lcd_devices = []
-                for _, row in df_lcd.iterrows():
-                    new_lcd_devices.append({
-                        'ip': row['ip'],
-                        'port': int(row['modbus_tcp_port']),
-                        'mute': int(row['mute']) == 0
-                    })
-
-                # 更新 device_info（假设 LoRaWAN 设备的表名为 device_list，包含 devEui, label, holder）
-                sql_query_device = """
-                    SELECT j_code, label, holder 
-                    FROM device_list 
-                    WHERE j_code IS NOT NULL;
-                """
-                df_device = pd.read_sql(sql_query_device, engine)
-                new_device_info = {
-                    row['j_code']: {
-                        'label': row['label'] if pd.notna(row['label']) else 'Unknown',
-                        'holder': row['holder'] if pd.notna(row['holder']) else 'Unknown'
-                    } for _, row in df_device.iterrows()
-                }
-
-                # 检查是否变更
-                if cls._lcd_devices != new_lcd_devices:
-                    cls._lcd_devices = new_lcd_devices
-                    cls._device_changed = True
-                    log_info("forward_msg_to_lcd", f"LCD devices changed: {cls._lcd_devices}")
-                if cls._config != new_config:
-                    cls._config = new_config
-                    log_info("forward_msg_to_lcd", f"Updated config: {cls._config}")
-                if cls._device_info != new_device_info:
-                    cls._device_info = new_device_info
-                    cls._device_changed = True
-                    log_info("forward_msg_to_lcd", f"Updated device_info: {cls._device_info}")
-                cls._last_update = time.time()
+                watcher = cls._watchers['network_infrastracture_list']
+                upserts, removals = watcher.poll()
+                if upserts or removals:
+                    changes.append(('network_infrastracture_list', upserts, removals))
+                    new_lcd_devices = tuple(MappingProxyType({
+                        'ip': ip,
+                        'port': int(port),
+                        'mute': int(mute) == 0
+                    }) for ip, port, mute in watcher.rows.values())
+                    if new_lcd_devices != lcd_devices:
+                        lcd_devices = new_lcd_devices
+                        log_info("forward_msg_to_lcd", f"LCD devices changed: {[dict(d) for d in lcd_devices]}")
+
+                # 更新 device_info（假设 LoRaWAN 设备的表名为 device_list，包含 devEui, label, holder），只改动有变化的设备
+                watcher = cls._watchers['device_list']
+                upserts, removals = watcher.poll()
+                if upserts or removals:
+                    changes.append(('device_list', upserts, removals))
+                    new_devices = devices.copy()  # 旧快照里的索引可能正被读者使用，改副本
+                    changed = new_devices.apply({j_code: row[1:] for j_code, row in upserts.items()}, removals)
+                    if changed:
+                        devices = new_devices
+                        log_info("forward_msg_to_lcd",
+                                 f"Updated device_info: {changed} device(s) changed, {len(devices)} in total")
+
+                # 一次赋值发布新快照
+                cls._snapshot = ConfigSnapshot(config, lcd_devices, devices, old.version + (1 if changes else 0),
+                                               time.time())
             except Exception as e:
+                # 本轮已读到但没发布的变化撤销掉，下次刷新重新报告
+                for table, _, _ in changes:
+                    cls._watchers[table].rollback()
+                changes = []
                 log_error("forward_msg_to_lcd", f"Failed to update config from DB: {e}")
-                if cls._config is None:
-                    cls._config = cls._default_config.copy()
-                    cls._config['sms_destination_pb'] = [cls._config['sms_destination_pb']]
-                    cls._config['sms_destination_tracker'] = [cls._config['sms_destination_tracker']]
-                    log_info("forward_msg_to_lcd", f"Using default config due to DB error: {cls._config}")
-                if cls._lcd_devices is None:
-                    cls._lcd_devices = []
-                    log_info("forward_msg_to_lcd", "No LCD devices available due to DB error")
-                if cls._device_info is None:
-                    cls._device_info = {}
-                    log_info("forward_msg_to_lcd", "No device info available due to DB error")
+                if not old.updated_at:
+                    log_info("forward_msg_to_lcd",
+                             f"Using default config, no LCD devices or device info due to DB error: {dict(config)}")
+            finally:
+                cls._loaded.set()
+
+        # 锁外通知，监听者可以直接读取 ConfigCache
+        for table, upserts, removals in changes:
+            for fn in cls._listeners:
+                try:
+                    fn(table, upserts, removals)
+                except Exception as e:
+                    log_error("forward_msg_to_lcd", f"Config listener failed for {table}: {e}")
 
     @classmethod
     def get_config(cls):
-        with cls._lock:
-            if cls._config is None:
-                cls._update()
-            return cls._config
+        return cls.snapshot().config
 
     @classmethod
     def get_lcd_devices(cls):
-        with cls._lock:
-            if cls._lcd_devices is None:
-                cls._update()
-            return cls._lcd_devices
+        return cls.snapshot().lcd_devices
 
     @classmethod
-    def get_device_info(cls, j_code: str):
-        with cls._lock:
-            if not cls._device_info:
-                cls._update()
-            return cls._device_info.get(j_code, {'label': 'Unknown', 'holder': 'Unknown'})
-
-    @classmethod
-    def get_label_to_jcode(cls):
-        with cls._lock:
-            if not cls._device_info:
-                cls._update()
-            return {info['label']: j_code for j_code, info in cls._device_info.items() if info['label'] != 'Unknown'}
+    def get_devices(cls):
+        """DeviceRegistry of device_list, refreshed by the update loop; lookups never hit the DB."""
+        cls.get_instance()
+        return cls.snapshot().devices
 
     @classmethod
-    def devices_changed(cls):
-        with cls._lock:
-            return cls._device_changed
+    def get_device_info(cls, j_code: str):
+        return cls.get_devices().info(j_code)
 
     @classmethod
-    def clear_devices_changed(cls):
-        with cls._lock:
-            cls._device_changed = False
+    def get_label_to_jcode(cls):
+        return cls.get_devices().label_to_jcode()
 
 
 def get_device_dictionary(alarm_dic):
-    try:
-        df = pd.read_sql("SELECT j_code, label FROM device_list;", engine)
-        mapping = dict(zip(df["j_code"], df["label"]))
-        return [mapping[j] for j in alarm_dic if j in mapping]
-    except Exception as e:
-        log_error("forward_msg_to_lcd", f"Failed to get device dictionary: {e}")
-        return []
+    return ConfigCache.get_devices().labels(alarm_dic)
 
 
 def get_alarm_color(duration: float) -> int:
@@ -202,29 +262,9 @@ def get_alarm_color(duration: float) -> int:
         return LCDDisplayModbus.DISPLAY_RED
 
 
-def send_alarm_message(lcd, line1: str, line2: str, duration1: float, duration2: float):
-    try:
-        lcd.switch_page(1)
-        line1 = (line1[:16] if line1 else "").ljust(16)
-        line2 = (line2[:16] if line2 else "").ljust(16)
-        if line1.strip():
-            # lcd.write_line(1, line1, get_alarm_color(duration1))
-            lcd.write_line(1, line1, get_alarm_color(duration2))
-        lcd.write_line(2, line2, get_alarm_color(duration2))
-        log_info("forward_msg_to_lcd", f"Sent to LCD: {line1}, {line2}")
-    except (ConnectionError, ValueError) as e:
-        log_error("forward_msg_to_lcd", f"Failed to send alarm message to LCD: {e}")
-
-
 def process_alarm_duration(alarm_dict):
     current_time = time.time()
-    try:
-        sql_query = "SELECT j_code, label, device_type FROM device_list;"
-        df_device = pd.read_sql(sql_query, engine)
-        device_info = df_device.set_index('j_code')[['label', 'device_type']].to_dict('index')
-    except Exception as e:
-        log_error("forward_msg_to_lcd", f"Failed to load device info: {e}")
-        device_info = {}
+    devices = ConfigCache.get_devices()
 
     config = ConfigCache.get_instance().get_config()
 
@@ -233,8 +273,8 @@ def process_alarm_duration(alarm_dict):
         if device not in alarm_dict:
             if device in sent_sms_flags and (
                     sent_sms_flags[device]["PB_300"] or sent_sms_flags[device]["TrackerD_500"]):
-                label = device_info.get(device, {}).get('label', 'Unknown')
-                device_type = device_info.get(device, {}).get('device_type', '')
+                info = devices.info(device)
+                label, device_type = info['label'], info['device_type']
                 payload = json.dumps({
                     "j_code": device,
                     "label": label,
@@ -246,7 +286,8 @@ def process_alarm_duration(alarm_dict):
                 try:
                     if str(location).strip().lower() == 'chargingstation':
                         continue
-                    publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload)
+                    publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload, durable=True)
+                    sms_queued_total.inc()
                     log_info("forward_msg_to_lcd", f"Sent cleared SMS for device {device} (label: {label})")
                 except Exception as e:
                     log_error("forward_msg_to_lcd", f"Failed to send cleared SMS for device {device}: {e}")
@@ -261,8 +302,8 @@ def process_alarm_duration(alarm_dict):
     for device, start_time in alarm_duration.items():
         location = alarm_dict.get(device, ("", ""))[1]
         elapsed = current_time - start_time
-        label = device_info.get(device, {}).get('label', 'Unknown')
-        device_type = device_info.get(device, {}).get('device_type', '')
+        info = devices.info(device)
+        label, device_type = info['label'], info['device_type']
 
         if elapsed >= config['lcd_display_in_yellow_time']:
             log_info("forward_msg_to_lcd",
@@ -287,7 +328,8 @@ def process_alarm_duration(alarm_dict):
             try:
                 if str(location).strip().lower() == 'chargingstation':
                     continue
-                publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload)
+                publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload, durable=True)
+                sms_queued_total.inc()
                 log_info("forward_msg_to_lcd",
                          f"Sent SMS for PB device {device} (label: {label}) with duration {elapsed:.1f} seconds.")
                 sent_sms_flags[device]["PB_300"] = True
@@ -305,7 +347,8 @@ def process_alarm_duration(alarm_dict):
             try:
                 if str(location).strip().lower() == 'chargingstation':
                     continue
-                publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload)
+                publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload, durable=True)
+                sms_queued_total.inc()
                 log_info("forward_msg_to_lcd",
                          f"Sent SMS for TrackerD device {device} (label: {label}) with duration {elapsed:.1f} seconds.")
                 sent_sms_flags[device]["TrackerD_500"] = True
@@ -316,113 +359,77 @@ def process_alarm_duration(alarm_dict):
 def send_messages():
     global pre_title
     cache = ConfigCache.get_instance()
-    lcd_info = cache.get_lcd_devices()
-
-    lcd_clients = []
-    for info in lcd_info:
-        lcd_client = ModbusClient(host=info["ip"], port=info["port"], timeout=3)
-        if not lcd_client.open():
-            log_error("forward_msg_to_lcd", f"Failed to connect LCD to {info['ip']}:{info['port']}")
-            continue
-        lcd = LCDDisplayModbus(lcd_client, slave_id=LCD_SLAVE_ID)
-        buzzer = None
-        # if info["mute"]:
-        #     buzzer_client = ModbusClient(host=info["ip"], port=info["port"], timeout=1)
-        #     if not buzzer_client.open():
-        #         log_error("forward_msg_to_lcd", f"Failed to connect buzzer to {info['ip']}:{info['port']}")
-        #     else:
-        #         buzzer = BuzzerModbus(buzzer_client, slave_id=BUZZER_SLAVE_ID)
-        buzzer_client = ModbusClient(host=info["ip"], port=info["port"], timeout=3)
-        if not buzzer_client.open():
-            log_error("forward_msg_to_lcd", f"Failed to connect buzzer to {info['ip']}:{info['port']}")
-        else:
-            buzzer = BuzzerModbus(buzzer_client, slave_id=BUZZER_SLAVE_ID)
-        lcd_clients.append({
-            "ip": info["ip"],
-            "lcd": lcd,
-            "buzzer": buzzer,
-            "buzzer_on": False,
-            "lock": threading.Lock(),
-            "active": True,
-            "fail_count": 0
-        })
-        log_info("forward_msg_to_lcd", f"Initialized connection for {info['ip']}:{info['port']}")
+    # 启动时等第一次刷新拿到 LCD 列表；之后读取都不等待
+    if not ConfigCache.wait_loaded(timeout=60):
+        log_error("forward_msg_to_lcd", "Config not loaded after 60s, starting with the default config")
+    # 上次运行未确认的短信立即重发，不等下一条告警
+    publisher.start()
+
+    # 共享的显示状态：主循环只发布要显示的内容，每台设备一个写线程负责写入，慢设备只拖慢自己
+    display = DisplayState()
+    display.set(title=cache.get_config()['lcd_static_title'])
+
+    # 每台设备一条 Modbus TCP 连接，LCD 和 buzzer 按 unit id 共用；断线由后台重连，不占用写线程的超时
+    modbus = ModbusSessions(backoff_max=RECOVER_INTERVAL)
+    modbus.register_metrics()
+    modbus.start()
+
+    # 设备列表随 ConfigCache 变化增量调整：只连接新增的、断开删除的，其余设备的写线程和连接不受影响
+    lcd_clients = AnnunciatorSet(display, modbus, lcd_unit=LCD_SLAVE_ID, buzzer_unit=BUZZER_SLAVE_ID,
+                                 clock_interval=CLOCK_REFRESH_INTERVAL)
+
+    def _on_config_change(table, upserts, removals):
+        if table == 'network_infrastracture_list':
+            added, removed = lcd_clients.reconcile(ConfigCache.get_lcd_devices())
+            if added or removed:
+                log_info("forward_msg_to_lcd", f"Annunciators added: {added}, removed: {removed}")
+
+    ConfigCache.add_listener(_on_config_change)
+    # 注册监听之后再读设备列表：之前发布的变化都已包含在内，之后的由监听者处理
+    lcd_clients.reconcile(ConfigCache.get_lcd_devices())
+    log_info("forward_msg_to_lcd", f"Initialized {len(lcd_clients)} annunciator(s)")
 
     def _close_all_clients():
-        for dev in lcd_clients:
-            try:
-                dev["lcd"].close()
-            except:
-                pass
-            try:
-                if dev["buzzer"]:
-                    dev["buzzer"].close()
-            except:
-                pass
+        lcd_clients.stop(timeout=1)
+        modbus.stop(timeout=1)
 
     atexit.register(_close_all_clients)
 
+    metrics.gauge('lcd_devices', 'LCDs configured', fn=lambda: len(lcd_clients))
+    metrics.gauge('lcd_devices_active', 'LCDs whose Modbus circuit is not open',
+                  fn=lambda: sum(w.active for w in lcd_clients.writers()))
+
     # State Machine Variables
-    buzzer_on = False
     alarm_index = 0
     last_labels = []
     last_display_time = time.time()
-    last_time_update = 0
     location_to_area = {}
 
-    # label_to_jcode = ConfigCache.get_instance().get_label_to_jcode()
     try:
-        # sql_query = "SELECT j_code, label FROM device_list;"
-        # df_device = pd.read_sql(sql_query, engine)
-        # label_to_jcode = dict(zip(df_device['label'], df_device['j_code']))
-
         sql_query_beacon = "SELECT X, Y, Z, area FROM beacon_list;"
-        df_beacon = pd.read_sql(sql_query_beacon, engine)
         # Normalize coordinates to string format "(X, Y, Z)" with 2 decimal places
-        location_to_area = {f"({float(row['X']):.2f}, {float(row['Y']):.2f}, {float(row['Z']):.2f})": row['area']
-                            for _, row in df_beacon.iterrows()}
-        # location_to_area = {
-        #     (row['X'], row['Y'], row['Z']): row['area']
-        #     for _, row in df_beacon.iterrows()
-        # }
+        location_to_area = db_rows.fetch_dict(
+            engine, sql_query_beacon,
+            key=lambda row: f"({float(row[0]):.2f}, {float(row[1]):.2f}, {float(row[2]):.2f})",
+            value=lambda row: row[3])
     except Exception as e:
         log_error("forward_msg_to_lcd", f"Failed to load device dictionary for reverse lookup: {e}")
 
-    recover_interval = 60
-    last_recover = 0.0
+    # 报警状态：只在 listen_event 的 version 变化时才复制一次，不再每轮无锁读取共享 dict
+    alarm_version, alarm_dic = listen_event.alarm_store.snapshot()
 
     while True:
+        loop_started = time.monotonic()
         try:
-            label_to_jcode = ConfigCache.get_instance().get_label_to_jcode()
-            title = cache.get_config()['lcd_static_title']
+            devices = ConfigCache.get_devices()
+            config = cache.get_config()
             # everytime we need to check the _lcd_devices (witch is saved in the memory, no more connection to DB)
             current_cfg = ConfigCache.get_instance().get_lcd_devices()
 
             current_time = time.time()
 
-            # —— 0) 定期探活所有 inactive 设备 —— #
-            if current_time - last_recover >= recover_interval:
-                for dev in lcd_clients:
-                    if not dev['active']:
-                        try:
-                            # Try reopening the underlying connection first (if using a persistent connection)
-                            dev['lcd'].client.open()
-                            dev['lcd'].switch_page(0)
-                            dev['active'] = True
-                            dev['fail_count'] = 0
-                            log_info("forward_msg_to_lcd", f"{dev['ip']} 恢复在线")
-                        except Exception:
-                            log_debug("\n---------forward_msg_to_lcd", f"{dev['ip']} still offline---------\n")
-                            # still offline
-                            pass
-                last_recover = current_time
-
-            # Add more LCD devices in the future, we may need the rebuild functino
-            # if cache.devices_changed():
-            #     rebuild_clients()
-            #     cache.clear_devices_changed()
-
-            alarm_dic = listen_event.alarm_dictionary
+            if listen_event.alarm_store.version != alarm_version:
+                alarm_version, alarm_dic = listen_event.alarm_store.snapshot()
             current_alarm_count = len(alarm_dic)
             log_info("forward_msg_to_lcd", f"(Alarm count: {current_alarm_count})")
 
@@ -432,156 +439,38 @@ def send_messages():
             log_info("forward_msg_to_lcd", f"alarm_labels: {alarm_labels}")
 
             mute_map = {d['ip']: d['mute'] for d in current_cfg}  # {192.168.2.21: 0->True, ...}
+            # 有报警开 buzzer，无报警关；写线程只在状态变化时写入
+            display.set(title=config['lcd_static_title'], buzzer=current_alarm_count > 0, buzzer_enabled=mute_map)
 
             if current_alarm_count == 0:
                 # 无报警，显示时间页面
-                if buzzer_on:
-                    # print("\n===========================无报警，关闭buzzer===========================\n")
-                    for dev in lcd_clients:
-                        try:
-                            if not dev["active"]:
-                                log_debug("forward_msg_to_lcd", f"can't write to the {dev['ip']} with 3 times out")
-                                continue
-
-                            if dev['buzzer'] and mute_map.get(dev['ip'], False):
-                                with dev["lock"]:
-                                    # print(f"start buzzer off: {datetime.now()}")
-                                    dev['buzzer'].set_off()
-                                    # print(f"end buzzer off: {datetime.now()}")
-                                    log_info("forward_msg_to_lcd", f"Turned off buzzer for {dev['ip']}")
-
-                                    dev['fail_count'] = 0
-                        except ConnectionError as e:
-                            log_error("forward_msg_to_lcd", f"Failed to turn off buzzer: {e}")
-
-                            dev['fail_count'] += 1
-                            log_error("forward_msg_to_lcd", f"{dev['ip']} fail to turn off ({dev['fail_count']} times): {e}")
-                            if dev['fail_count'] >= 3:
-                                dev['active'] = False
-                                # dev['lcd'].client.close()
-                                log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
-                    buzzer_on = False
-
-                # force buzzer off when current_alarm_count == 0 and 10s interval
-                for dev in lcd_clients:
-                    try:
-                        if not dev["active"]:
-                            log_debug("forward_msg_to_lcd", f"can't write to the {dev['ip']} with 3 times out")
-                            continue
-
-                        if dev['buzzer'] and mute_map.get(dev['ip'], False) and current_time - last_time_update >= 10:
-                            with dev["lock"]:
-                                # print(f"start buzzer off: {datetime.now()}")
-                                dev['buzzer'].set_off()
-                                log_info("forward_msg_to_lcd", f"Forced {dev['ip']}'s buzzer off")
-                    except Exception as e:
-                        log_error("forward_msg_to_lcd", f"Failed to turn off {dev['ip']}'s buzzer: {e}")
-                # update time in 10s interval
-                if current_time - last_time_update >= 10:
-                    for dev in lcd_clients:
-                        if not dev["active"]:
-                            log_debug("forward_msg_to_lcd", f"can't write to the {dev['ip']} with 3 times out")
-                            continue
-
-                        with dev["lock"]:
-                            try:
-                                # print("====Try to write the switch_page====")
-                                dev["lcd"].switch_page(0)
-                                # print("====end switch_page====")
-                                # print("====Try to write time_page====")
-                                # if title != pre_title:
-                                #     pre_title = title
-                                #     dev["lcd"].set_title(title)
-                                dev["lcd"].set_title(title)
-                                log_info("forward_msg_to_lcd", f"Sent current Title to LCD at {dev['ip']}")
-                                dev["lcd"].set_current_time()
-                                log_info("forward_msg_to_lcd", f"Sent current time to LCD at {dev['ip']}")
-
-                                dev['fail_count'] = 0
-                            except Exception as e:
-                                log_error("forward_msg_to_lcd", f"Time update failed for {dev['ip']}: {e}", exc_info=True)
-
-                                dev['fail_count'] += 1
-                                log_error("forward_msg_to_lcd", f"{dev['ip']} fail to turn off ({dev['fail_count']} times): {e}")
-                                if dev['fail_count'] >= 3:
-                                    dev['active'] = False
-                                    # dev['lcd'].client.close()
-                                    log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
-                    last_time_update = current_time
+                if display.frame.mode != CLOCK:
+                    display.show(CLOCK)
 
             # 改变报警的显示逻辑，一页一个设备，添加location
             else:
                 # 有报警，显示报警页面
-                if not buzzer_on:
-                    # print("\n===========================有报警，开启buzzer===========================\n")
-                    for dev in lcd_clients:
-                        try:
-                            if not dev['active']:
-                                continue
-
-                            if dev['buzzer'] and mute_map.get(dev['ip'], False):
-                                with dev["lock"]:
-                                    log_debug("forward_msg_to_lcd", f"Turning on buzzer for {dev['ip']}")
-                                    dev['buzzer'].set_on()
-                                    log_info("forward_msg_to_lcd", f"Turned on buzzer for {dev['ip']}")
-
-                                    dev['fail_count'] = 0
-                        except ConnectionError as e:
-                            log_error("forward_msg_to_lcd", f"Failed to turn on buzzer: {e}")
-
-                            dev['fail_count'] += 1
-                            log_error("forward_msg_to_lcd", f"{dev['ip']} fail to turn on ({dev['fail_count']} times): {e}")
-                            if dev['fail_count'] >= 3:
-                                dev['active'] = False
-                                # dev['lcd'].client.close()
-                                log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
-                    buzzer_on = True
-
                 labels_changed = alarm_labels != last_labels
-                config = ConfigCache.get_instance().get_config()
                 display_time = config['lcd_scrolling_alarm_interval']
 
                 if labels_changed or (current_time - last_display_time >= display_time):
                     num_labels = len(alarm_labels)
                     line1, line2 = "", ""
-                    duration1, duration2 = 0, 0
+                    duration2 = 0
 
-                    # print("nums_labels: ", num_labels)
                     if num_labels == 0:
                         # clear the page
-                        for dev in lcd_clients:
-                            if not dev['active']:
-                                continue
-
-                            with dev["lock"]:
-                                try:
-                                    dev['lcd'].switch_page(1)
-                                    dev['lcd'].write_line(1, " " * 16, LCDDisplayModbus.DISPLAY_RED)
-                                    dev['lcd'].write_line(2, " " * 16, LCDDisplayModbus.DISPLAY_RED)
-                                    dev['lcd'].switch_page(0)
-                                    log_info("forward_msg_to_lcd", f"Cleared alarm page content for {dev['ip']}")
-
-                                    dev['fail_count'] = 0
-                                except (ConnectionError, ValueError) as e:
-                                    log_error("forward_msg_to_lcd", f"Failed to clear alarm page content for {dev['ip']}: {e}")
-
-                                    dev['fail_count'] += 1
-                                    log_error("forward_msg_to_lcd", f"{dev['ip']} fail to turn off ({dev['fail_count']} times): {e}")
-                                    if dev['fail_count'] >= 3:
-                                        dev['active'] = False
-                                        # dev['lcd'].client.close()
-                                        log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
+                        display.show(BLANK)
 
                     # 在这一部分进行修改，添加location，一页显示一个device
                     else:
                         if alarm_index >= num_labels:
                             alarm_index = 0
-                        j_code = label_to_jcode.get(alarm_labels[alarm_index])
+                        j_code = devices.jcode(alarm_labels[alarm_index])
                         log_info("forward_msg_to_lcd", f"j_code is {j_code}")
 
                         if j_code:
-                            device_info = cache.get_device_info(j_code)
-                            holder = device_info.get('holder', 'Unknown')
+                            holder = devices.info(j_code)['holder']
                             event_name = alarm_dic[j_code][0]
                             location = alarm_dic[j_code][1]  # str or None(PB)
                             # location还需要和area对应，将location的坐标mapping到area
@@ -594,98 +483,27 @@ def send_messages():
                             log_info("forward_msg_to_lcd", f"e: {event_name}, l: {location}, a: {area}")
 
                             if "PB_" in event_name:
-                                device_type = "PB"
-                            else:
-                                device_type = "Tracker"
-
-                            if device_type == "PB":
                                 line1 = f"{alarm_index + 1}. {alarm_labels[alarm_index]}"
                                 line2 = f" "
-                            elif device_type == "Tracker":
+                            else:
                                 line1 = f"{alarm_index + 1}. {holder}"
                                 line2 = f"{area}"
-
-                        if j_code:
                             duration2 = current_time - alarm_duration.get(j_code, current_time)
-                        for dev in lcd_clients:
-                            if not dev['active']:
-                                continue
-                            with dev["lock"]:
-                                try:
-                                    c1 = get_alarm_color(duration2)
-                                    c2 = get_alarm_color(duration2)
-                                    log_debug("forward_msg_to_lcd",
-                                              f"[display] dev={dev['ip']} dur1={duration1:.1f} → color1={c1}, "
-                                              f"dur2={duration2:.1f} → color2={c2}")
-                                    send_alarm_message(dev["lcd"], line1, line2, 0, duration2)
-                                    dev['fail_count'] = 0
-                                except Exception as e:
-                                    dev['fail_count'] += 1
-                                    log_error("forward_msg_to_lcd",
-                                              f"{dev['ip']} fail to write color ({dev['fail_count']} times): {e}")
-                                    if dev['fail_count'] >= 3:
-                                        dev['active'] = False
-                                        log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
-                        alarm_index = (alarm_index + 1) % num_labels
 
-                    # elif num_labels == 1:
-                    #     line1 = f"1. {alarm_labels[0]}"
-                    #     line2 = " " * 16
-                    #     j_code = label_to_jcode.get(alarm_labels[0])
-                    #     if j_code:
-                    #         duration1 = current_time - alarm_duration.get(j_code, current_time)
-                    # elif num_labels == 2:
-                    #     line1 = f"1. {alarm_labels[0]}"
-                    #     line2 = f"2. {alarm_labels[1]}"
-                    #     j_code1 = label_to_jcode.get(alarm_labels[0])
-                    #     j_code2 = label_to_jcode.get(alarm_labels[1])
-                    #     if j_code1:
-                    #         duration1 = current_time - alarm_duration.get(j_code1, current_time)
-                    #     if j_code2:
-                    #         duration2 = current_time - alarm_duration.get(j_code2, current_time)
-                    # else:
-                    #     if alarm_index >= num_labels:
-                    #         alarm_index = 0
-                    #     next_index = (alarm_index + 1) % num_labels
-                    #     line1 = f"{alarm_index + 1}. {alarm_labels[alarm_index]}"
-                    #     line2 = f"{next_index + 1}. {alarm_labels[next_index]}"
-                    #     j_code1 = label_to_jcode.get(alarm_labels[alarm_index])
-                    #     j_code2 = label_to_jcode.get(alarm_labels[next_index])
-                    #     if j_code1:
-                    #         duration1 = current_time - alarm_duration.get(j_code1, current_time)
-                    #     if j_code2:
-                    #         duration2 = current_time - alarm_duration.get(j_code2, current_time)
-                    #     alarm_index = (alarm_index + 1) % num_labels
-                    #
-                    # if line1 or line2:
-                    #     for dev in lcd_clients:
-                    #         if not dev['active']:
-                    #             continue
-                    #
-                    #         with dev["lock"]:
-                    #             try:
-                    #                 c1 = get_alarm_color(duration1)
-                    #                 c2 = get_alarm_color(duration2)
-                    #                 log_debug("forward_msg_to_lcd",
-                    #                           f"[display] dev={dev['ip']} dur1={duration1:.1f} → color1={c1}, "
-                    #                           f"dur2={duration2:.1f} → color2={c2}")
-                    #                 send_alarm_message(dev["lcd"], line1, line2, duration1, duration2)
-                    #
-                    #                 dev['fail_count'] = 0
-                    #             except Exception as e:
-                    #                 dev['fail_count'] += 1
-                    #                 log_error("forward_msg_to_lcd", f"{dev['ip']} fail to write color ({dev['fail_count']} times): {e}")
-                    #                 if dev['fail_count'] >= 3:
-                    #                     dev['active'] = False
-                    #                     # dev['lcd'].client.close()
-                    #                     log_info("forward_msg_to_lcd", f"{dev['ip']} offline, continue")
+                        color = get_alarm_color(duration2)
+                        log_debug("forward_msg_to_lcd", f"[display] dur2={duration2:.1f} → color={color}")
+                        display.show(ALARM, line1, line2, color)
+                        log_info("forward_msg_to_lcd", f"Sent to LCD: {line1}, {line2}")
+                        alarm_index = (alarm_index + 1) % num_labels
 
                     last_labels = alarm_labels.copy()
                     last_display_time = current_time
         except Exception as e:
             log_error("forward_msg_to_lcd", f"Unexpected error in main loop: {e}")
+        lcd_loop_hist.observe((time.monotonic() - loop_started) * 1000.0)
 
-        time.sleep(0.1)
+        # 有报警变化立即醒来，否则 0.1s 后继续做计时/滚动等周期任务
+        listen_event.alarm_store.wait(alarm_version, timeout=0.1)
 
 
 if __name__ == "__main__":
@@ -694,6 +512,8 @@ if __name__ == "__main__":
             log_error("forward_msg_to_lcd",
                       f"start_mqtt_listener is not callable, got {type(listen_event.start_mqtt_listener)}")
             raise TypeError(f"start_mqtt_listener is not callable, got {type(listen_event.start_mqtt_listener)}")
+        if METRICS_PORT:
+            metrics.serve(METRICS_PORT)
         ConfigCache.get_instance()
         mqtt_thread = threading.Thread(target=listen_event.start_mqtt_listener, daemon=True)
         mqtt_thread.start()
@@ -1,54 +1,58 @@
 from datetime import datetime
+import time
 
 class LCDDisplayModbus:
     DISPLAY_RED = 1
     DISPLAY_GREEN = 2
     DISPLAY_YELLOW = 3
 
-    def __init__(self, client, slave_id=1):
+    # 寄存器表：0-4 时间(年月日时分) 5 页面 6-13 第一行 14-21 第二行 24-31 标题 48/49/50 第一行/第二行/标题颜色
+    TIME_REGISTER = 0
+    PAGE_REGISTER = 5
+    MAX_GAP = 16  # known registers rewritten to merge two dirty runs into one transaction
+    MAX_BLOCK = 123  # registers per write_multiple_registers (Modbus limit)
+
+    def __init__(self, client, slave_id=1, resync_interval=300.0):
+        """
+        Every write goes through a shadow copy of the registers last acknowledged by the device and
+        only sends the ones that differ. The shadow is dropped on a failed write, on reconnect and
+        every resync_interval seconds (None: never), after which everything is written again.
+        """
         self.client = client
         self.slave_id = slave_id
         self.client.unit_id = slave_id
+        self.resync_interval = resync_interval
+        self.transactions = 0  # Modbus requests sent
+        self._shadow = {}      # register -> value the device acknowledged
+        self._shadow_since = time.monotonic()
 
     def close(self):
         if self.client.is_open:
             self.client.close()
+        self.invalidate()
 
     def switch_page(self, page):
         if page not in [0, 1]:
             raise ValueError("Page must be 0 or 1")
-        if not self.client.is_open:
-            if not self.client.open():
-                raise ConnectionError("Failed to reconnect for switch page")
         # if not self.client.write_single_register(5, page):
         #     self.client.close()
         #     raise ConnectionError("Failed to switch page")
         try:
-            ok = self.client.write_single_register(5, page)
-            if not ok:
-                # 读取库内部记录的错误/异常信息
-                err_txt = self.client.last_error_as_txt  # 如 "connection timed out"
-                exc_txt = self.client.last_except_as_txt  # 如 "ILLEGAL DATA ADDRESS"
-                detail = self.client.last_except_as_full_txt  # 更长的 Modbus 解释
-                raise ConnectionError(
-                    f"Modbus write_single_register(addr=5, value={page}) failed: "
-                    f"last_error={err_txt}, last_except={exc_txt}, detail={detail}"
-                )
-        except Exception as e:
-            # 捕获 write_single_register 自己抛出的异常（例如参数越界）
+            self._write({self.PAGE_REGISTER: page}, "switch page")
+        except ConnectionError as e:
+            # 读取库内部记录的错误/异常信息
+            err_txt = self.client.last_error_as_txt  # 如 "connection timed out"
+            exc_txt = self.client.last_except_as_txt  # 如 "ILLEGAL DATA ADDRESS"
+            detail = self.client.last_except_as_full_txt  # 更长的 Modbus 解释
             raise ConnectionError(
-                f"Exception while switching page to {page}: {e}"
+                f"Modbus write_single_register(addr=5, value={page}) failed: "
+                f"last_error={err_txt}, last_except={exc_txt}, detail={detail}"
             ) from e
 
     def set_current_time(self):
-        if not self.client.is_open:
-            if not self.client.open():
-                raise ConnectionError("Failed to reconnect for set time")
         now = datetime.now()
         values = [now.year, now.month, now.day, now.hour, now.minute]
-        if not self.client.write_multiple_registers(0, values):
-            self.client.close()
-            raise ConnectionError("Failed to write current time")
+        self._write(dict(enumerate(values, self.TIME_REGISTER)), "current time")
 
     def write_line(self, line_num, text, color):
         if line_num not in [1, 2]:
@@ -56,45 +60,111 @@ class LCDDisplayModbus:
         if not (1 <= len(text) <= 16):
             raise ValueError("Text must be 1 to 16 characters long")
 
-        text = text.ljust(16)
-        registers = []
-        for i in range(0, 16, 2):
-            high = ord(text[i])
-            low = ord(text[i + 1])
-            value = (high << 8) + low
-            registers.append(value)
-
         start_register = 6 if line_num == 1 else 14
         color_register = 48 if line_num == 1 else 49
-
-        if not self.client.is_open:
-            if not self.client.open():
-                raise ConnectionError("Failed to reconnect for write line")
-        if not self.client.write_multiple_registers(start_register, registers):
-            self.client.close()
-            raise ConnectionError(f"Failed to write content for line {line_num}")
-        if not self.client.write_single_register(color_register, color):
-            self.client.close()
-            raise ConnectionError(f"Failed to write color for line {line_num}")
+        desired = dict(enumerate(self._encode(text), start_register))
+        desired[color_register] = color
+        self._write(desired, f"content for line {line_num}")
 
     def set_title(self, title):
-        text = title.ljust(16)
-        registers = []
-        for i in range(0, 16, 2):
-            high = ord(text[i])
-            low = ord(text[i+1])
-            value = (high << 8) + low
-            registers.append(value)
         start_register = 24
+        desired = dict(enumerate(self._encode(title), start_register))
+        # always assuming color register at 51, and color to be yellow
+        desired[50] = 2
+        self._write(desired, "content for title")
+
+    def write_frame(self, page=None, line1=None, line2=None, colors=(), title=None, clock=False):
+        """
+        A whole screen in as few Modbus requests as the register map allows: everything that
+        changed is planned together, so time + page + both lines (0-21) go out as one block, the
+        title (24-31) as another and the colours (48-50) as a third, at most. Any argument left at
+        None is not touched; colors is (line1, line2[, title]), a None entry leaves that colour.
+        clock=True also writes the current time.
+        """
+        desired = {}
+        if clock:
+            now = datetime.now()
+            desired.update(enumerate([now.year, now.month, now.day, now.hour, now.minute], self.TIME_REGISTER))
+        if page is not None:
+            if page not in [0, 1]:
+                raise ValueError("Page must be 0 or 1")
+            desired[self.PAGE_REGISTER] = page
+        for start_register, text in ((6, line1), (14, line2), (24, title)):
+            if text is not None:
+                desired.update(enumerate(self._encode(text), start_register))
+        for color_register, color in zip((48, 49, 50), colors):
+            if color is not None:
+                desired[color_register] = color
+        if title is not None:
+            desired.setdefault(50, 2)  # same title colour as set_title
+        if desired:
+            self._write(desired, "frame")
+
+    # ---- shadow register map ----
+
+    @staticmethod
+    def _encode(text):
+        """16 characters -> 8 registers, two characters (high, low byte) per register."""
+        text = text[:16].ljust(16)
+        return [(ord(text[i]) << 8) + ord(text[i + 1]) for i in range(0, 16, 2)]
+
+    def invalidate(self):
+        """Forget what the device holds; the next writes send every register again."""
+        self._shadow.clear()
+        self._shadow_since = time.monotonic()
 
+    def _open(self, what):
+        if self.resync_interval is not None and time.monotonic() - self._shadow_since >= self.resync_interval:
+            self.invalidate()
         if not self.client.is_open:
+            # 重连后设备可能已重启，影子寄存器不再可信
+            self.invalidate()
             if not self.client.open():
-                raise ConnectionError("Failed to reconnect for set title")
-        if not self.client.write_multiple_registers(start_register, registers):
-            self.client.close()
-            raise ConnectionError(f"Failed to write content for title")
-        # always assuming color register at 51, and color to be yellow
-        if not self.client.write_single_register(50, 2):
+                raise ConnectionError(f"Failed to reconnect for {what}")
+
+    def _fault(self, what):
+        # 共享会话（lib/modbus_sessions.UnitClient）交给断路器处理，不关闭同一设备其他单元也在用的连接
+        fault = getattr(self.client, 'fault', None)
+        if fault is not None:
+            fault(f"failed to write {what}")
+        else:
             self.client.close()
-            raise ConnectionError(f"Failed to write color for title")
 
+    def _plan(self, desired):
+        """
+        Registers of `desired` that differ from the shadow, as [(start, [values])] runs. A clean
+        register between two dirty ones is written again (with its known value) when that saves a
+        transaction, i.e. when the gap is at most MAX_GAP registers and fully known. A register
+        whose value is unknown is never written, so it always splits the runs around it.
+        """
+        shadow = self._shadow
+        dirty = sorted(r for r, v in desired.items() if shadow.get(r) != v)
+        runs = []
+        for r in dirty:
+            if runs:
+                start, values = runs[-1]
+                end = start + len(values)
+                gap = range(end, r)
+                if len(gap) <= self.MAX_GAP and r - start < self.MAX_BLOCK \
+                        and all(g in desired or g in shadow for g in gap):
+                    values.extend(desired.get(g, shadow.get(g)) for g in gap)
+                    values.append(desired[r])
+                    continue
+            runs.append((r, [desired[r]]))
+        return runs
+
+    def _write(self, desired, what):
+        """Write the registers of desired {address: value} the device does not hold yet."""
+        self._open(what)
+        for start, values in self._plan(desired):
+            if len(values) == 1:
+                ok = self.client.write_single_register(start, values[0])
+            else:
+                ok = self.client.write_multiple_registers(start, values)
+            self.transactions += 1
+            if not ok:
+                # 写入是否部分生效未知
+                self._fault(what)
+                self.invalidate()
+                raise ConnectionError(f"Failed to write {what}")
+            self._shadow.update(zip(range(start, start + len(values)), values))
@@ -0,0 +1,209 @@
+"""
+Alarm state with change notification: instead of polling and diffing a shared dict, consumers
+subscribe to typed events or wait for the version counter to move.
+
+store = AlarmStore()
+store.apply(upserts={'cow1': [1, 1]}, removals=['cow2'])      # producer (MQTT thread)
+
+sub = store.subscribe()                  # consumer: sub.initial holds the state it starts from
+event = sub.get(timeout=10)              # AlarmEvent or None on timeout
+    ENTER   key started alarming          value = new value
+    UPDATE  alarming key changed value    value = new value, previous = old value
+    EXIT    key stopped alarming          previous = last value
+    STALE   key expired: no update for `ttl` seconds (lost tag or message); removed like EXIT, previous = last value
+    RESYNC  the subscriber fell behind and events were dropped; value = full state at `version`
+
+version, state = store.snapshot()        # or, for loops with periodic work of their own:
+version = store.wait(version, timeout=0.1)   # returns as soon as anything changed
+
+With ttl set, every upsert (changed or not) refreshes the key's last-seen time, and start_expiry()
+runs a sweeper that removes keys not seen for ttl seconds. An upsert that replays an older reading
+passes its age (apply(..., ages={key: seconds})): last-seen is set to when the value was read and
+never moves backwards, and a replayed value already older than ttl is ignored. Deadlines sit in a
+heap, so a sweep costs O(log n) per expired or refreshed key instead of a scan of the whole state.
+"""
+import heapq
+import queue
+import threading
+import time
+from collections import namedtuple
+
+ENTER = 'enter'
+UPDATE = 'update'
+EXIT = 'exit'
+STALE = 'stale'
+RESYNC = 'resync'
+
+AlarmEvent = namedtuple('AlarmEvent', 'kind key value previous version time')
+
+
+class Subscription:
+    def __init__(self, store, initial, version, maxsize):
+        self.store = store
+        self.initial = initial
+        self.version = version
+        self._queue = queue.Queue(maxsize)
+        self._overflowed = False
+
+    def _push(self, event):
+        # runs under the store lock, on the producer's thread: never block it on a slow consumer
+        if self._overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout=None):
+        if self._overflowed:
+            with self.store.lock:
+                self._overflowed = False
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                version, state = self.store.version, dict(self.store.state)
+            return AlarmEvent(RESYNC, None, state, None, version, time.time())
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.store.unsubscribe(self)
+
+
+class AlarmStore:
+    def __init__(self, ttl=None):
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self.state = {}  # key -> value, mutate only through apply()
+        self.version = 0
+        self.ttl = ttl
+        self._subscribers = []
+        self._last_seen = {}  # key -> time.monotonic() of the last upsert
+        self._deadlines = []  # heap of (last seen + ttl, key); entries outdated by a later upsert are skipped
+        self._sweeper = None
+        self._sweeper_stop = threading.Event()
+
+    def subscribe(self, maxsize=10000):
+        with self.lock:
+            sub = Subscription(self, dict(self.state), self.version, maxsize)
+            self._subscribers.append(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def apply(self, upserts=None, removals=(), ages=None):
+        """
+        Set and remove keys in one step; returns the events it produced (none if nothing changed).
+        ages: {key: seconds since the upserted value was read} for replayed values, default 0.
+        """
+        events = []
+        now = time.time()
+        with self._cond:
+            state = self.state
+            for key in removals:
+                if key in state:
+                    previous = state.pop(key)
+                    self._last_seen.pop(key, None)
+                    self.version += 1
+                    events.append(AlarmEvent(EXIT, key, None, previous, self.version, now))
+            seen = time.monotonic()
+            for key, value in (upserts or {}).items():
+                age = ages.get(key, 0.0) if ages else 0.0
+                if self.ttl is not None and age >= self.ttl:
+                    continue  # a replay of a reading that has expired already
+                self._touch(key, seen - age)
+                previous = state.get(key)
+                if key not in state:
+                    kind = ENTER
+                elif previous != value:
+                    kind = UPDATE
+                else:
+                    continue
+                state[key] = value
+                self.version += 1
+                events.append(AlarmEvent(kind, key, value, previous, self.version, now))
+            self._publish(events)
+        return events
+
+    def _publish(self, events):
+        if events:
+            for sub in self._subscribers:
+                for event in events:
+                    sub._push(event)
+            self._cond.notify_all()
+
+    def _touch(self, key, seen):
+        if seen <= self._last_seen.get(key, seen - 1):
+            return
+        self._last_seen[key] = seen
+        if self.ttl is not None:
+            heapq.heappush(self._deadlines, (seen + self.ttl, key))
+            # refreshed keys leave outdated heap entries behind: rebuild before they outnumber the live ones
+            if len(self._deadlines) > 2 * len(self._last_seen) + 64:
+                self._deadlines = [(t + self.ttl, k) for k, t in self._last_seen.items()]
+                heapq.heapify(self._deadlines)
+
+    def last_seen(self, key):
+        """Seconds since the key was last upserted, None if it is not in the store."""
+        with self.lock:
+            seen = self._last_seen.get(key)
+        return None if seen is None else time.monotonic() - seen
+
+    def expire(self, now=None):
+        """Remove keys not upserted for ttl seconds, as STALE events; returns those events."""
+        if self.ttl is None:
+            return []
+        events = []
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            heap = self._deadlines
+            while heap and heap[0][0] <= now:
+                deadline, key = heapq.heappop(heap)
+                seen = self._last_seen.get(key)
+                if seen is None or seen + self.ttl != deadline:
+                    continue  # removed, or refreshed since this entry was pushed
+                del self._last_seen[key]
+                previous = self.state.pop(key)
+                self.version += 1
+                events.append(AlarmEvent(STALE, key, None, previous, self.version, time.time()))
+            self._publish(events)
+        return events
+
+    def start_expiry(self, interval=1.0):
+        """Sweep for stale keys every `interval` seconds on a daemon thread."""
+        if self.ttl is None or self._sweeper is not None:
+            return
+
+        def _sweep():
+            while not self._sweeper_stop.wait(interval):
+                self.expire()
+
+        self._sweeper_stop.clear()
+        self._sweeper = threading.Thread(target=_sweep, name='alarm-store-expiry', daemon=True)
+        self._sweeper.start()
+
+    def stop_expiry(self):
+        self._sweeper_stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, dict(self.state)
+
+    def wait(self, version, timeout=None):
+        """Block until the store moves past `version` or timeout expires; returns the current version."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def __len__(self):
+        return len(self.state)
+
+    def __contains__(self, key):
+        return key in self.state
@@ -0,0 +1,242 @@
+"""
+What every annunciator (LCD + buzzer) should show, and one writer thread per device that makes it so.
+
+display = DisplayState()
+writers = [AnnunciatorWriter(ip, lcd, buzzer, display, sessions.session(ip, port)) for ...]; each .start()
+display.set(title='Ramsay Health', buzzer=True, buzzer_enabled={'192.168.2.21': True})
+display.show(ALARM, line1='1. Bed 3', line2='Ward A', color=LCDDisplayModbus.DISPLAY_RED)
+
+The control loop only publishes frames; it never waits on Modbus. Each writer wakes up when the
+state changes and writes only what its device is missing, newest state first: a frame published
+while a device is still busy replaces the one it had not got to yet. Devices are written in
+parallel, so a frame reaches every screen in about one round-trip, and an unreachable device only
+delays itself. lcd and buzzer talk through the device's ModbusSession (lib.modbus_sessions): while
+its circuit is open the writer skips the device, and once the session has reconnected in the
+background it writes the whole current frame again.
+
+AnnunciatorSet keeps one writer per configured (ip, port): reconcile(devices) starts writers for new
+devices and stops and disconnects removed ones, leaving the others and their sessions alone.
+
+Each frame is one LCDDisplayModbus.write_frame(): page, lines, colours and title planned together,
+and only registers that changed are sent.
+Modes: CLOCK   page 0, title and current time, rewritten every clock_interval seconds (in practice
+               just the minute register); enabled buzzers are forced off at the same pace
+       ALARM   page 1, line1 (left as is when blank) and line2 in `color`
+       BLANK   lines cleared, back to page 0
+"""
+import logging
+import threading
+import time
+from typing import Mapping, NamedTuple
+
+from lib import metrics
+from lib.metrics import LATENCY_MS_BUCKETS
+from lib.TwoLineLCD_ModbusTCP import LCDDisplayModbus
+from lib.buzzer_modbusTCP import BuzzerModbus
+
+CLOCK = 'clock'
+ALARM = 'alarm'
+BLANK = 'blank'
+
+log = logging.getLogger('annunciator')
+
+write_failures_total = metrics.counter('lcd_write_failures_total', 'Failed Modbus writes to LCDs and buzzers')
+frame_latency_hist = metrics.histogram('lcd_frame_latency_ms', LATENCY_MS_BUCKETS,
+                                       'Frame published to written on one device')
+
+
+class DisplayFrame(NamedTuple):
+    version: int            # bumped on any change, writers wake on it
+    frame_seq: int          # bumped by show(): the screen content must be written again
+    mode: str
+    title: str
+    line1: str
+    line2: str
+    color: int
+    buzzer: bool
+    buzzer_enabled: Mapping  # ip -> buzzer may sound (mute off)
+    published_at: float      # time.monotonic() of the last show()
+
+
+class DisplayState:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.frame = DisplayFrame(0, 0, CLOCK, '', '', '', LCDDisplayModbus.DISPLAY_RED, False, {}, time.monotonic())
+
+    def set(self, **fields):
+        """Change title / buzzer / buzzer_enabled without rewriting the screen content; no-op if unchanged."""
+        with self._cond:
+            if all(getattr(self.frame, k) == v for k, v in fields.items()):
+                return self.frame
+            self.frame = self.frame._replace(version=self.frame.version + 1, **fields)
+            self._cond.notify_all()
+            return self.frame
+
+    def show(self, mode, line1='', line2='', color=LCDDisplayModbus.DISPLAY_RED):
+        """Publish new screen content; every device writes it again, even if it did not change."""
+        with self._cond:
+            frame = self.frame
+            self.frame = frame._replace(version=frame.version + 1, frame_seq=frame.frame_seq + 1, mode=mode,
+                                        line1=line1, line2=line2, color=color, published_at=time.monotonic())
+            self._cond.notify_all()
+            return self.frame
+
+    def wait(self, version, timeout=None):
+        """The current frame, as soon as its version differs from `version` or after timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.frame.version != version, timeout)
+            return self.frame
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+
+class AnnunciatorWriter:
+    def __init__(self, ip, lcd, buzzer, display, session, clock_interval=10.0):
+        self.ip = ip
+        self.lcd = lcd
+        self.buzzer = buzzer
+        self.display = display
+        self.session = session
+        self.clock_interval = clock_interval
+        self.fail_count = 0
+        self._frame_written = None   # frame_seq on the screen, None = unknown
+        self._buzzer_written = None  # buzzer state last set, None = unknown
+        self._next_clock = 0.0
+        self._connects = None        # session.connects the state above belongs to
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def active(self):
+        return self.session.available
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'annunciator-{self.ip}', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.display.wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def close(self):
+        for device in (self.lcd, self.buzzer):
+            try:
+                if device is not None:
+                    device.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        version = None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = self._next_clock if self.active and self.display.frame.mode == CLOCK else now + 1.0
+            frame = self.display.wait(version, timeout=max(0.0, min(due, now + 1.0) - now))
+            if self._stop.is_set():
+                break
+            version = frame.version
+            if not self.active:
+                continue  # 断路器打开：不碰网络，由会话在后台重连
+            if self.session.connects != self._connects:
+                # 新连接：设备可能重启过，整帧重写
+                self._connects = self.session.connects
+                self._frame_written = self._buzzer_written = None
+                self._next_clock = 0.0
+                self.lcd.invalidate()
+            try:
+                self._render(frame)
+                self.fail_count = 0
+            except Exception as e:
+                self._failed(e)
+
+    def _render(self, frame):
+        now = time.monotonic()
+        clock_due = frame.mode == CLOCK and now >= self._next_clock
+
+        if self.buzzer is not None and frame.buzzer_enabled.get(self.ip, False):
+            if frame.buzzer != self._buzzer_written or (clock_due and not frame.buzzer):
+                self._buzzer_written = None
+                if frame.buzzer:
+                    self.buzzer.set_on()
+                else:
+                    self.buzzer.set_off()
+                self._buzzer_written = frame.buzzer
+                log.info("%s: buzzer %s", self.ip, 'on' if frame.buzzer else 'off')
+
+        if frame.frame_seq == self._frame_written and not clock_due:
+            return
+        self._frame_written = None  # unknown until the whole frame went through
+        lcd = self.lcd
+        if frame.mode == CLOCK:
+            lcd.write_frame(page=0, title=frame.title, clock=True)
+            self._next_clock = now + self.clock_interval
+        elif frame.mode == ALARM:
+            line1 = frame.line1[:16].ljust(16)
+            if line1.strip():
+                lcd.write_frame(page=1, line1=line1, line2=frame.line2, colors=(frame.color, frame.color))
+            else:
+                lcd.write_frame(page=1, line2=frame.line2, colors=(None, frame.color))
+        else:
+            # 清空第一页并切回第0页，一次写入
+            lcd.write_frame(page=0, line1='', line2='', colors=(LCDDisplayModbus.DISPLAY_RED,) * 2)
+        self._frame_written = frame.frame_seq
+        frame_latency_hist.observe((time.monotonic() - frame.published_at) * 1000.0)
+        log.debug("%s: wrote %s frame %d", self.ip, frame.mode, frame.frame_seq)
+
+    def _failed(self, e):
+        self.fail_count += 1
+        write_failures_total.inc()
+        log.error("%s: write failed (%d times): %s", self.ip, self.fail_count, e)
+
+
+class AnnunciatorSet:
+    def __init__(self, display, sessions, lcd_unit=1, buzzer_unit=2, clock_interval=10.0):
+        self.display = display
+        self.sessions = sessions
+        self.lcd_unit = lcd_unit
+        self.buzzer_unit = buzzer_unit
+        self.clock_interval = clock_interval
+        self._writers = {}  # (ip, port) -> AnnunciatorWriter
+        self._lock = threading.Lock()  # one reconcile at a time
+
+    def writers(self):
+        return list(self._writers.values())
+
+    def __len__(self):
+        return len(self._writers)
+
+    def _make_writer(self, ip, port):
+        lcd = LCDDisplayModbus(self.sessions.unit(ip, port, self.lcd_unit), slave_id=self.lcd_unit)
+        buzzer = BuzzerModbus(self.sessions.unit(ip, port, self.buzzer_unit), slave_id=self.buzzer_unit)
+        return AnnunciatorWriter(ip, lcd, buzzer, self.display, self.sessions.session(ip, port),
+                                 clock_interval=self.clock_interval)
+
+    def reconcile(self, devices):
+        """devices: the configured annunciators, mappings with 'ip' and 'port'. Returns (added, removed) keys."""
+        with self._lock:
+            wanted = {(d['ip'], d['port']) for d in devices}
+            removed = [key for key in self._writers if key not in wanted]
+            added = [key for key in wanted if key not in self._writers]
+            writers = dict(self._writers)
+            for key in added:
+                writer = self._make_writer(*key)
+                writer.start()
+                writers[key] = writer
+                log.info("%s:%s added", *key)
+            stopping = [writers.pop(key) for key in removed]
+            self._writers = writers  # readers iterate over the old dict undisturbed
+            for writer, key in zip(stopping, removed):
+                writer.stop(timeout=1)
+                self.sessions.remove(*key)
+                log.info("%s:%s removed", *key)
+        return added, removed
+
+    def stop(self, timeout=None):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.stop(timeout)
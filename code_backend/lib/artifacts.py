@@ -0,0 +1,164 @@
+"""
+Versioned artifact bundle: one memory-mappable file holding named numpy arrays plus a small JSON manifest.
+
+write_bundle('model/weight/positioning.bundle', arrays={'grid_means': ...}, meta={...}, version='2025.08')
+bundle = load_bundle('model/weight/positioning.bundle')  # reads the manifest only
+grid_means = bundle['grid_means']                          # read-only view into the mapped file
+
+Layout:
+    MAGIC (8 bytes) | manifest length (uint64 LE) | manifest JSON | padding | array data, each ALIGN-aligned
+
+Arrays are never copied: every service that loads the same bundle shares its pages through the OS page cache.
+load_bundle() caches bundles by the content hash recorded in the manifest, so loading a path twice,
+or two paths with the same content, maps the file once per process.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b'VFBUNDL1'
+FORMAT_VERSION = 1
+ALIGN = 64
+_HEADER = struct.Struct('<8sQ')
+
+_bundles = {}  # content hash -> ArtifactBundle
+_bundles_lock = threading.Lock()
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_bundle(path, arrays, meta=None, version='1'):
+    """
+    arrays: dict name -> numpy array (any dtype, structured dtypes included)
+    meta: small JSON-serialisable dict stored in the manifest
+    The file is written next to `path` and renamed into place, so readers never see a partial bundle.
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+
+    digest = hashlib.sha256()
+    entries = {}
+    offset = 0
+    for name, arr in arrays.items():
+        offset = _align(offset)
+        entries[name] = {
+            'dtype': np.lib.format.dtype_to_descr(arr.dtype),
+            'shape': list(arr.shape),
+            'offset': offset,
+            'nbytes': arr.nbytes,
+        }
+        digest.update(name.encode('utf-8'))
+        digest.update(json.dumps(entries[name]['dtype']).encode('utf-8'))
+        digest.update(str(arr.shape).encode('utf-8'))
+        digest.update(arr.tobytes())
+        offset += arr.nbytes
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': str(version),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'meta': meta or {},
+        'arrays': entries,
+    }
+    digest.update(json.dumps(manifest['meta'], sort_keys=True).encode('utf-8'))
+    manifest['content_hash'] = digest.hexdigest()
+
+    manifest_bytes = json.dumps(manifest).encode('utf-8')
+    data_start = _align(_HEADER.size + len(manifest_bytes))
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(manifest_bytes)))
+        f.write(manifest_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + entries[name]['offset'])
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_manifest(path):
+    """Manifest of a bundle, with 'data_start' added. Touches only the header."""
+    with open(path, 'rb') as f:
+        magic, length = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an artifact bundle")
+        manifest = json.loads(f.read(length).decode('utf-8'))
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} in {path}")
+    manifest['data_start'] = _align(_HEADER.size + length)
+    return manifest
+
+
+class ArtifactBundle:
+    """Arrays are mapped lazily, on first access, and cached per name."""
+
+    def __init__(self, path, manifest=None):
+        self.path = path
+        self.manifest = manifest or read_manifest(path)
+        self._mmap = None
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def content_hash(self):
+        return self.manifest['content_hash']
+
+    @property
+    def meta(self):
+        return self.manifest['meta']
+
+    def __contains__(self, name):
+        return name in self.manifest['arrays']
+
+    def names(self, prefix=''):
+        return [name for name in self.manifest['arrays'] if name.startswith(prefix)]
+
+    def __getitem__(self, name):
+        arr = self._arrays.get(name)
+        if arr is not None:
+            return arr
+        with self._lock:
+            if name not in self._arrays:
+                entry = self.manifest['arrays'][name]
+                if self._mmap is None:
+                    with open(self.path, 'rb') as f:
+                        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                dtype = np.lib.format.descr_to_dtype(_as_descr(entry['dtype']))
+                if entry['nbytes'] == 0:
+                    arr = np.empty(entry['shape'], dtype=dtype)
+                else:
+                    arr = np.frombuffer(self._mmap, dtype=dtype, count=entry['nbytes'] // dtype.itemsize,
+                                        offset=self.manifest['data_start'] + entry['offset'])
+                self._arrays[name] = arr.reshape(entry['shape'])
+            return self._arrays[name]
+
+
+def _as_descr(descr):
+    # JSON turns the (name, type[, shape]) tuples of structured dtypes into lists
+    if isinstance(descr, list):
+        return [(item[0], _as_descr(item[1])) + tuple(tuple(shape) for shape in item[2:]) for item in descr]
+    return descr
+
+
+def load_bundle(path):
+    """Return the cached bundle for this content, reading only the manifest on a cache miss."""
+    manifest = read_manifest(path)
+    key = manifest['content_hash']
+    with _bundles_lock:
+        bundle = _bundles.get(key)
+        if bundle is None:
+            bundle = _bundles[key] = ArtifactBundle(path, manifest)
+        return bundle
@@ -11,13 +11,21 @@ class BuzzerModbus:
         if self.client.is_open:
             self.client.close()
 
+    def _fault(self):
+        # a session unit (lib/modbus_sessions.py) shares its socket with the LCD: let the breaker handle it
+        fault = getattr(self.client, 'fault', None)
+        if fault is not None:
+            fault("buzzer write failed")
+        else:
+            self.client.close()
+
     def set_on(self):
         if not self.client.is_open:
             if not self.client.open():
                 raise ConnectionError("Failed to reconnect for buzzer ON")
         print(f"---try to turn on the buzzer--- {datetime.now()}")
         if not self.client.write_single_register(4, 1):
-            self.client.close()
+            self._fault()
             print(f"---fail to turn on the buzzer--- {datetime.now()}")
             raise ConnectionError("Failed to turn ON buzzer")
 
@@ -27,6 +35,6 @@ class BuzzerModbus:
                 raise ConnectionError("Failed to reconnect for buzzer OFF")
         print(f"try to turn off the buzzer {datetime.now()}")
         if not self.client.write_single_register(4, 0):
-            self.client.close()
+            self._fault()
             print(f"---fail to turn off the buzzer--- {datetime.now()}")
             raise ConnectionError("Failed to turn OFF buzzer")
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Row streaming on a SQLAlchemy engine, for building small dicts and caches without a DataFrame.
+
+for ip, port, mute in stream(engine, "SELECT ip, modbus_tcp_port, mute FROM network_infrastracture_list"):
+    ...
+areas = fetch_dict(engine, "SELECT X, Y, Z, area FROM beacon_list", key=lambda r: r[:3], value=lambda r: r[3])
+
+Rows come out as plain tuples (NULL -> None), fetched from the server in chunks of batch_size
+(stream_results: a server-side cursor where the driver has one), so memory stays flat for big tables.
+A generator holds its connection until it is exhausted or closed.
+"""
+from sqlalchemy import text
+
+
+def _statement(query):
+    return text(query) if isinstance(query, str) else query
+
+
+def stream_on(conn, query, params=None, batch_size=1000):
+    """Like stream(), on a connection the caller already holds."""
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+        _statement(query), params or {})
+    try:
+        for row in result:
+            yield tuple(row)
+    finally:
+        result.close()
+
+
+def stream(engine, query, params=None, batch_size=1000):
+    """Yield the rows of query as tuples."""
+    with engine.connect() as conn:
+        yield from stream_on(conn, query, params, batch_size)
+
+
+def fetch_dict(engine, query, key=lambda row: row[0], value=lambda row: row[1], params=None):
+    """{key(row): value(row)} over all rows of query."""
+    return {key(row): value(row) for row in stream(engine, query, params)}
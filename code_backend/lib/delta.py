@@ -0,0 +1,101 @@
+"""
+Change-only publishing of per-cow state on /modelPublish.
+
+Frames are {"seq": 12, "keyframe": false, "cows": {"cow1": [x, y, is_out], ...}}.
+A delta frame holds only the cows whose value changed since they were last published; a keyframe,
+sent at least every keyframe_interval seconds, holds every cow. seq grows by one per frame, so a
+subscriber that sees a gap knows it missed a delta and stays stale until the next keyframe.
+
+A keyframe replays cows that were not in the latest payload, so it also carries
+"ages": {"cow1": 42.0, ...}, seconds since each such cow was last reported (cows without an age
+were just reported). A replayed value is not a new reading: subscribers must not treat it as one.
+A cow not reported for expire_after seconds is dropped and left out of later keyframes.
+
+publisher side:   frame = encoder.frame(payload)     # None when nothing changed and no keyframe is due
+subscriber side:  cows, keyframe = receiver.receive(json.loads(raw))
+                  ages = frame_ages(message)
+
+A plain {"cow1": [...]} map (the format before frames, still published with delta mode off) is
+received as a delta without a sequence number.
+"""
+import logging
+import time
+
+log = logging.getLogger('delta')
+
+
+def is_frame(message):
+    return isinstance(message, dict) and 'cows' in message and 'keyframe' in message
+
+
+def frame_ages(message):
+    """{cow_id: seconds since last reported} of the replayed cows in a frame; {} for anything else."""
+    return (message.get('ages') or {}) if is_frame(message) else {}
+
+
+class DeltaEncoder:
+    def __init__(self, keyframe_interval=30.0, expire_after=None):
+        self.keyframe_interval = keyframe_interval
+        self.expire_after = expire_after
+        self.seq = 0
+        self.expired = 0  # cows dropped for not being reported
+        self._published = {}  # cow_id -> last published value
+        self._reported = {}   # cow_id -> time.monotonic() it was last in a payload
+        self._last_keyframe = None
+
+    def _expire(self, now):
+        if self.expire_after is None:
+            return
+        gone = [cow_id for cow_id, seen in self._reported.items() if now - seen >= self.expire_after]
+        for cow_id in gone:
+            del self._reported[cow_id]
+            self._published.pop(cow_id, None)
+        if gone:
+            self.expired += len(gone)
+            log.info("dropped %d cow(s) not reported for %.0fs", len(gone), self.expire_after)
+
+    def frame(self, payload: dict):
+        now = time.monotonic()
+        changed = {}
+        published = self._published
+        reported = self._reported
+        for cow_id, value in payload.items():
+            reported[cow_id] = now
+            if published.get(cow_id) != value:
+                changed[cow_id] = value
+        published.update(changed)
+
+        keyframe = self._last_keyframe is None or now - self._last_keyframe >= self.keyframe_interval
+        if keyframe:
+            self._last_keyframe = now
+            self._expire(now)
+            cows = dict(published)
+            ages = {cow_id: round(now - reported[cow_id], 1) for cow_id in cows if cow_id not in payload}
+            self.seq += 1
+            return {'seq': self.seq, 'keyframe': True, 'cows': cows, 'ages': ages}
+        if not changed:
+            return None
+        self.seq += 1
+        return {'seq': self.seq, 'keyframe': False, 'cows': changed}
+
+
+class DeltaReceiver:
+    def __init__(self, name='delta'):
+        self.name = name
+        self.seq = None
+        self.gaps = 0  # frames missed
+
+    def receive(self, message):
+        """message: decoded JSON -> (cows dict, keyframe). keyframe=True: cows is the whole herd."""
+        if not is_frame(message):
+            return message, False
+
+        seq, keyframe = message.get('seq'), bool(message['keyframe'])
+        if self.seq is not None and isinstance(seq, int) and seq > self.seq + 1:
+            self.gaps += seq - self.seq - 1
+            if not keyframe:
+                log.warning("%s: missed %d frame(s) before seq %d, stale until the next keyframe",
+                            self.name, seq - self.seq - 1, seq)
+        # a lower seq means the publisher restarted: take it as the new baseline
+        self.seq = seq if isinstance(seq, int) else None
+        return message['cows'], keyframe
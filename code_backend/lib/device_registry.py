@@ -0,0 +1,108 @@
+"""
+In-memory index of device_list for the LCD forwarder, so the display loop never queries MySQL.
+
+registry = DeviceRegistry()
+registry.update(rows)                 # [(j_code, label, holder, device_type), ...] -> number of changes
+registry.apply(upserts, removals)     # or just the diff: {j_code: (label, holder, device_type)}, [j_code]
+registry.info('J001')                 # {'label': 'Bed 3', 'holder': 'Alice', 'device_type': 'TrackerD'}
+registry.jcode('Bed 3')               # 'J001'
+registry.labels(alarm_dic)            # labels of the known j_codes, in the order given
+
+Both only touch the entries that were added, changed or removed, and bump `version` when anything
+did. Missing labels and holders read as 'Unknown', a missing device_type as ''.
+
+A registry is not locked: readers share one that is no longer modified, and a writer changes a
+copy() and publishes it (see ConfigCache's snapshots).
+"""
+
+UNKNOWN = 'Unknown'
+
+
+def _entry(label, holder, device_type):
+    return {
+        'label': label if label is not None else UNKNOWN,
+        'holder': holder if holder is not None else UNKNOWN,
+        'device_type': device_type if device_type is not None else '',
+    }
+
+
+class DeviceRegistry:
+    def __init__(self):
+        self._by_jcode = {}  # j_code -> entry
+        self._by_label = {}  # label -> j_code, 'Unknown' labels left out
+        self.version = 0
+        self.loaded = False
+
+    def _unindex(self, j_code, entry, lost):
+        if self._by_label.get(entry['label']) == j_code:
+            del self._by_label[entry['label']]
+            lost.add(entry['label'])
+
+    def _index(self, j_code, entry):
+        if entry['label'] != UNKNOWN:
+            self._by_label[entry['label']] = j_code
+
+    def update(self, rows):
+        """rows: every (j_code, label, holder, device_type) of device_list; returns how many devices changed."""
+        upserts = {j_code: (label, holder, device_type) for j_code, label, holder, device_type in rows
+                   if j_code is not None}
+        removals = [j for j in self._by_jcode if j not in upserts]
+        return self.apply(upserts, removals)
+
+    def apply(self, upserts, removals=()):
+        """upserts: {j_code: (label, holder, device_type)} of changed devices; returns how many changed."""
+        changed = 0
+        lost = set()  # labels whose j_code went away or was relabelled
+        for j_code in removals:
+            old = self._by_jcode.pop(j_code, None)
+            if old is not None:
+                self._unindex(j_code, old, lost)
+                changed += 1
+        for j_code, (label, holder, device_type) in upserts.items():
+            entry = _entry(label, holder, device_type)
+            old = self._by_jcode.get(j_code)
+            if old == entry:
+                continue
+            if old is not None:
+                self._unindex(j_code, old, lost)
+            self._by_jcode[j_code] = entry
+            self._index(j_code, entry)
+            changed += 1
+        lost.difference_update(self._by_label)
+        if lost:
+            # another device may still carry a label that just lost its j_code
+            for j_code, entry in self._by_jcode.items():
+                if entry['label'] in lost and entry['label'] not in self._by_label:
+                    self._by_label[entry['label']] = j_code
+        if changed:
+            self.version += 1
+        self.loaded = True
+        return changed
+
+    def copy(self):
+        other = DeviceRegistry()
+        other._by_jcode = dict(self._by_jcode)  # entries are never changed in place, only replaced
+        other._by_label = dict(self._by_label)
+        other.version = self.version
+        other.loaded = self.loaded
+        return other
+
+    def info(self, j_code):
+        entry = self._by_jcode.get(j_code)
+        return dict(entry) if entry is not None else _entry(None, None, None)
+
+    def jcode(self, label):
+        return self._by_label.get(label)
+
+    def labels(self, j_codes):
+        by_jcode = self._by_jcode
+        return [by_jcode[j]['label'] for j in j_codes if j in by_jcode]
+
+    def label_to_jcode(self):
+        return dict(self._by_label)
+
+    def __len__(self):
+        return len(self._by_jcode)
+
+    def __contains__(self, j_code):
+        return j_code in self._by_jcode
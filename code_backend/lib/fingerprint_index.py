@@ -0,0 +1,168 @@
+"""
+Prebuilt nearest-neighbour index over the RSSI fingerprint database.
+
+index = FingerprintIndex.build(X, y, n_classes, kind='kd_tree', n_neighbors=3)
+index.save('model/weight/fingerprint_index.pkl')
+index = FingerprintIndex.load('model/weight/fingerprint_index.pkl')  # memory-mapped
+grid_codes = index.predict(X_query)
+arrays, meta = index.to_arrays()                            # for lib.artifacts bundles
+
+kind:
+    'kd_tree' / 'ball_tree'  exact search, same votes as KNeighborsClassifier(weights='uniform')
+    'ivf'                    approximate: fingerprints stored as int8 dBm and bucketed by a coarse
+                             k-means quantizer, only the n_probe closest buckets are scanned
+"""
+import pickle
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.neighbors import KDTree, BallTree
+
+INDEX_KINDS = ('kd_tree', 'ball_tree', 'ivf')
+FORMAT_VERSION = 1
+
+
+class FingerprintIndex:
+    def __init__(self, kind, n_neighbors, n_classes, labels, tree=None,
+                 centroids=None, list_offsets=None, codes=None, n_probe=None):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"kind must be one of {INDEX_KINDS}, got {kind!r}")
+        self.kind = kind
+        self.n_neighbors = n_neighbors
+        self.n_classes = n_classes
+        self.labels = labels  # grid code per fingerprint row (bucket order for ivf)
+        self.tree = tree
+        self.centroids = centroids
+        self.list_offsets = list_offsets  # bucket i holds rows list_offsets[i]:list_offsets[i + 1]
+        self.codes = codes
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, X, y, n_classes, kind='kd_tree', n_neighbors=3, leaf_size=30, n_lists=None, n_probe=8):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.int32)
+        if kind == 'kd_tree':
+            return cls(kind, n_neighbors, n_classes, y, tree=KDTree(X, leaf_size=leaf_size))
+        if kind == 'ball_tree':
+            return cls(kind, n_neighbors, n_classes, y, tree=BallTree(X, leaf_size=leaf_size))
+        if kind == 'ivf':
+            from sklearn.cluster import MiniBatchKMeans
+
+            n_lists = n_lists or max(1, int(np.sqrt(len(X))))
+            quantizer = MiniBatchKMeans(n_clusters=n_lists, n_init=3, random_state=0).fit(X)
+            order = np.argsort(quantizer.labels_, kind='stable')
+            list_offsets = np.searchsorted(quantizer.labels_[order], np.arange(n_lists + 1)).astype(np.int64)
+            codes = np.clip(np.rint(X[order]), -128, 127).astype(np.int8)
+            return cls(kind, n_neighbors, n_classes, y[order],
+                       centroids=quantizer.cluster_centers_.astype(np.float32),
+                       list_offsets=list_offsets, codes=codes, n_probe=min(n_probe, n_lists))
+        raise ValueError(f"kind must be one of {INDEX_KINDS}, got {kind!r}")
+
+    def save(self, path):
+        # uncompressed, so every array can be memory-mapped by load()
+        joblib.dump({'format_version': FORMAT_VERSION, **self.__dict__}, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        state = joblib.load(path, mmap_mode=mmap_mode)
+        if state.pop('format_version', None) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported fingerprint index format in {path}")
+        return cls(**state)
+
+    def to_arrays(self):
+        """Flat arrays plus JSON meta; the inverse of from_arrays()."""
+        arrays = {'labels': np.asarray(self.labels)}
+        meta = {'kind': self.kind, 'n_neighbors': int(self.n_neighbors), 'n_classes': int(self.n_classes)}
+        if self.tree is not None:
+            # the tree's pickle state is its node arrays plus a few scalars and the metric object
+            _, _, state = self.tree.__reduce__()
+            objects = {}
+            for i, item in enumerate(state):
+                if isinstance(item, np.ndarray):
+                    arrays[f'tree_state_{i}'] = item
+                else:
+                    objects[i] = item
+            arrays['tree_objects'] = np.frombuffer(pickle.dumps(objects), dtype=np.uint8)
+            meta.update(tree_state_len=len(state), sklearn_version=sklearn.__version__)
+        else:
+            arrays.update(centroids=self.centroids, list_offsets=self.list_offsets, codes=self.codes)
+            meta['n_probe'] = int(self.n_probe)
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """
+        arrays: mapping name -> array, e.g. read-only views into a memory-mapped bundle.
+        Tree node arrays are used in place; if the bundle was written by another scikit-learn
+        version the tree is rebuilt from the stored fingerprints instead.
+        """
+        kind = meta['kind']
+        if kind == 'ivf':
+            return cls(kind, meta['n_neighbors'], meta['n_classes'], arrays['labels'],
+                       centroids=arrays['centroids'], list_offsets=arrays['list_offsets'],
+                       codes=arrays['codes'], n_probe=meta['n_probe'])
+
+        tree_cls = KDTree if kind == 'kd_tree' else BallTree
+        if meta.get('sklearn_version') == sklearn.__version__:
+            objects = pickle.loads(arrays['tree_objects'].tobytes())
+            state = tuple(objects[i] if i in objects else arrays[f'tree_state_{i}']
+                          for i in range(meta['tree_state_len']))
+            tree = tree_cls.__new__(tree_cls)
+            tree.__setstate__(state)
+        else:
+            tree = tree_cls(arrays['tree_state_0'])
+        return cls(kind, meta['n_neighbors'], meta['n_classes'], arrays['labels'], tree=tree)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def kneighbors(self, X):
+        """Row indices (into self.labels) of the n_neighbors closest fingerprints, nearest first."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if self.tree is not None:
+            return self.tree.query(X, k=self.n_neighbors, return_distance=False)
+        return self._ivf_kneighbors(X)
+
+    def _ivf_kneighbors(self, X):
+        k = self.n_neighbors
+        Xq = X.astype(np.float32)
+        n = len(Xq)
+        best_dist = np.full((n, k), np.inf, dtype=np.float32)
+        best_idx = np.zeros((n, k), dtype=np.int64)
+
+        coarse = (Xq ** 2).sum(axis=1)[:, None] - 2 * Xq @ self.centroids.T + (self.centroids ** 2).sum(axis=1)
+        probes = np.argpartition(coarse, self.n_probe - 1, axis=1)[:, :self.n_probe]
+
+        # walk the probed buckets once each, merging their candidates into every query's top-k
+        probe_lists = probes.ravel()
+        probe_queries = np.repeat(np.arange(n), self.n_probe)
+        order = np.argsort(probe_lists, kind='stable')
+        probe_lists, probe_queries = probe_lists[order], probe_queries[order]
+        starts = np.flatnonzero(np.r_[True, probe_lists[1:] != probe_lists[:-1]])
+        ends = np.r_[starts[1:], len(probe_lists)]
+        query_norms = (Xq ** 2).sum(axis=1)
+
+        for start, end in zip(starts, ends):
+            lo, hi = self.list_offsets[probe_lists[start]], self.list_offsets[probe_lists[start] + 1]
+            if hi == lo:
+                continue
+            queries = probe_queries[start:end]
+            members = self.codes[lo:hi].astype(np.float32)
+            dist = query_norms[queries, None] - 2 * Xq[queries] @ members.T + (members ** 2).sum(axis=1)
+            cand_dist = np.concatenate([best_dist[queries], dist], axis=1)
+            cand_idx = np.concatenate([best_idx[queries], np.broadcast_to(np.arange(lo, hi), dist.shape)], axis=1)
+            top = np.argpartition(cand_dist, k - 1, axis=1)[:, :k]
+            best_dist[queries] = np.take_along_axis(cand_dist, top, axis=1)
+            best_idx[queries] = np.take_along_axis(cand_idx, top, axis=1)
+
+        nearest_first = np.argsort(best_dist, axis=1)
+        return np.take_along_axis(best_idx, nearest_first, axis=1)
+
+    def predict(self, X):
+        """Majority vote of the neighbours' grid codes; ties go to the smallest code, as in sklearn."""
+        neighbour_labels = np.asarray(self.labels)[self.kneighbors(X)]
+        n = len(neighbour_labels)
+        flat = neighbour_labels + (np.arange(n) * self.n_classes)[:, None]
+        votes = np.bincount(flat.ravel(), minlength=n * self.n_classes).reshape(n, self.n_classes)
+        return votes.argmax(axis=1)
@@ -0,0 +1,129 @@
+"""
+Array-based RSSI imputation for the KNN positioning model.
+
+tables = ImputationTables.from_maps(grid_names, rssi_cols, grid_mean_map, col_mean_map, fill_value=-106)
+history = GridHistory(n_grids=len(grid_names), maxlen=5)
+rows = history.rows(cow_ids)
+X = tables.fill(X, history.mode(rows))
+history.push(rows, predicted_codes)
+"""
+import numpy as np
+
+
+class ImputationTables:
+    """
+    grid_mean_map / col_mean_map compiled into dense arrays:
+    grid_means[grid_code, col] and col_means[col].
+    """
+
+    def __init__(self, grid_means, col_means):
+        self.grid_means = grid_means
+        self.col_means = col_means
+
+    @classmethod
+    def from_maps(cls, grid_names, rssi_cols, grid_mean_map, col_mean_map, fill_value):
+        col_means = np.array([col_mean_map.get(col, fill_value) for col in rssi_cols], dtype=float)
+        grid_means = grid_mean_map.reindex(index=list(grid_names), columns=rssi_cols).to_numpy(dtype=float)
+        # grids or cells that never had a reading fall back to the column mean
+        return cls(np.where(np.isnan(grid_means), col_means, grid_means), col_means)
+
+    def fill(self, X, fallback_codes):
+        """
+        X: (n, n_cols) float matrix with NaN for missing readings.
+        fallback_codes: (n,) grid code per row, -1 when the row has no history.
+        """
+        missing = np.isnan(X)
+        if not missing.any():
+            return X
+        has_grid = (fallback_codes >= 0)[:, None]
+        fill = np.where(has_grid, self.grid_means[np.maximum(fallback_codes, 0)], self.col_means)
+        return np.where(missing, fill, X)
+
+
+class GridHistory:
+    """
+    Last `maxlen` predicted grid codes per cow, kept as a ring buffer with per-grid counts
+    so the most frequent recent grid is updated incrementally instead of recounted.
+    On a tie the current leader is kept.
+    """
+
+    def __init__(self, n_grids, maxlen, capacity=64):
+        self.n_grids = n_grids
+        self.maxlen = maxlen
+        self._index = {}  # cow_id -> row
+        self._ring = np.full((capacity, maxlen), -1, dtype=np.int32)
+        self._pos = np.zeros(capacity, dtype=np.int32)
+        self._counts = np.zeros((capacity, n_grids), dtype=np.int16)
+        self._mode = np.full(capacity, -1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, cow_id):
+        return cow_id in self._index
+
+    def clear(self):
+        self._index.clear()
+        self._ring.fill(-1)
+        self._pos.fill(0)
+        self._counts.fill(0)
+        self._mode.fill(-1)
+
+    def _grow(self, needed):
+        capacity = len(self._pos)
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - len(self._pos)
+        self._ring = np.vstack([self._ring, np.full((extra, self.maxlen), -1, dtype=np.int32)])
+        self._pos = np.concatenate([self._pos, np.zeros(extra, dtype=np.int32)])
+        self._counts = np.vstack([self._counts, np.zeros((extra, self.n_grids), dtype=np.int16)])
+        self._mode = np.concatenate([self._mode, np.full(extra, -1, dtype=np.int32)])
+
+    def rows(self, cow_ids):
+        """Row index of every cow, registering unseen cows."""
+        index = self._index
+        rows = np.empty(len(cow_ids), dtype=np.int64)
+        for i, cow_id in enumerate(cow_ids):
+            row = index.get(cow_id)
+            if row is None:
+                row = index[cow_id] = len(index)
+            rows[i] = row
+        if len(index) > len(self._pos):
+            self._grow(len(index))
+        return rows
+
+    def mode(self, rows):
+        """Most frequent recent grid code per row, -1 for cows without history."""
+        return self._mode[rows]
+
+    def recent(self, cow_id):
+        """Grid codes of one cow, oldest first."""
+        row = self._index.get(cow_id)
+        if row is None:
+            return []
+        ring = np.roll(self._ring[row], -self._pos[row])
+        return ring[ring >= 0].tolist()
+
+    def push(self, rows, codes):
+        """Append one grid code per row. rows must be unique within one call."""
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.int32)
+        pos = self._pos[rows]
+        evicted = self._ring[rows, pos]
+
+        full = evicted >= 0
+        self._counts[rows[full], evicted[full]] -= 1
+        self._ring[rows, pos] = codes
+        self._counts[rows, codes] += 1
+        self._pos[rows] = (pos + 1) % self.maxlen
+
+        mode = self._mode[rows]
+        new_count = self._counts[rows, codes].astype(np.int32)
+        mode_count = np.where(mode >= 0, self._counts[rows, np.maximum(mode, 0)], 0)
+        mode = np.where(new_count > mode_count, codes, mode)
+
+        # the old leader lost a vote to eviction: only these rows need a full rescan
+        rescan = full & (evicted == mode) & (evicted != codes)
+        if rescan.any():
+            mode[rescan] = self._counts[rows[rescan]].argmax(axis=1)
+        self._mode[rows] = mode
@@ -7,6 +7,13 @@ from logging.handlers import RotatingFileHandler
 import paho.mqtt.client as mqtt
 import time
 
+from lib import metrics
+from lib.alarm_store import AlarmStore
+from lib.delta import DeltaReceiver, frame_ages
+from lib.mqtt_supervisor import MqttSupervisor
+from lib.metrics import LATENCY_MS_BUCKETS
+from lib.wire import KIND_POSITION, WireDecoder, is_binary
+
 # Broker Info
 BROKER = '10.166.179.5'
 PORT = 1883
@@ -14,6 +21,10 @@ USERNAME = ''
 PASSWORD = ''
 TOPIC = "/modelPublish"
 
+# An alarm whose cow has not been reported for this long is dropped as stale (dead tag, lost messages).
+# Keyframes replay silent cows with the age of their last reading, which does not refresh the alarm.
+ALARM_TTL = 120
+
 LOG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs'))
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, 'listenEventlog.log')
@@ -33,17 +44,37 @@ listenEventlog.addHandler(file_handler)
 
 # Global Singleton Variables and Locks
 _client = None
+_supervisor = None  # connects, reconnects (jittered backoff, no retry limit) and resubscribes off the callbacks
 _client_lock = threading.Lock()
 
-# Global Dictionary and Locks
-alarm_dictionary = {}
-_dict_lock = threading.Lock()
+# Alarm state: cows outside the fence -> grid. Consumers subscribe to enter/update/exit events
+# or wait on the version (lib/alarm_store.py); alarm_dictionary is the store's live dict, read it under _dict_lock
+alarm_store = AlarmStore(ttl=ALARM_TTL)
+alarm_dictionary = alarm_store.state
+_dict_lock = alarm_store.lock
+
+# /modelPublish sends only changed cows, with a keyframe of the whole herd now and then
+_receiver = DeltaReceiver('listen_event')
+# ... as JSON, or as binary frames (lib/wire.py) when predict_and_publish.PUBLISH_FORMAT = 'binary'
+_decoder = WireDecoder()
+
+messages_total = metrics.counter('listen_event_messages_total', 'Messages received on TOPIC')
+errors_total = metrics.counter('listen_event_errors_total', 'Messages that failed to decode or apply')
+handle_hist = metrics.histogram('listen_event_handle_ms', LATENCY_MS_BUCKETS, 'on_message decode + apply')
+metrics.gauge('listen_event_alarms', 'Cows currently alarming', fn=lambda: len(alarm_store))
+metrics.counter('listen_event_alarm_changes_total', 'Alarm store version', fn=lambda: alarm_store.version)
+metrics.gauge('listen_event_connected', 'Listener connected and subscribed',
+              fn=lambda: _supervisor is not None and _supervisor.is_connected())
+metrics.counter('listen_event_disconnects_total', 'Lost connections to the broker',
+                fn=lambda: _supervisor.disconnects if _supervisor is not None else 0)
+metrics.counter('listen_event_unresolved_total', 'Binary records dropped for lack of a dictionary',
+                fn=lambda: _decoder.unresolved)
 
 
 def on_connect(client, userdata, flags, rc):
+    # the supervisor subscribes to TOPIC on every successful connect
     if rc == 0:
-        listenEventlog.info("MQTT Connection successful, start subscription %s", TOPIC)
-        client.subscribe(TOPIC, qos=1)
+        listenEventlog.info("MQTT Connection successful, subscribing %s", TOPIC)
     else:
         listenEventlog.error("MQTT Connection failed, return code %s", rc)
 
@@ -51,53 +82,61 @@ def on_connect(client, userdata, flags, rc):
 def on_disconnect(client, userdata, rc):
     listenEventlog.warning("MQTT Disconnected, return code %s", rc)
     if rc != 0:  # not disconnect manually
-        listenEventlog.info("Unexpected disconnection, attempting to reconnect...")
-        retry_count = 0
-        max_retries = 5
-        while retry_count < max_retries:
-            try:
-                client.reconnect()
-                listenEventlog.info("MQTT Reconnection successful")
-                break
-            except Exception as e:
-                retry_count += 1
-                listenEventlog.error("Reconnection failed (%d/%d): %s", retry_count, max_retries, e, exc_info=True)
-                time.sleep(5)
-                if retry_count == max_retries:
-                    listenEventlog.error("Max reconnection attempts reached, stopping retries")
+        listenEventlog.info("Unexpected disconnection, the supervisor is reconnecting...")
 
 
 def on_message(client, userdata, msg):
-    global alarm_dictionary
+    started = time.monotonic()
+    messages_total.inc()
     try:
-        raw = msg.payload.decode()
-        listenEventlog.debug("Receive payload: %s", raw)
-        payload = json.loads(raw)  # {"cow1": [1,1,1], "cow2": [1,2,1], ...}
-
-        if payload:
-            with _dict_lock:
-                for cow_id, grid_fenceInfo in payload.items():
-                    if not isinstance(grid_fenceInfo, list) or len(grid_fenceInfo) < 3:
-                        listenEventlog.error("Invalid grid_fenceInfo for cow %s: %s", cow_id, grid_fenceInfo)
-                        continue
-
-                    grid = grid_fenceInfo[:2]
-                    isOutside = grid_fenceInfo[-1]  # isOutside = 1 -> outside
-
-                    if isOutside == 1:
-                        alarm_dictionary[cow_id] = grid  # {'cow1': [1,1]}
-                        listenEventlog.debug(f"add {cow_id} in alarm_dictionary")
-                    elif isOutside == 0:
-                        if cow_id in alarm_dictionary:
-                            del alarm_dictionary[cow_id]  # alarm_dictionary -> {}
-                            listenEventlog.debug(f"del {cow_id} in alarm_dictionary")
+        if is_binary(msg.payload):
+            kind, message = _decoder.decode(msg.payload)
+            if message is None:
+                return  # dictionary frame
+            if kind != KIND_POSITION:
+                listenEventlog.error("Unexpected binary frame kind %s on %s", kind, msg.topic)
+                return
+            listenEventlog.debug("Receive binary payload: %d bytes", len(msg.payload))
+        else:
+            raw = msg.payload.decode()
+            listenEventlog.debug("Receive payload: %s", raw)
+            message = json.loads(raw)
+        # {"seq": 7, "keyframe": false, "cows": {"cow1": [1,1,1], ...}} or a plain {"cow1": [1,1,1], ...}
+        payload, keyframe = _receiver.receive(message)
+
+        if payload or keyframe:
+            upserts, removals = {}, []
+            if keyframe:
+                # the keyframe lists every cow: alarms of cows it does not know are gone
+                with _dict_lock:
+                    removals = [c for c in alarm_dictionary if c not in payload]
+
+            for cow_id, grid_fenceInfo in payload.items():
+                if not isinstance(grid_fenceInfo, list) or len(grid_fenceInfo) < 3:
+                    listenEventlog.error("Invalid grid_fenceInfo for cow %s: %s", cow_id, grid_fenceInfo)
+                    continue
+
+                grid = grid_fenceInfo[:2]
+                isOutside = grid_fenceInfo[-1]  # isOutside = 1 -> outside
+
+                if isOutside == 1:
+                    upserts[cow_id] = grid  # {'cow1': [1,1]}
+                elif isOutside == 0:
+                    removals.append(cow_id)
+
+            # replayed cows carry the age of their last reading, so they do not keep a dead tag's alarm alive
+            for event in alarm_store.apply(upserts, removals, ages=frame_ages(message)):
+                listenEventlog.debug(f"{event.kind} {event.key} in alarm_dictionary (v{event.version})")
 
     except Exception as e:
+        errors_total.inc()
         listenEventlog.error("on_message dealing failed: %s", e, exc_info=True)
+    finally:
+        handle_hist.observe((time.monotonic() - started) * 1000.0)
 
 
 def start_mqtt_listener(broker_url=BROKER, broker_port=PORT):
-    global _client
+    global _client, _supervisor
     with _client_lock:
         if _client is not None:
             listenEventlog.debug("There is already an MQTT client instance, skip reinitialization")
@@ -112,32 +151,38 @@ def start_mqtt_listener(broker_url=BROKER, broker_port=PORT):
         client.on_disconnect = on_disconnect
         client.on_message = on_message
 
-        try:
-            client.connect(broker_url, broker_port, keepalive=60)
-        except Exception as e:
-            listenEventlog.error("MQTT Connection abnormality: %s", e, exc_info=True)
-            raise
-
-        client.loop_start()
+        # the first connect is retried like any reconnect, so an unreachable broker no longer raises here
+        supervisor = MqttSupervisor(client, broker_url, broker_port, keepalive=60, subscriptions=[(TOPIC, 1)],
+                                    name='listen_event', logger=listenEventlog)
+        metrics.register(supervisor.time_to_recover_hist)
+        supervisor.start()
+        alarm_store.start_expiry()
         _client = client
+        _supervisor = supervisor
         listenEventlog.info("MQTT Listening started (singleton mode)")
         return _client
 
 
+def mqtt_listener_stats():
+    """Connection state, disconnect / connect-attempt counts and time-to-recover of the listener."""
+    return _supervisor.stats() if _supervisor is not None else None
+
+
 def stop_mqtt_listener():
-    global _client
+    global _client, _supervisor
     with _client_lock:
         if _client is None:
             listenEventlog.info("No running MQTT client")
             return
         try:
-            _client.loop_stop()
-            _client.disconnect()
+            _supervisor.stop()
+            alarm_store.stop_expiry()
             listenEventlog.info("MQTT Client stopped")
         except Exception as e:
             listenEventlog.error("Failed to stop MQTT client: %s", e, exc_info=True)
         finally:
             _client = None
+            _supervisor = None
 
 
 if __name__ == "__main__":
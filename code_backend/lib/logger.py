@@ -1,6 +1,12 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, RotatingFileHandler
 import os
+import queue
+import threading
+import time
+
+from lib import metrics
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -11,11 +17,148 @@ LOG_FILE = os.path.join(LOG_DIR, 'app.log')
 LOG_FORMAT = '[%(asctime)s] [%(name)s] [%(levelname)s] [%(filename)s:%(lineno)d] %(message)s'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+# Async mode: the calling thread only puts the record on a queue; a writer thread formats and writes
+# in batches, flushing the file once per batch. A full queue drops the record instead of blocking.
+ASYNC_LOGGING = True
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500         # records written per flush at most
+LOG_FLUSH_INTERVAL = 0.5     # seconds a record may wait for its batch
+
+# Per-module sampling of INFO/DEBUG lines: at most `burst` records per call site (file:line) every
+# `interval` seconds; the next one let through reports how many were suppressed. WARNING and above
+# always pass. The LCD loop logs the alarm count and every write of every LCD several times a second.
+RATE_LIMITS = {
+    'forward_msg_to_lcd': (5, 10.0),  # module: (burst, interval seconds)
+    'annunciator': (5, 10.0),
+}
+
+dropped_total = metrics.counter('log_dropped_total', 'Log records dropped because the log queue was full')
+suppressed_total = metrics.counter('log_suppressed_total', 'Log records suppressed by RATE_LIMITS')
+
+
+class CallSiteSampler(logging.Filter):
+    def __init__(self, limits):
+        super().__init__()
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._sites = {}  # (name, pathname, lineno) -> [window start, passed in window, suppressed]
+
+    def filter(self, record):
+        limit = self.limits.get(record.name)
+        if limit is None or record.levelno >= logging.WARNING:
+            return True
+        burst, interval = limit
+        key = (record.name, record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= interval:
+                suppressed = site[2] if site is not None else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < burst:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                suppressed_total.inc()
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_total.inc()
+
+
+class BatchingRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that writes a list of records and flushes once."""
+
+    def emit_batch(self, records):
+        if self.stream is None:
+            self.stream = self._open()
+        for record in records:
+            try:
+                if self.shouldRollover(record):
+                    self.stream.flush()
+                    self.doRollover()
+                self.stream.write(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        self.stream.flush()
+
+
+class BatchWriter:
+    def __init__(self, log_queue, file_handler, other_handlers=(), batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.queue = log_queue
+        self.file_handler = file_handler
+        self.other_handlers = list(other_handlers)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _take(self):
+        """Block for the first record, then collect until the batch is full or flush_interval passed."""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _write(self, batch):
+        with self.file_handler.lock:
+            self.file_handler.emit_batch([r for r in batch if r.levelno >= self.file_handler.level])
+        for handler in self.other_handlers:
+            for record in batch:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take()
+            if batch:
+                self._write(batch)
+
+    def stop(self):
+        """Write out what is still queued and stop the thread."""
+        self._stop.set()
+        self._thread.join(self.flush_interval * 2 + 1)
+        rest = []
+        while True:
+            try:
+                rest.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if rest:
+            self._write(rest)
+
+
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.DEBUG)
 
 # RotatingFileHandler
-handler = RotatingFileHandler(
+handler = BatchingRotatingFileHandler(
     LOG_FILE,
     maxBytes=1000 * 1024 * 1024,
     backupCount=5,
@@ -23,12 +166,25 @@ handler = RotatingFileHandler(
 )
 handler.setLevel(logging.DEBUG)
 handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
-root_logger.addHandler(handler)
 
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
-root_logger.addHandler(console_handler)
+
+sampler = CallSiteSampler(RATE_LIMITS)
+writer = None
+
+if ASYNC_LOGGING:
+    queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(sampler)
+    root_logger.addHandler(queue_handler)
+    writer = BatchWriter(queue_handler.queue, handler, [console_handler])
+    writer.start()
+    atexit.register(writer.stop)
+else:
+    for h in (handler, console_handler):
+        h.addFilter(sampler)
+        root_logger.addHandler(h)
 
 
 def log_info(module: str, msg: str, *args, **kwargs):
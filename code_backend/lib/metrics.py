@@ -0,0 +1,205 @@
+"""
+Counters, gauges and fixed-bucket histograms for hot-path measurements, and a registry that serves
+them in the Prometheus text format.
+
+hist = Histogram('queue_wait_ms', LATENCY_MS_BUCKETS)
+hist.observe(12.5)
+hist.summary()  # {'count': 1, 'mean': 12.5, 'p50': 12.5, 'p99': 12.5, 'max': 12.5}
+
+sent = metrics.counter('publisher_sent_total', 'Messages handed to the MQTT client')
+sent.inc()
+metrics.gauge('publisher_queued', 'Messages waiting for the flusher', fn=lambda: len(queue))
+metrics.register(hist)              # metrics created elsewhere (Stage, MicroBatcher, ...)
+metrics.serve(9101)                 # GET http://127.0.0.1:9101/metrics
+
+Updating a metric is a lock and an add; nothing is formatted until a scrape asks for it, and gauges
+(or counters) given fn are only evaluated then, so an unscraped registry costs next to nothing.
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """
+    counts[i] holds observations <= bounds[i] (and > bounds[i - 1]); the last slot is +Inf.
+    Quantiles are reported as the upper bound of the bucket they fall in, capped at the largest observation.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, bounds, help=''):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        idx = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        with self._lock:
+            counts, total, largest = list(self.counts), self.count, self.max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for idx, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return min(self.bounds[idx], largest) if idx < len(self.bounds) else largest
+        return largest
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+
+    def samples(self):
+        with self._lock:
+            counts, total, total_sum = list(self.counts), self.count, self.sum
+        cumulative = 0
+        for bound, c in zip(self.bounds, counts):
+            cumulative += c
+            yield f'{self.name}_bucket{{le="{bound}"}}', cumulative
+        yield f'{self.name}_bucket{{le="+Inf"}}', total
+        yield f'{self.name}_sum', total_sum
+        yield f'{self.name}_count', total
+
+
+class Counter:
+    """Monotonic count. fn: read the value from elsewhere at scrape time instead of inc()."""
+    kind = 'counter'
+
+    def __init__(self, name, help='', fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, n=1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge(Counter):
+    """Value that goes up and down: set() it, or pass fn to sample it at scrape time."""
+    kind = 'gauge'
+
+    def set(self, value):
+        self._value = value
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+
+def _format(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value) if value == value else 'NaN'
+    return str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> metric, in registration order
+
+    def register(self, *metrics):
+        """Add metrics; one registered again under the same name replaces the old one. Returns the last."""
+        with self._lock:
+            for metric in metrics:
+                self._metrics[metric.name] = metric
+        return metrics[-1] if metrics else None
+
+    def counter(self, name, help='', fn=None):
+        return self.register(Counter(name, help, fn))
+
+    def gauge(self, name, help='', fn=None):
+        return self.register(Gauge(name, help, fn))
+
+    def histogram(self, name, bounds, help=''):
+        return self.register(Histogram(name, bounds, help))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:  # a broken gauge callback must not take the endpoint down
+                lines.append(f'# {metric.name} unavailable: {e}')
+                continue
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {_format(value)}' for name, value in samples if value is not None)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve render() at http://host:port/metrics from a daemon thread; returns the server."""
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=f'metrics-http-{port}', daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+register = REGISTRY.register
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
+serve = REGISTRY.serve
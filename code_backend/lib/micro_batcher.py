@@ -0,0 +1,107 @@
+"""
+Collect per-cow readings from many messages and hand them to one handler call.
+
+batcher = MicroBatcher(handler, max_wait_ms=50, max_items=2000)
+batcher.start()
+batcher.submit({"cow1": [...], "cow2": [...]})   # from the paho callback, never blocks on the handler
+
+A batch is flushed when its oldest message has waited max_wait_ms, or when it holds max_items cows,
+whichever comes first. A cow seen twice in one window keeps only its newest reading, so the pending
+batch is bounded by the herd size however slow the handler is.
+"""
+import logging
+import threading
+import time
+
+from lib.metrics import REGISTRY, Gauge, Histogram, LATENCY_MS_BUCKETS, SIZE_BUCKETS
+
+log = logging.getLogger('micro_batcher')
+
+
+class MicroBatcher:
+    def __init__(self, handler, max_wait_ms=50, max_items=2000, name='micro_batcher'):
+        self.handler = handler
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_items = max_items
+        self.name = name
+        self.batch_size_hist = Histogram(f'{name}_batch_size', SIZE_BUCKETS)
+        self.queue_wait_hist = Histogram(f'{name}_queue_wait_ms', LATENCY_MS_BUCKETS)
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._arrivals = []  # submit time of every message in the pending batch
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            batch, arrivals = self._take()
+            if batch:
+                self._flush(batch, arrivals)
+
+    def submit(self, items):
+        """items: dict keyed by cow id; later readings of a cow replace earlier ones."""
+        if not items:
+            return
+        with self._cond:
+            self._pending.update(items)
+            self._arrivals.append(time.monotonic())
+            if len(self._arrivals) == 1 or len(self._pending) >= self.max_items:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _take(self):
+        with self._cond:
+            batch, arrivals = self._pending, self._arrivals
+            self._pending, self._arrivals = {}, []
+        return batch, arrivals
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._arrivals:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                deadline = self._arrivals[0] + self.max_wait
+                while self._running and len(self._pending) < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch, arrivals = self._take()
+            if batch:
+                self._flush(batch, arrivals)
+
+    def _flush(self, batch, arrivals):
+        now = time.monotonic()
+        for t in arrivals:
+            self.queue_wait_hist.observe((now - t) * 1000.0)
+        self.batch_size_hist.observe(len(batch))
+        try:
+            self.handler(batch)
+        except Exception as e:
+            log.error("%s handler failed for a batch of %d: %s", self.name, len(batch), e, exc_info=True)
+
+    def stats(self):
+        return {'batch_size': self.batch_size_hist.summary(), 'queue_wait_ms': self.queue_wait_hist.summary()}
+
+    def register_metrics(self, registry=REGISTRY):
+        registry.register(Gauge(f'{self.name}_pending', 'Items waiting for the next flush', fn=self.pending),
+                          self.batch_size_hist, self.queue_wait_hist)
@@ -0,0 +1,331 @@
+"""
+One Modbus TCP connection per device (host:port), shared by every unit ID behind it, with a circuit
+breaker, adaptive timeouts and reconnects done in the background.
+
+sessions = ModbusSessions()
+sessions.start()
+lcd = LCDDisplayModbus(sessions.unit('192.168.2.21', 502, 1), slave_id=1)
+buzzer = BuzzerModbus(sessions.unit('192.168.2.21', 502, 2), slave_id=2)
+
+A unit client stands in for a pyModbusTCP ModbusClient in LCDDisplayModbus / BuzzerModbus; the
+requests of all units of one host take turns on the one socket.
+
+Breaker: CLOSED    requests go through; failure_threshold failures in a row -> OPEN
+         OPEN      requests fail at once without touching the network (is_open is False, writes
+                   return False); the health thread reconnects after a backoff that doubles up to
+                   backoff_max -> HALF_OPEN
+         HALF_OPEN connected again; the next request decides: success -> CLOSED, failure -> OPEN
+New sessions start OPEN and are connected by the health thread straight away.
+
+The request timeout follows the measured round-trip (srtt + 4 * rttvar, like TCP's RTO) within
+[min_timeout, max_timeout], and doubles after a failure. A connected session idle for idle_check
+seconds is probed with one read_holding_registers; an exception response still counts as alive.
+"""
+import logging
+import random
+import threading
+import time
+
+from pyModbusTCP.client import ModbusClient
+from pyModbusTCP.constants import MB_EXCEPT_ERR
+
+from lib.metrics import REGISTRY, Counter, Gauge, Histogram, LATENCY_MS_BUCKETS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+log = logging.getLogger('modbus_sessions')
+
+
+class ModbusSession:
+    def __init__(self, manager, host, port):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.client = manager.client_factory(host=host, port=port, timeout=manager.max_timeout, auto_open=False)
+        self.lock = threading.Lock()  # one request at a time on the socket
+        self.state = OPEN
+        self.failures = 0             # in a row
+        self.backoff = manager.backoff_min
+        self.next_attempt = 0.0
+        self.timeout = manager.max_timeout
+        self.srtt = None
+        self.rttvar = 0.0
+        self.last_used = time.monotonic()
+        self.connects = 0             # successful (re)connects, lets users notice a new connection
+        self.units = set()
+        self.busy = False             # a health thread job is running
+        self.retired = False          # removed from the manager: never connects again
+
+    def __repr__(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def available(self):
+        return self.state != OPEN
+
+    def request(self, unit_id, name, *args):
+        """client.<name>(*args) for unit_id; None (reads) or False (writes) on failure or open circuit."""
+        if self.state == OPEN:
+            return None
+        with self.lock:
+            if self.state == OPEN:
+                return None
+            client = self.client
+            client.unit_id = unit_id
+            client.timeout = self.timeout
+            started = time.monotonic()
+            if not client.is_open and not client.open():
+                result = None
+            else:
+                result = getattr(client, name)(*args)
+            elapsed = time.monotonic() - started
+            self.last_used = time.monotonic()
+            if result is None or result is False:
+                if client.last_error == MB_EXCEPT_ERR:
+                    self._succeeded(elapsed)  # the device answered, just not with data
+                else:
+                    self._failed(client.last_error_as_txt)
+            else:
+                self._succeeded(elapsed)
+        return result
+
+    def open(self):
+        if self.state == OPEN:
+            return False
+        with self.lock:
+            if self.state == OPEN:
+                return False
+            if self.client.is_open:
+                return True
+            self.client.timeout = self.timeout
+            if self.client.open():
+                return True
+            self._failed(self.client.last_error_as_txt)
+            return False
+
+    def close(self):
+        with self.lock:
+            self.client.close()
+
+    def fault(self, reason):
+        """A unit saw a failed write: count it against the breaker unless the request already did."""
+        with self.lock:
+            # request() closes the socket when it counts a failure; still open = the device answered
+            if self.state != OPEN and self.client.is_open:
+                self._failed(reason)
+
+    def retire(self):
+        """Close for good: requests of units still holding the session fail at once, nothing reconnects."""
+        with self.lock:
+            self.retired = True
+            self.state = OPEN
+            self.next_attempt = float('inf')
+            self.client.close()
+
+    def _succeeded(self, elapsed):
+        m = self.manager
+        m.request_hist.observe(elapsed * 1000.0)
+        if self.srtt is None:
+            self.srtt, self.rttvar = elapsed, elapsed / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - elapsed)
+            self.srtt = 0.875 * self.srtt + 0.125 * elapsed
+        self.timeout = min(max(self.srtt + 4 * self.rttvar, m.min_timeout), m.max_timeout)
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.backoff = m.backoff_min
+            log.info("%s: back online (timeout %.2fs)", self, self.timeout)
+
+    def _failed(self, reason):
+        m = self.manager
+        m.failures_total.inc()
+        self.failures += 1
+        self.timeout = min(self.timeout * 2, m.max_timeout)
+        self.client.close()  # a timed-out reply may still arrive and desync the stream
+        if self.state == HALF_OPEN or self.failures >= m.failure_threshold:
+            self._trip(reason)
+
+    def _trip(self, reason):
+        m = self.manager
+        self.state = OPEN
+        self.client.close()
+        self.next_attempt = time.monotonic() + self.backoff * random.uniform(0.8, 1.2)
+        log.warning("%s: circuit open after %d failures (%s), retry in %.1fs",
+                    self, self.failures, reason, self.backoff)
+        self.backoff = min(self.backoff * 2, m.backoff_max)
+        m.trips_total.inc()
+
+    def reconnect(self):
+        """Health thread: one connection attempt for an OPEN session."""
+        m = self.manager
+        with self.lock:
+            if self.retired:
+                return  # removed while this job waited for the lock
+            self.client.timeout = m.connect_timeout
+            if self.client.open():
+                self.state = HALF_OPEN
+                self.failures = 0
+                self.timeout = m.max_timeout if self.srtt is None else self.timeout
+                self.last_used = time.monotonic()
+                self.connects += 1
+                m.reconnects_total.inc()
+                log.info("%s: connected", self)
+            else:
+                self.next_attempt = time.monotonic() + self.backoff * random.uniform(0.8, 1.2)
+                self.backoff = min(self.backoff * 2, m.backoff_max)
+                log.debug("%s: connect failed (%s)", self, self.client.last_error_as_txt)
+
+    def check(self):
+        """Health thread: probe an idle connection with the smallest read."""
+        unit_id = min(self.units) if self.units else 1
+        self.request(unit_id, 'read_holding_registers', 0, 1)
+
+
+class UnitClient:
+    """The ModbusClient subset LCDDisplayModbus and BuzzerModbus use, for one unit of a session."""
+
+    def __init__(self, session, unit_id):
+        self.session = session
+        self._unit_id = unit_id
+        session.units.add(unit_id)
+
+    @property
+    def unit_id(self):
+        return self._unit_id
+
+    @unit_id.setter
+    def unit_id(self, value):
+        self.session.units.discard(self._unit_id)
+        self._unit_id = value
+        self.session.units.add(value)
+
+    @property
+    def is_open(self):
+        return self.session.available and self.session.client.is_open
+
+    def open(self):
+        return self.session.open()
+
+    def close(self):
+        self.session.close()
+
+    def fault(self, reason='write failed'):
+        """Failure path for the device classes instead of close(): the other units keep the socket."""
+        self.session.fault(f"unit {self._unit_id}: {reason}")
+
+    def write_single_register(self, address, value):
+        return bool(self.session.request(self._unit_id, 'write_single_register', address, value))
+
+    def write_multiple_registers(self, address, values):
+        return bool(self.session.request(self._unit_id, 'write_multiple_registers', address, values))
+
+    def read_holding_registers(self, address, count=1):
+        return self.session.request(self._unit_id, 'read_holding_registers', address, count)
+
+    @property
+    def last_error_as_txt(self):
+        return self.session.client.last_error_as_txt if self.session.available else 'circuit open'
+
+    @property
+    def last_except_as_txt(self):
+        return self.session.client.last_except_as_txt
+
+    @property
+    def last_except_as_full_txt(self):
+        return self.session.client.last_except_as_full_txt
+
+
+class ModbusSessions:
+    def __init__(self, connect_timeout=3.0, min_timeout=0.5, max_timeout=3.0, failure_threshold=3,
+                 backoff_min=1.0, backoff_max=60.0, idle_check=30.0, client_factory=ModbusClient):
+        self.connect_timeout = connect_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.failure_threshold = failure_threshold
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.idle_check = idle_check
+        self.client_factory = client_factory
+        self.request_hist = Histogram('modbus_request_ms', LATENCY_MS_BUCKETS)
+        self.failures_total = Counter('modbus_failures_total', 'Failed Modbus requests and connects')
+        self.trips_total = Counter('modbus_breaker_trips_total', 'Sessions whose circuit opened')
+        self.reconnects_total = Counter('modbus_reconnects_total', 'Successful background (re)connects')
+        self._sessions = {}  # (host, port) -> ModbusSession
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def session(self, host, port):
+        with self._lock:
+            session = self._sessions.get((host, port))
+            if session is None:
+                session = self._sessions[(host, port)] = ModbusSession(self, host, port)
+                self._wake.set()
+            return session
+
+    def unit(self, host, port, unit_id):
+        return UnitClient(self.session(host, port), unit_id)
+
+    def remove(self, host, port):
+        """Close and forget a device's session; the other sessions are not touched."""
+        with self._lock:
+            session = self._sessions.pop((host, port), None)
+        if session is not None:
+            session.retire()
+            log.info("%s: removed", session)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def register_metrics(self, registry=REGISTRY):
+        registry.register(
+            Gauge('modbus_sessions', 'Modbus TCP connections managed', fn=lambda: len(self._sessions)),
+            Gauge('modbus_sessions_open', 'Sessions with an open circuit',
+                  fn=lambda: sum(s.state == OPEN for s in self.sessions())),
+            self.request_hist, self.failures_total, self.trips_total, self.reconnects_total)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='modbus-health', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for session in self.sessions():
+            session.close()
+
+    def _job(self, session, fn):
+        try:
+            fn()
+        except Exception:
+            log.exception("%s: health check failed", session)
+        finally:
+            session.busy = False
+
+    def _run(self):
+        # 每个设备的连接/探测在各自的短线程里做，一个连不上的设备不耽误其他设备
+        while not self._stop.is_set():
+            now = time.monotonic()
+            next_due = now + 1.0
+            for session in self.sessions():
+                if session.busy:
+                    continue
+                if session.state == OPEN:
+                    job = session.reconnect if now >= session.next_attempt else None
+                    next_due = min(next_due, session.next_attempt)
+                else:
+                    job = session.check if now - session.last_used >= self.idle_check else None
+                if job is not None:
+                    session.busy = True
+                    threading.Thread(target=self._job, args=(session, job), name=f'modbus-health-{session}',
+                                     daemon=True).start()
+            self._wake.wait(max(0.0, next_due - time.monotonic()))
+            self._wake.clear()
@@ -0,0 +1,186 @@
+"""
+Keeps one paho client connected and subscribed, from a thread of its own.
+
+supervisor = MqttSupervisor(client, broker, port, subscriptions=[("/modelPublish", 1)], logger=log)
+supervisor.start()     # returns at once; connecting and every reconnect happen on the supervisor thread
+...
+supervisor.stop()
+
+The supervisor thread runs the client's network loop. When the connection drops it retries without
+limit: the first attempt is immediate, later ones wait a random delay in [0, min(max_backoff,
+min_backoff * 2 ** n)] ("full jitter", so a fleet of clients does not hammer a restarted broker in
+step). Callbacks never sleep or reconnect, so message handling is never frozen by a retry loop.
+
+Every (re)connect resubscribes to all subscriptions, and a subscription is re-sent if its SUBACK does
+not arrive within subscribe_timeout. The client counts as recovered once every SUBACK is in;
+time_to_recover_hist holds the time from losing the connection to that point.
+"""
+import logging
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from lib.metrics import Histogram, LATENCY_MS_BUCKETS
+
+RECOVERY_MS_BUCKETS = LATENCY_MS_BUCKETS + (30000, 60000, 300000)
+
+
+class MqttSupervisor:
+    def __init__(self, client, host, port, keepalive=60, subscriptions=(), min_backoff=0.1, max_backoff=30.0,
+                 connect_timeout=2.0, subscribe_timeout=5.0, name='mqtt', logger=None):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.subscriptions = list(subscriptions)  # [(topic, qos)]
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.subscribe_timeout = subscribe_timeout
+        self.name = name
+        self.log = logger or logging.getLogger('mqtt_supervisor')
+        client.connect_timeout = connect_timeout  # socket connect; the CONNACK wait below uses it too
+
+        self.time_to_recover_hist = Histogram(f'{name}_time_to_recover_ms', RECOVERY_MS_BUCKETS)
+        self.disconnects = 0
+        self.connect_attempts = 0
+
+        self._connected = False
+        self._ever_connected = False
+        self._down_since = None
+        self._pending_subs = {}  # mid -> (topic, qos)
+        self._subscribe_sent = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+        # chain the owner's callbacks behind ours
+        self._user_on_connect = client.on_connect
+        self._user_on_disconnect = client.on_disconnect
+        self._user_on_subscribe = client.on_subscribe
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_subscribe = self._on_subscribe
+
+    # --- paho callbacks, on the supervisor thread: bookkeeping only, never block ---
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self._connected = True
+            self._ever_connected = True
+            self._subscribe_all()
+        if self._user_on_connect:
+            self._user_on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        was_connected = self._connected
+        self._connected = False
+        self._pending_subs.clear()
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+        # failed reconnect attempts report a disconnect too: pass on only the real loss of a connection
+        if was_connected:
+            self.disconnects += 1
+            if self._user_on_disconnect:
+                self._user_on_disconnect(client, userdata, rc)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        self._pending_subs.pop(mid, None)
+        if not self._pending_subs:
+            self._recovered()
+        if self._user_on_subscribe:
+            self._user_on_subscribe(client, userdata, mid, granted_qos)
+
+    def _subscribe_all(self):
+        self._pending_subs.clear()
+        self._subscribe_sent = time.monotonic()
+        for topic, qos in self.subscriptions:
+            result, mid = self.client.subscribe(topic, qos)
+            if result == mqtt.MQTT_ERR_SUCCESS:
+                self._pending_subs[mid] = (topic, qos)
+            else:
+                self.log.error("%s: subscribe to %s failed, result code %s", self.name, topic, result)
+        if not self.subscriptions:
+            self._recovered()
+
+    def _recovered(self):
+        if self._down_since is not None:
+            elapsed_ms = (time.monotonic() - self._down_since) * 1000.0
+            self.time_to_recover_hist.observe(elapsed_ms)
+            self.log.info("%s: recovered (connected and subscribed) in %.0f ms", self.name, elapsed_ms)
+            self._down_since = None
+
+    # --- supervisor thread ---
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._down_since = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        self._connected = False
+
+    def is_connected(self):
+        return self._connected
+
+    def _backoff(self, attempt):
+        if attempt == 0:
+            return 0.0
+        return random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** (attempt - 1)))
+
+    def _connect_once(self):
+        self.connect_attempts += 1
+        if self._ever_connected:
+            self.client.reconnect()
+        else:
+            self.client.connect(self.host, self.port, keepalive=self.keepalive)
+        # CONNACK is handled by the network loop
+        deadline = time.monotonic() + self.connect_timeout
+        while not self._connected and time.monotonic() < deadline and not self._stop.is_set():
+            if self.client.loop(timeout=0.05) != mqtt.MQTT_ERR_SUCCESS:
+                break
+        return self._connected
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            if not self._connected:
+                if self._stop.wait(self._backoff(attempt)):
+                    break
+                attempt += 1
+                try:
+                    if self._connect_once():
+                        attempt = 0
+                        continue
+                    self.log.warning("%s: no CONNACK from %s:%s (attempt %d)", self.name, self.host, self.port, attempt)
+                except (OSError, mqtt.WebsocketConnectionError) as e:
+                    self.log.warning("%s: connect to %s:%s failed (attempt %d): %s",
+                                     self.name, self.host, self.port, attempt, e)
+                continue
+
+            rc = self.client.loop(timeout=0.1)
+            if rc != mqtt.MQTT_ERR_SUCCESS and self._connected:
+                # connection lost without a disconnect callback (e.g. socket error)
+                self._on_disconnect(self.client, None, rc)
+            elif self._pending_subs and time.monotonic() - self._subscribe_sent >= self.subscribe_timeout:
+                self.log.warning("%s: no SUBACK for %s, subscribing again", self.name,
+                                 [topic for topic, _ in self._pending_subs.values()])
+                self._subscribe_all()
+
+    def stats(self):
+        return {
+            'connected': self._connected,
+            'disconnects': self.disconnects,
+            'connect_attempts': self.connect_attempts,
+            'time_to_recover_ms': self.time_to_recover_hist.summary(),
+        }
@@ -0,0 +1,119 @@
+"""
+Append-only on-disk outbox for messages that must survive a restart (SMS alarms).
+
+outbox = Outbox('outbox/alarmHandler.outbox')
+msg_id = outbox.put({'broker': ..., 'topic': ..., 'payload': ...})   # fsync'ed before it returns
+outbox.ack(msg_id)                                                    # once the broker acknowledged it
+outbox.pending()                                                      # {msg_id: record} not acked yet
+
+One JSON line per event: {"op": "put", "id": 7, "record": {...}} or {"op": "ack", "id": 7}. Opening
+the file replays it, so messages put but never acked before a crash or restart are pending again.
+A torn last line from a crash mid-write is skipped. Once acked lines dominate, the file is rewritten
+with only the pending puts (atomic replace).
+"""
+import base64
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('outbox')
+
+COMPACT_MIN_ACKS = 1000
+
+
+def _encode_payload(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return {'payload_b64': base64.b64encode(bytes(payload)).decode('ascii')}
+    return {'payload': payload}
+
+
+def _decode_payload(record):
+    if 'payload_b64' in record:
+        record = dict(record)
+        record['payload'] = base64.b64decode(record.pop('payload_b64'))
+    return record
+
+
+class Outbox:
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._pending = {}  # id -> record, in put order
+        self._next_id = 1
+        self._acks_in_file = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._replay()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                    msg_id = int(entry['id'])
+                except (ValueError, KeyError, TypeError):
+                    log.warning("%s: skipping unreadable line %d", self.path, n)
+                    continue
+                if entry.get('op') == 'put':
+                    self._pending[msg_id] = _decode_payload(entry['record'])
+                elif entry.get('op') == 'ack':
+                    self._pending.pop(msg_id, None)
+                    self._acks_in_file += 1
+                self._next_id = max(self._next_id, msg_id + 1)
+        if self._pending:
+            log.info("%s: %d message(s) pending from a previous run", self.path, len(self._pending))
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def put(self, record):
+        """record: dict with a str or bytes 'payload'. Returns its id."""
+        stored = dict(record)
+        stored.update(_encode_payload(stored.pop('payload')))
+        with self._lock:
+            msg_id = self._next_id
+            self._next_id += 1
+            self._append({'op': 'put', 'id': msg_id, 'record': stored})
+            self._pending[msg_id] = dict(record)
+        return msg_id
+
+    def ack(self, msg_id):
+        with self._lock:
+            if self._pending.pop(msg_id, None) is None:
+                return
+            self._append({'op': 'ack', 'id': msg_id})
+            self._acks_in_file += 1
+            if self._acks_in_file >= COMPACT_MIN_ACKS and self._acks_in_file > len(self._pending):
+                self._compact()
+
+    def _compact(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for msg_id, record in self._pending.items():
+                stored = dict(record)
+                stored.update(_encode_payload(stored.pop('payload')))
+                f.write(json.dumps({'op': 'put', 'id': msg_id, 'record': stored}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._acks_in_file = 0
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,168 @@
+"""
+Bounded, keyed work queue served by a pool of worker threads.
+
+stage = Stage('imu', handler, workers=1, maxsize=100, merge=keep_newest, overflow='drop_oldest')
+stage.start()
+stage.put('cow1', item)   # from the paho callback: never runs the handler, never waits unless overflow='block'
+
+merge:    f(queued_item, new_item) -> item. When the key is already queued the two are combined in place
+          (e.g. keep only the newest reading per cow) and the queue does not grow. None: every put is queued.
+overflow: what put() does when the queue holds maxsize items and the key is not queued yet
+          'drop_oldest'  evict the item that has waited longest
+          'drop_newest'  refuse the new item
+          'block'        wait up to block_timeout seconds for room, then refuse the new item
+put() returns False when the new item was refused.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lib.metrics import REGISTRY, Counter, Gauge, Histogram, LATENCY_MS_BUCKETS
+
+log = logging.getLogger('pipeline')
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+def keep_newest(queued, new):
+    return new
+
+
+class Stage:
+    def __init__(self, name, handler, workers=1, maxsize=100, merge=None, overflow='drop_oldest',
+                 block_timeout=1.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.merge = merge
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self.queue_wait_hist = Histogram(f'{name}_queue_wait_ms', LATENCY_MS_BUCKETS)
+        self.service_hist = Histogram(f'{name}_service_ms', LATENCY_MS_BUCKETS)
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._cond = threading.Condition()
+        self._queue = OrderedDict()  # key -> [item, enqueue time], oldest first
+        self._busy = set()  # keys being handled right now, so one key is never handled twice at once
+        self._unkeyed = itertools.count()
+        self._running = False
+        self._threads = []
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def qsize(self):
+        with self._cond:
+            return len(self._queue)
+
+    def put(self, key, item):
+        """key: None queues the item on its own, without merging."""
+        if key is None or self.merge is None:
+            key = ('_unkeyed', next(self._unkeyed))
+        with self._cond:
+            entry = self._queue.get(key)
+            if entry is not None:
+                entry[0] = self.merge(entry[0], item)
+                self.merged += 1
+                return True
+
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == 'drop_oldest':
+                    self._queue.popitem(last=False)
+                    self.dropped += 1
+                elif self.overflow == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.maxsize:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            break
+                    if len(self._queue) >= self.maxsize:
+                        self.dropped += 1
+                        return False
+                else:
+                    self.dropped += 1
+                    return False
+
+            self._queue[key] = [item, time.monotonic()]
+            self._cond.notify()
+            return True
+
+    def _next(self):
+        """Oldest queued item whose key is not being handled by another worker."""
+        for key in self._queue:
+            if key not in self._busy:
+                item, enqueued = self._queue.pop(key)
+                return key, item, enqueued
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = None
+                while self._running:
+                    job = self._next()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                key, item, enqueued = job
+                self._busy.add(key)
+                self._cond.notify_all()  # room for a blocked put()
+
+            started = time.monotonic()
+            self.queue_wait_hist.observe((started - enqueued) * 1000.0)
+            try:
+                self.handler(item)
+            except Exception as e:
+                self.failed += 1
+                log.error("%s stage handler failed: %s", self.name, e, exc_info=True)
+            finally:
+                self.service_hist.observe((time.monotonic() - started) * 1000.0)
+                with self._cond:
+                    self._busy.discard(key)
+                    self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'queued': self.qsize(),
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queue_wait_ms': self.queue_wait_hist.summary(),
+            'service_ms': self.service_hist.summary(),
+        }
+
+    def register_metrics(self, registry=REGISTRY):
+        """Expose queue depth, merge/drop/failure counts and both histograms on a metrics registry."""
+        registry.register(
+            Gauge(f'{self.name}_queued', 'Items waiting for a worker', fn=self.qsize),
+            Counter(f'{self.name}_merged_total', 'Items merged into one already queued', fn=lambda: self.merged),
+            Counter(f'{self.name}_dropped_total', 'Items dropped by the overflow policy', fn=lambda: self.dropped),
+            Counter(f'{self.name}_failed_total', 'Items whose handler raised', fn=lambda: self.failed),
+            self.queue_wait_hist,
+            self.service_hist,
+        )
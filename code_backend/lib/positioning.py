@@ -0,0 +1,86 @@
+"""
+Everything predict_and_publish needs to turn RSSI rows into grids, loaded either from the
+legacy pickles in model/weight/ or from a single artifact bundle (see lib.artifacts).
+
+positioning = PositioningModel.from_pickles('model/weight', rssi_cols, fill_value=-106)
+positioning.write_bundle('model/weight/positioning.bundle', version='2025.08')
+positioning = PositioningModel.from_bundle(load_bundle('model/weight/positioning.bundle'))
+"""
+import os
+
+import numpy as np
+
+from lib.fingerprint_index import FingerprintIndex
+from lib.imputation import ImputationTables
+
+INDEX_PREFIX = 'index/'
+
+
+class PositioningModel:
+    def __init__(self, model, grid_names, grid_is_out, grid_xy, imputation, rssi_cols, version=None):
+        self.model = model                # anything with predict(X) -> encoded grid ids
+        self.grid_names = grid_names      # encoded grid id -> "x_y"
+        self.grid_is_out = grid_is_out    # encoded grid id -> 1 if the grid is outside the fence
+        self.grid_xy = grid_xy            # encoded grid id -> [x, y]
+        self.imputation = imputation
+        self.rssi_cols = rssi_cols
+        self.version = version
+
+    @classmethod
+    def from_pickles(cls, weight_dir, rssi_cols, fill_value):
+        import joblib
+
+        grid_encoder = joblib.load(os.path.join(weight_dir, 'grid_label_encoder.pkl'))
+        label_map = joblib.load(os.path.join(weight_dir, 'grid_to_label_mapping.pkl'))
+        col_mean_map = joblib.load(os.path.join(weight_dir, 'global_column_means.pkl'))
+        grid_mean_map = joblib.load(os.path.join(weight_dir, 'grid_mean_map.pkl'))
+
+        # prebuilt, memory-mapped neighbour index from build_fingerprint_index.py, else the pickled KNN model
+        index_path = os.path.join(weight_dir, 'fingerprint_index.pkl')
+        if os.path.exists(index_path):
+            model = FingerprintIndex.load(index_path)
+        else:
+            model = joblib.load(os.path.join(weight_dir, 'knn_model.pkl'))
+
+        grid_names = [str(g) for g in grid_encoder.classes_]
+        return cls(
+            model=model,
+            grid_names=grid_names,
+            grid_is_out=np.array([1 if label_map.get(g) == 'out' else 0 for g in grid_names], dtype=np.int64),
+            grid_xy=np.array([list(map(int, g.split('_'))) for g in grid_names], dtype=np.int64),
+            imputation=ImputationTables.from_maps(grid_names, rssi_cols, grid_mean_map, col_mean_map, fill_value),
+            rssi_cols=list(rssi_cols),
+        )
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        meta = bundle.meta
+        index_arrays = {name[len(INDEX_PREFIX):]: bundle[name] for name in bundle.names(INDEX_PREFIX)}
+        return cls(
+            model=FingerprintIndex.from_arrays(index_arrays, meta['index']),
+            grid_names=meta['grid_names'],
+            grid_is_out=bundle['grid_is_out'],
+            grid_xy=bundle['grid_xy'],
+            imputation=ImputationTables(bundle['grid_means'], bundle['col_means']),
+            rssi_cols=meta['rssi_cols'],
+            version=bundle.version,
+        )
+
+    def write_bundle(self, path, version):
+        from lib.artifacts import write_bundle
+
+        index = self.model
+        if not isinstance(index, FingerprintIndex):
+            # a fitted KNeighborsClassifier: keep its fingerprints and k, store them as a KD-tree
+            index = FingerprintIndex.build(index._fit_X, index._y, len(self.grid_names),
+                                           kind='kd_tree', n_neighbors=index.n_neighbors)
+        index_arrays, index_meta = index.to_arrays()
+        arrays = {INDEX_PREFIX + name: arr for name, arr in index_arrays.items()}
+        arrays.update(
+            grid_is_out=self.grid_is_out,
+            grid_xy=self.grid_xy,
+            grid_means=self.imputation.grid_means,
+            col_means=self.imputation.col_means,
+        )
+        meta = {'grid_names': list(self.grid_names), 'rssi_cols': list(self.rssi_cols), 'index': index_meta}
+        return write_bundle(path, arrays, meta, version=version)
@@ -1,24 +1,59 @@
 """
 publisher.push_message(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, payload)
+publisher.push_message(BROKER, PORT, USERNAME, PASSWORD, SMS_TOPIC, payload, durable=True)  # survives restarts
+publisher.push_encoded(DATABASE_BROKER, DATABASE_PORT, USERNAME, PASSWORD, TOPIC, encoder, cows)  # lib.wire binary
+
+push_message never blocks on the network: it queues the message and returns. A background flusher
+publishes queued messages in batches over the pooled clients and retries failures with jittered
+exponential backoff. Durable messages are appended to an on-disk outbox (lib/outbox.py) before
+push_message returns, sent with QoS 1 and dropped from the outbox only when the broker acks them,
+so they are re-sent after a crash or restart. Other messages are kept in a bounded in-memory queue
+and given up after MAX_ATTEMPTS. The outbox file is only opened by programs that send durable
+messages: by start() at startup, or by their first durable push_message.
+
+Since the publish itself happens later on the flusher, push_message returns (rc, None): rc says
+whether the message was queued, there is no MQTT mid to return yet.
 """
+import atexit
+import heapq
+import random
+import sys
 import time
-import traceback
 import threading
+from collections import deque
 import paho.mqtt.client as mqtt
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 
+from lib import metrics
+from lib.metrics import LATENCY_MS_BUCKETS
+from lib.outbox import Outbox
+
 _clients = {}
 _clients_lock = threading.Lock()
 MQTT_KEEPALIVE = 60
+MQTT_MAX_INFLIGHT = 20  # QoS>0 messages awaiting broker ack
+MQTT_MAX_QUEUED = 1000  # messages waiting in the client's outgoing queue, 0 = unbounded
+
+PUBLISH_QUEUE_SIZE = 10000   # non-durable messages waiting for the flusher; beyond this push_message refuses
+FLUSH_BATCH = 200            # messages published per flusher pass
+MAX_ATTEMPTS = 3             # non-durable messages are dropped after this many failed publishes
+RETRY_MIN_BACKOFF = 0.5      # seconds; doubled per attempt, jittered, capped at RETRY_MAX_BACKOFF
+RETRY_MAX_BACKOFF = 30.0
+ACK_TIMEOUT = 30.0           # durable message without PUBACK after this long is logged (the client re-sends it)
+FLUSH_ON_EXIT_TIMEOUT = 5.0  # seconds the interpreter waits at exit for queued messages
 
 LOG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs'))
 os.makedirs(LOG_DIR, exist_ok=True)
 LOG_FILE = os.path.join(LOG_DIR, 'publisherlog.log')
 
+# one outbox per program, so a restarted alarmHandler picks up exactly its own unsent SMS
+OUTBOX_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'outbox'))
+OUTBOX_NAME = os.path.splitext(os.path.basename(sys.argv[0] or ''))[0] or 'publisher'
+
 liblog = logging.getLogger('publisherlog')
-liblog.setLevel(logging.DEBUG)
+liblog.setLevel(logging.INFO)  # DEBUG adds a line (with the payload) per published message
 
 file_handler = RotatingFileHandler(
     LOG_FILE,
@@ -42,37 +77,262 @@ def _get_client(broker, port, username=None, password=None):
                 client.username_pw_set(username, password)
             client.on_connect = lambda c, u, f, rc: liblog.info(f"MQTT({broker}:{port}) connected, rc={rc}")
             client.on_disconnect = lambda c, u, rc: liblog.warning(f"MQTT({broker}:{port}) disconnected, rc={rc}")
+            client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+            client.max_queued_messages_set(MQTT_MAX_QUEUED)
             client.connect(broker, port, keepalive=MQTT_KEEPALIVE)  # Use synchronous connect
             client.loop_start()
             _clients[key] = client
         return _clients[key]
 
-def push_message(broker, port, username, password, topic, payload, qos=0, retain=False):
-    """
-    According to the incoming connection parameters, first get the corresponding Client, then publish.
-    If an error occurs, try to reconnect and resend up to 3 times with delays.
-    """
-    client = _get_client(broker, port, username, password)
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            result, mid = client.publish(topic, payload, qos, retain)
-            if result == mqtt.MQTT_ERR_SUCCESS:
-                liblog.info(f"Successfully published to {topic}: {payload}")
-                return (result, mid)
+class _Message:
+    __slots__ = ('key', 'topic', 'payload', 'qos', 'retain', 'outbox_id', 'attempts', 'next_try', 'queued_at')
+
+    def __init__(self, key, topic, payload, qos, retain, outbox_id=None):
+        self.key = key
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.outbox_id = outbox_id
+        self.attempts = 0
+        self.next_try = 0.0
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return self.next_try < other.next_try
+
+    def describe(self):
+        if isinstance(self.payload, (bytes, bytearray)):
+            return f"<{len(self.payload)} bytes>"
+        return self.payload
+
+
+class _Flusher:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = deque()  # messages ready to publish, oldest first
+        self._queued_volatile = 0
+        self._retries = []  # heap of messages waiting for their backoff to pass
+        self._inflight = []  # [message, MQTTMessageInfo, sent at, overdue] of durable messages awaiting PUBACK
+        self._outbox = None
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='publisher-flusher', daemon=True)
+                self._thread.start()
+
+    def open_outbox(self):
+        """Open the outbox, queueing what a previous run left unacknowledged."""
+        with self._cond:
+            if self._outbox is None:
+                self._outbox = Outbox(os.path.join(OUTBOX_DIR, f'{OUTBOX_NAME}.outbox'))
+                for msg_id, record in self._outbox.pending().items():
+                    self._queue.append(_Message(tuple(record['key']), record['topic'], record['payload'],
+                                                record['qos'], record['retain'], outbox_id=msg_id))
+                self._cond.notify()
+            return self._outbox
+
+    def submit(self, key, topic, payload, qos, retain, durable):
+        self.start()
+        if durable:
+            self.open_outbox()
+            qos = max(qos, 1)  # PUBACK is what clears it from the outbox
+            # fsync'ed here, outside the condition, so other callers and the flusher don't wait on the disk
+            outbox_id = self._outbox.put({'key': list(key), 'topic': topic, 'payload': payload,
+                                          'qos': qos, 'retain': retain})
+        with self._cond:
+            if durable:
+                self._queue.append(_Message(key, topic, payload, qos, retain, outbox_id))
+            elif self._queued_volatile >= PUBLISH_QUEUE_SIZE:
+                dropped_total.inc()
+                liblog.warning(f"Publish queue full ({PUBLISH_QUEUE_SIZE}), dropped message to {topic}")
+                return mqtt.MQTT_ERR_QUEUE_SIZE
             else:
-                liblog.error(f"Publish to {topic} failed, result code: {result}")
-                raise Exception(f"Publish failed with code {result}")
+                self._queue.append(_Message(key, topic, payload, qos, retain))
+                self._queued_volatile += 1
+            self._cond.notify()
+            return mqtt.MQTT_ERR_SUCCESS
+
+    def _retry(self, msg, reason):
+        failed_total.inc()
+        msg.attempts += 1
+        if msg.outbox_id is None and msg.attempts >= MAX_ATTEMPTS:
+            dropped_total.inc()
+            liblog.error(f"Max retries reached, giving up on {msg.topic}: {reason}")
+            return
+        backoff = min(RETRY_MAX_BACKOFF, RETRY_MIN_BACKOFF * 2 ** (msg.attempts - 1))
+        msg.next_try = time.monotonic() + random.uniform(backoff / 2, backoff)
+        liblog.warning(f"Publish to {msg.topic} failed (attempt {msg.attempts}): {reason}, "
+                       f"retrying in {msg.next_try - time.monotonic():.1f}s")
+        with self._cond:
+            heapq.heappush(self._retries, msg)
+
+    def _send(self, msg):
+        broker, port = msg.key[0], msg.key[1]
+        try:
+            client = _get_client(*msg.key)
         except Exception as e:
-            liblog.error(f"[{broker}:{port}] Publish error (attempt {attempt + 1}/{max_retries}): {e}")
-            traceback.print_exc()
-            if attempt < max_retries - 1:
-                liblog.info(f"Attempting to reconnect and retry...")
-                try:
-                    client.reconnect()
-                    time.sleep(1)  # Wait before retry
-                except Exception as e2:
-                    liblog.error(f"Reconnect failed: {e2}")
-            else:
-                liblog.error(f"Max retries reached, giving up on {topic}")
-                return (mqtt.MQTT_ERR_NO_CONN, None)
\ No newline at end of file
+            self._retry(msg, f"[{broker}:{port}] connect failed: {e}")
+            return
+        if msg.outbox_id is not None and not client.is_connected():
+            # kept out of the client's queue while the broker is down: the outbox holds it until reconnect
+            self._retry(msg, f"[{broker}:{port}] not connected")
+            return
+        info = client.publish(msg.topic, msg.payload, msg.qos, msg.retain)
+        # QoS>0 while disconnected stays in the client's queue and goes out after its reconnect; only
+        # a non-durable message may rely on that, a durable one needs an info that can report its PUBACK
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or \
+                (msg.outbox_id is None and msg.qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            sent_total.inc()
+            queue_wait_hist.observe((time.monotonic() - msg.queued_at) * 1000.0)
+            if liblog.isEnabledFor(logging.DEBUG):
+                liblog.debug(f"Successfully published to {msg.topic}: {msg.describe()}")
+            if msg.outbox_id is not None:
+                self._inflight.append([msg, info, time.monotonic(), False])
+        else:
+            self._retry(msg, f"result code {info.rc}")
+
+    def _check_inflight(self):
+        now = time.monotonic()
+        waiting = []
+        for entry in self._inflight:
+            msg, info, sent_at, overdue = entry
+            if info.is_published():
+                self._outbox.ack(msg.outbox_id)
+                acked_total.inc()
+                ack_hist.observe((now - sent_at) * 1000.0)
+                continue
+            if not overdue and now - sent_at >= ACK_TIMEOUT:
+                # not published again: the client still holds it and re-sends it after its reconnect,
+                # a second publish would deliver it twice. It stays in the outbox until acked.
+                entry[3] = True
+                liblog.warning(f"No PUBACK for {msg.topic} within {ACK_TIMEOUT:.0f}s, "
+                               f"left to the MQTT client's redelivery")
+            waiting.append(entry)
+        self._inflight = waiting
+
+    def _take(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._retries and self._retries[0].next_try <= now:
+                    self._queue.append(heapq.heappop(self._retries))
+                if self._queue:
+                    batch = [self._queue.popleft() for _ in range(min(FLUSH_BATCH, len(self._queue)))]
+                    self._queued_volatile -= sum(1 for msg in batch if msg.outbox_id is None and msg.attempts == 0)
+                    return batch
+                if self._inflight:
+                    return []
+                timeout = self._retries[0].next_try - now if self._retries else None
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._take()
+                for msg in batch:
+                    try:
+                        self._send(msg)
+                    except Exception as e:
+                        self._retry(msg, e)
+                if self._inflight:
+                    self._check_inflight()
+                    if not batch:
+                        time.sleep(0.05)
+            except Exception:
+                # the flusher must outlive any one message, or everything queued after it is stuck
+                liblog.exception("Publisher flusher error")
+                time.sleep(0.05)
+
+    def idle(self):
+        with self._cond:
+            return not (self._queue or self._retries or self._inflight)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'retrying': len(self._retries),
+                'inflight': len(self._inflight),
+                'outbox_pending': len(self._outbox) if self._outbox is not None else 0,
+                'sent': sent_total.value,
+                'acked': acked_total.value,
+                'dropped': dropped_total.value,
+                'queue_wait_ms': queue_wait_hist.summary(),
+            }
+
+
+_flusher = _Flusher()
+
+sent_total = metrics.counter('publisher_sent_total', 'Messages handed to the MQTT client')
+failed_total = metrics.counter('publisher_failed_total', 'Publish attempts that failed and were retried or dropped')
+dropped_total = metrics.counter('publisher_dropped_total', 'Messages given up on (queue full or out of attempts)')
+acked_total = metrics.counter('publisher_acked_total', 'Durable messages acked by the broker')
+queue_wait_hist = metrics.histogram('publisher_queue_wait_ms', LATENCY_MS_BUCKETS,
+                                    'push_message to publish, including retries')
+ack_hist = metrics.histogram('publisher_ack_ms', LATENCY_MS_BUCKETS, 'Durable message publish to PUBACK')
+metrics.gauge('publisher_queued', 'Messages ready for the flusher', fn=lambda: len(_flusher._queue))
+metrics.gauge('publisher_retrying', 'Messages waiting out a retry backoff', fn=lambda: len(_flusher._retries))
+metrics.gauge('publisher_inflight', 'Durable messages awaiting PUBACK', fn=lambda: len(_flusher._inflight))
+metrics.gauge('publisher_outbox_pending', 'Durable messages not yet acked, on disk',
+              fn=lambda: len(_flusher._outbox) if _flusher._outbox is not None else 0)
+
+
+def start():
+    """
+    For programs that send durable messages: replay the outbox and start the flusher now instead
+    of on the first durable push_message, so messages left unacknowledged by a previous run go out
+    even if nothing new is sent.
+    """
+    _flusher.open_outbox()
+    _flusher.start()
+
+
+def push_message(broker, port, username, password, topic, payload, qos=0, retain=False, durable=False):
+    """
+    Queue a message for the background flusher and return at once.
+    durable=True: written to the on-disk outbox first and published with QoS 1 until the broker acks it,
+    across restarts; use it for alarms / SMS.
+    Returns (MQTT_ERR_SUCCESS, None) when queued, (MQTT_ERR_QUEUE_SIZE, None) when the queue is full;
+    unlike client.publish there is no mid, the message is only published later by the flusher.
+    """
+    result = _flusher.submit((broker, port, username, password), topic, payload, qos, retain, durable)
+    return (result, None)
+
+
+def flush(timeout=None):
+    """Wait until every queued message has been published (and durable ones acked); False on timeout."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not _flusher.idle():
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def stats():
+    return _flusher.stats()
+
+
+def _flush_at_exit():
+    if not flush(FLUSH_ON_EXIT_TIMEOUT):
+        liblog.warning(f"Exiting with unsent messages: {stats()}")
+
+
+atexit.register(_flush_at_exit)
+
+
+def push_encoded(broker, port, username, password, topic, encoder, payload, qos=0, retain=False, **frame_args):
+    """
+    Publish a cow map in the binary format of lib.wire: encoder is a WireEncoder, frame_args
+    (seq, keyframe, framed) go to encoder.encode. A dictionary frame goes out first when one is due.
+    Returns the result of the last publish; stops at the first frame that fails.
+    """
+    result = (mqtt.MQTT_ERR_SUCCESS, None)
+    for frame in encoder.encode(payload, **frame_args):
+        result = push_message(broker, port, username, password, topic, frame, qos, retain)
+        if result[0] != mqtt.MQTT_ERR_SUCCESS:
+            break
+    return result
@@ -0,0 +1,93 @@
+"""
+Per-cow HMM filter over the grid adjacency graph, to stop single-reading boundary jitter
+from turning into "out" / "in" flips on /modelPublish.
+
+smoother = GridSmoother(positioning.grid_xy, stay_prob=0.9, hit_prob=0.6)
+rows = history.rows(cow_ids)                 # same row numbering as lib.imputation.GridHistory
+smoothed_codes = smoother.step(rows, predicted_codes)
+
+Hidden state: the grid a cow is really in. Each step a cow stays put with stay_prob or moves to a
+neighbouring grid (within one grid pitch on x/y, see adjacency()); the KNN reports the true grid
+with hit_prob, a neighbouring grid otherwise. The filtered belief of every cow is one row of a float32 array, so a
+batch is updated with one matrix product; the published grid is the most likely state. With the
+defaults a cow needs two consecutive readings in a neighbouring grid before it is moved there (up to
+four next to grids with many neighbours); benchmarks/bench_smoothing.py checks this on the real grid.
+"""
+import numpy as np
+
+JUMP_PROB = 1e-3  # non-adjacent moves / misreads, so the filter can always recover from a wrong belief
+
+
+def adjacency(grid_xy):
+    """
+    (n_grids, n_grids) bool, True for distinct grids that touch (including diagonally).
+
+    Grid centres are not on a unit lattice (the fenced area has a pitch of 2, the outer grids sit
+    further out), so "touching" is measured against the layout itself: two grids are neighbours
+    when their Chebyshev distance is at most the grid pitch, the median nearest-neighbour distance.
+    A grid with nothing that close is linked to its nearest grid(s) instead, so no grid is isolated.
+    """
+    grid_xy = np.asarray(grid_xy, dtype=np.float64)
+    d = np.abs(grid_xy[:, None, :] - grid_xy[None, :, :]).max(axis=2)
+    if len(d) < 2:
+        return np.zeros(d.shape, dtype=bool)
+    np.fill_diagonal(d, np.inf)
+    nearest = d.min(axis=1)
+    pitch = np.median(nearest)
+    reach = np.maximum(nearest, pitch)[:, None] + 1e-9
+    adj = d <= reach
+    return adj | adj.T
+
+
+def _kernel(adj, center):
+    """Row-stochastic matrix: `center` on the diagonal, the rest spread over neighbours, JUMP_PROB over all grids."""
+    n = len(adj)
+    degree = adj.sum(axis=1, keepdims=True)
+    near = np.where(degree > 0, adj / np.maximum(degree, 1), 0.0)
+    k = center * np.eye(n) + (1.0 - center - JUMP_PROB) * near + JUMP_PROB / n
+    # a grid without neighbours keeps the mass it could not hand out
+    k[np.arange(n), np.arange(n)] += np.where(degree[:, 0] == 0, 1.0 - center - JUMP_PROB, 0.0)
+    return k
+
+
+class GridSmoother:
+    def __init__(self, grid_xy, stay_prob=0.9, hit_prob=0.6, capacity=64):
+        adj = adjacency(grid_xy)
+        self.n_grids = len(adj)
+        self.transition = _kernel(adj, stay_prob).astype(np.float32)     # [from, to]
+        # likelihood[observed, state] = P(KNN reports `observed` | cow is in `state`)
+        self.likelihood = _kernel(adj, hit_prob).T.astype(np.float32).copy()
+        self._belief = np.zeros((capacity, self.n_grids), dtype=np.float32)
+        self._seen = np.zeros(capacity, dtype=bool)
+        self.corrected = 0  # readings whose published grid differs from the raw prediction
+
+    def _grow(self, needed):
+        capacity = len(self._seen)
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - len(self._seen)
+        self._belief = np.vstack([self._belief, np.zeros((extra, self.n_grids), dtype=np.float32)])
+        self._seen = np.concatenate([self._seen, np.zeros(extra, dtype=bool)])
+
+    def clear(self):
+        self._belief.fill(0)
+        self._seen.fill(False)
+
+    def step(self, rows, codes):
+        """One new raw grid code per row -> smoothed grid code per row. rows must be unique within one call."""
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.int64)
+        if len(rows) and rows.max() >= len(self._seen):
+            self._grow(int(rows.max()) + 1)
+
+        evidence = self.likelihood[codes]
+        prior = self._belief[rows] @ self.transition
+        # first reading of a cow: nothing to smooth against
+        belief = np.where(self._seen[rows, None], prior * evidence, evidence)
+        belief /= belief.sum(axis=1, keepdims=True)
+
+        self._belief[rows] = belief
+        self._seen[rows] = True
+        smoothed = belief.argmax(axis=1)
+        self.corrected += int((smoothed != codes).sum())
+        return smoothed
@@ -0,0 +1,137 @@
+"""
+Incremental refresh of a small DB table: a cheap version marker is checked first and rows are only
+fetched when it moved; the caller gets the rows that changed, keyed, instead of the whole table.
+
+watch = TableWatcher(engine, 'device_list', "SELECT j_code, label, holder, device_type FROM device_list",
+                     key=0, marker=checksum_marker('device_list'))
+upserts, removals = watch.poll()      # ({key: row tuple}, [keys]); both empty when nothing changed
+watch.rows                            # {key: row tuple} as of the last poll
+watch.rollback()                      # forget the last poll, e.g. when its changes could not be applied
+
+Markers (the query must return one row; any change to it means "re-read"):
+    checksum_marker(table)                  CHECKSUM TABLE, needs no schema change (MySQL)
+    updated_at_marker(table, column, where) COUNT(*) + MAX(column) over the rows matching where (the
+                                            query's own filter); with since_query only rows newer
+                                            than the last MAX are fetched, and a count that does not
+                                            add up (deleted rows) falls back to a full read
+    version_table_marker(table, vtable)     a trigger-maintained version counter per table
+A table whose marker query fails (other engine, no permission) is re-read in full on every poll.
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from lib.db_rows import stream_on
+
+log = logging.getLogger('table_watch')
+
+
+def checksum_marker(table):
+    return f"CHECKSUM TABLE {table}"
+
+
+def updated_at_marker(table, column='updated_at', where=None):
+    """where: the watched query's filter, so COUNT(*) counts the rows it returns."""
+    marker = f"SELECT COUNT(*), MAX({column}) FROM {table}"
+    return f"{marker} WHERE {where}" if where else marker
+
+
+def version_table_marker(table, version_table='config_version'):
+    return text(f"SELECT version FROM {version_table} WHERE table_name = :table").bindparams(table=table)
+
+
+class TableWatcher:
+    def __init__(self, engine, name, query, key=0, marker=None, since_query=None):
+        """
+        query: full read of the table. key: column index (or tuple of indices) identifying a row.
+        marker: SQL string or sqlalchemy text() with its parameters bound (see the *_marker helpers).
+        since_query: optional read of rows with updated_at >= :since, for updated_at_marker (>= so rows
+        updated in the same second as the last poll are not missed; unchanged ones drop out of the diff).
+        """
+        self.engine = engine
+        self.name = name
+        self.query = text(query)
+        self.key = key
+        self.marker = text(marker) if isinstance(marker, str) else marker
+        self.since_query = text(since_query) if since_query else None
+        self.rows = {}
+        self.loaded = False
+        self.full_reads = 0
+        self.partial_reads = 0
+        self.skipped = 0
+        self._marker_value = None
+        self._undo = None  # (marker, loaded, {key: row before the last poll, None if it was new})
+
+    def _key(self, row):
+        if isinstance(self.key, tuple):
+            return tuple(row[i] for i in self.key)
+        return row[self.key]
+
+    def _read_marker(self, conn):
+        if self.marker is None:
+            return None
+        try:
+            return tuple(conn.execute(self.marker).fetchone() or ())
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                raise  # the DB is gone, not the marker: fail this poll, keep the marker
+            log.warning("%s: version marker unavailable, reading the table on every poll: %s", self.name, e)
+            self.marker = None
+            return None
+
+    def _diff(self, fetched, full):
+        upserts = {}
+        seen = set()
+        for row in fetched:
+            row = tuple(row)
+            key = self._key(row)
+            seen.add(key)
+            if self.rows.get(key) != row:
+                upserts[key] = row
+        # a partial read only has the updated rows: nothing can be told removed from it
+        removals = [key for key in self.rows if key not in seen] if full else []
+        previous = {key: self.rows.get(key) for key in upserts}
+        for key in removals:
+            previous[key] = self.rows.pop(key)
+        self.rows.update(upserts)
+        self._undo = (self._marker_value, self.loaded, previous)
+        return upserts, removals
+
+    def rollback(self):
+        """Undo the last poll(), so the next one reports its changes again."""
+        if self._undo is None:
+            return
+        self._marker_value, self.loaded, previous = self._undo
+        for key, row in previous.items():
+            if row is None:
+                self.rows.pop(key, None)
+            else:
+                self.rows[key] = row
+        self._undo = None
+
+    def poll(self):
+        """Fetch what changed since the last poll; returns (upserts, removals)."""
+        with self.engine.connect() as conn:
+            marker = self._read_marker(conn)
+            if self.loaded and marker is not None and marker == self._marker_value:
+                self.skipped += 1
+                self._undo = None
+                return {}, []
+            full = True
+            if self.loaded and self.since_query is not None and marker is not None \
+                    and self._marker_value is not None and self._marker_value[1] is not None:
+                fetched = list(stream_on(conn, self.since_query, {'since': self._marker_value[1]}))
+                new_keys = sum(1 for row in fetched if self._key(tuple(row)) not in self.rows)
+                # no deletions iff the row count grew by exactly the number of new keys
+                if len(self.rows) + new_keys == marker[0]:
+                    full = False
+                    self.partial_reads += 1
+            if full:
+                # rows go straight from the cursor into the diff
+                fetched = stream_on(conn, self.query)
+                self.full_reads += 1
+            upserts, removals = self._diff(fetched, full)
+        self._marker_value = marker
+        self.loaded = True
+        return upserts, removals
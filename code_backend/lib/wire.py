@@ -0,0 +1,198 @@
+"""
+Versioned binary encoding for /BLEPublish (RSSI) and /modelPublish (positions), as an optional
+alternative to JSON. Subscribers tell the two apart by the first two bytes (MAGIC), so both can
+share a topic during a migration.
+
+Every frame starts with a 16-byte header:
+    magic b'VF' | version u8 | kind u8 | flags u16 | epoch u32 | seq u32 | 2 pad bytes
+(seq is the delta frame number for positions and the number of names for dictionary frames)
+followed by fixed-width little-endian records that decode with one numpy.frombuffer call:
+    KIND_RSSI      cow u16, rssi i8 x 6          (dBm rounded to 1 dB, -128 = no reading)
+    KIND_POSITION  cow u16, x i8, y i8, out u8, age u8
+                                                 (age: seconds since a keyframe-replayed cow was last
+                                                 reported, 0 = in this payload, max 255; see lib.delta)
+    KIND_DICTIONARY  cow ids, utf-8, NUL separated; record `cow` indexes this list
+
+Cow ids are sent once in a dictionary frame instead of in every message. The encoder sends one
+before the first data frame, whenever a new cow appears and every dictionary_interval seconds, so a
+subscriber that joins late can decode within that interval. The epoch (random per encoder) names
+the dictionary a frame belongs to: a decoder keeps one per epoch, so frames of several publishers on
+one topic decode side by side, and a restarted publisher simply starts a new one.
+
+encoder = WireEncoder(KIND_POSITION)
+for frame in encoder.encode({"cow1": [3, 4, 0]}, seq=12, keyframe=False):
+    client.publish(topic, frame)
+
+decoder = WireDecoder()
+kind, message = decoder.decode(frame)   # message is None for dictionary frames
+"""
+import random
+import struct
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+MAGIC = b'VF'
+VERSION = 2  # 2: position records gained `age`; version 1 frames are still decoded
+HEADER = struct.Struct('<2sBBHII2x')
+
+KIND_DICTIONARY = 0
+KIND_RSSI = 1
+KIND_POSITION = 2
+
+FLAG_FRAMED = 1     # position frame carries delta seq / keyframe (lib.delta), else a plain cow map
+FLAG_KEYFRAME = 2
+
+RSSI_MISSING = -128
+RSSI_WIDTH = 6
+MAX_COWS = 1 << 16
+
+RECORD_DTYPES = {
+    KIND_RSSI: np.dtype([('cow', '<u2'), ('rssi', 'i1', (RSSI_WIDTH,))]),
+    KIND_POSITION: np.dtype([('cow', '<u2'), ('x', 'i1'), ('y', 'i1'), ('out', 'u1'), ('age', 'u1')]),
+}
+RECORD_DTYPES_V1 = {
+    KIND_RSSI: RECORD_DTYPES[KIND_RSSI],
+    KIND_POSITION: np.dtype([('cow', '<u2'), ('x', 'i1'), ('y', 'i1'), ('out', 'u1')]),
+}
+
+
+def is_binary(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:2]) == MAGIC
+
+
+class WireEncoder:
+    def __init__(self, kind, dictionary_interval=30.0):
+        if kind not in RECORD_DTYPES:
+            raise ValueError(f"unknown record kind {kind}")
+        self.kind = kind
+        self.dtype = RECORD_DTYPES[kind]
+        self.dictionary_interval = dictionary_interval
+        self.epoch = random.getrandbits(32)
+        self._index = {}  # cow_id -> record index
+        self._names = []
+        self._dictionary_sent = None
+
+    def _cow_indices(self, cow_ids):
+        index = self._index
+        grew = False
+        out = np.empty(len(cow_ids), dtype=np.uint16)
+        for i, cow_id in enumerate(cow_ids):
+            idx = index.get(cow_id)
+            if idx is None:
+                if len(self._names) >= MAX_COWS:
+                    raise ValueError(f"more than {MAX_COWS} cows do not fit a u16 cow index")
+                idx = index[cow_id] = len(self._names)
+                self._names.append(cow_id)
+                grew = True
+            out[i] = idx
+        return out, grew
+
+    def dictionary_frame(self):
+        self._dictionary_sent = time.monotonic()
+        body = '\0'.join(str(name) for name in self._names).encode('utf-8')
+        return HEADER.pack(MAGIC, VERSION, KIND_DICTIONARY, 0, self.epoch, len(self._names)) + body
+
+    def encode(self, payload: dict, seq=0, keyframe=False, framed=False, ages=None):
+        """
+        payload: {cow_id: [6 RSSI values, None for missing]} or {cow_id: [x, y, is_out]}
+        ages: positions only, {cow_id: seconds since last reported} of replayed cows (lib.delta keyframes)
+        return: list of frames to publish in order (a dictionary frame first when one is due)
+        """
+        cow_ids = list(payload)
+        records = np.zeros(len(cow_ids), dtype=self.dtype)
+        records['cow'], grew = self._cow_indices(cow_ids)
+
+        values = list(payload.values())
+        if self.kind == KIND_RSSI:
+            rssi = np.array(values, dtype=float).reshape(len(cow_ids), RSSI_WIDTH)
+            rssi = np.where(np.isnan(rssi), RSSI_MISSING, np.clip(np.rint(rssi), -127, 127))
+            records['rssi'] = rssi.astype(np.int8)
+        elif values:
+            xyo = np.array(values, dtype=np.int64)
+            records['x'], records['y'], records['out'] = xyo[:, 0], xyo[:, 1], xyo[:, 2]
+            if ages:
+                # a replayed cow never reads as "reported now", however young its reading
+                records['age'] = [min(255, max(1, int(round(ages[c])))) if c in ages else 0 for c in cow_ids]
+
+        flags = (FLAG_FRAMED if framed else 0) | (FLAG_KEYFRAME if keyframe else 0)
+        frames = []
+        if grew or self._dictionary_sent is None or \
+                time.monotonic() - self._dictionary_sent >= self.dictionary_interval:
+            frames.append(self.dictionary_frame())
+        frames.append(HEADER.pack(MAGIC, VERSION, self.kind, flags, self.epoch, seq) + records.tobytes())
+        return frames
+
+
+class WireDecoder:
+    def __init__(self, max_epochs=16):
+        # one dictionary per publisher (epoch), so several encoders can share a topic or a decoder;
+        # the least recently used is forgotten beyond max_epochs (a restarted publisher's old epoch)
+        self.max_epochs = max_epochs
+        self.dictionaries = OrderedDict()  # epoch -> np.ndarray of cow ids, indexed by record `cow`
+        self.unresolved = 0  # records dropped because their dictionary had not arrived yet
+
+    def records(self, buf):
+        """(kind, flags, seq, names, records): records is a read-only structured view into buf."""
+        magic, version, kind, flags, epoch, seq = HEADER.unpack_from(buf)
+        if magic != MAGIC:
+            raise ValueError("not a binary frame")
+        if version not in (1, VERSION):
+            raise ValueError(f"unsupported binary frame version {version}")
+        if kind == KIND_DICTIONARY:
+            body = bytes(buf[HEADER.size:]).decode('utf-8')
+            names = body.split('\0') if body else []
+            if len(names) != seq:
+                raise ValueError(f"dictionary frame holds {len(names)} names, header says {seq}")
+            self.dictionaries[epoch] = np.array(names, dtype=object)
+            self.dictionaries.move_to_end(epoch)
+            while len(self.dictionaries) > self.max_epochs:
+                self.dictionaries.popitem(last=False)
+            return kind, flags, seq, None, None
+        dtype = (RECORD_DTYPES if version == VERSION else RECORD_DTYPES_V1).get(kind)
+        if dtype is None:
+            raise ValueError(f"unknown record kind {kind}")
+        records = np.frombuffer(buf, dtype=dtype, offset=HEADER.size)
+        names = self.dictionaries.get(epoch)
+        if names is None:
+            # no dictionary from this publisher yet (or it restarted): nothing can be named
+            self.unresolved += len(records)
+            records = records[:0]
+        else:
+            self.dictionaries.move_to_end(epoch)
+            known = records['cow'] < len(names)
+            if not known.all():
+                self.unresolved += int((~known).sum())
+                records = records[known]
+        return kind, flags, seq, names, records
+
+    def decode(self, buf):
+        """
+        KIND_RSSI      -> {cow_id: float32 array of 6, NaN for missing}
+        KIND_POSITION  -> {cow_id: [x, y, is_out]}, wrapped as a lib.delta frame (with the ages of
+                          replayed cows) when the encoder framed it
+        KIND_DICTIONARY -> None
+        """
+        dropped = self.unresolved
+        kind, flags, seq, names, records = self.records(buf)
+        if records is None:
+            return kind, None
+        # a keyframe missing unresolved cows is not the whole herd any more
+        complete = self.unresolved == dropped
+        cow_ids = names[records['cow']].tolist() if len(records) else []
+        if kind == KIND_RSSI:
+            rssi = records['rssi'].astype(np.float32)
+            rssi[records['rssi'] == RSSI_MISSING] = np.nan
+            return kind, dict(zip(cow_ids, rssi))
+        xyo = np.stack([records['x'], records['y'], records['out']], axis=1).astype(np.int64).tolist()
+        cows = dict(zip(cow_ids, xyo))
+        if flags & FLAG_FRAMED:
+            frame = {'seq': seq, 'keyframe': bool(flags & FLAG_KEYFRAME) and complete, 'cows': cows}
+            if 'age' in records.dtype.names:
+                replayed = records['age'] > 0
+                if replayed.any():
+                    frame['ages'] = dict(zip(np.array(cow_ids, dtype=object)[replayed].tolist(),
+                                             records['age'][replayed].astype(float).tolist()))
+            return kind, frame
+        return kind, cows
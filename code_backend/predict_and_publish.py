@@ -1,89 +1,242 @@
 import json
-import pandas as pd
-import joblib
+import os
+import threading
+import time
+import numpy as np
 import paho.mqtt.client as mqtt
-from collections import defaultdict, deque, Counter
-from lib import publisher
+from lib import metrics, publisher
+from lib.artifacts import load_bundle
+from lib.delta import DeltaEncoder
+from lib.imputation import GridHistory
+from lib.metrics import LATENCY_MS_BUCKETS
+from lib.micro_batcher import MicroBatcher
+from lib.pipeline import Stage
+from lib.positioning import PositioningModel
+from lib.smoothing import GridSmoother
+from lib.wire import KIND_POSITION, KIND_RSSI, WireDecoder, WireEncoder, is_binary
 
 # === MQTT Configuration ===
 MQTT_BROKER = '10.166.179.5'
 MQTT_PORT = 1883
+USERNAME = None
+PASSWORD = None
 PUBLISH_TOPIC = "/modelPublish"
 SUBSCRIBE_TOPIC = "/BLEPublish"
 
-# === Load model and mappings ===
-model = joblib.load('model/weight/knn_model.pkl')
-grid_encoder = joblib.load('model/weight/grid_label_encoder.pkl')
-label_map = joblib.load('model/weight/grid_to_label_mapping.pkl')
-col_mean_map = joblib.load('model/weight/global_column_means.pkl')
-grid_mean_map = joblib.load('model/weight/grid_mean_map.pkl')
+# === Change-only publishing (lib/delta.py): only cows whose grid or out-status changed, plus keyframes ===
+DELTA_PUBLISHING = True
+KEYFRAME_INTERVAL = 30    # seconds; every cow is republished with the first batch after this
+COW_EXPIRY = 300          # seconds; a cow not reported for this long is left out of keyframes
+
+# === Payload encoding (lib/wire.py): 'json', or 'binary' for the compact versioned frames ===
+# /BLEPublish accepts both whatever this is set to; this only picks what /modelPublish carries
+# (lib/listen_event.py and code_frontend/receiveData.js decode either)
+PUBLISH_FORMAT = 'json'
+
+# === Micro-batching of /BLEPublish messages ===
+BATCH_WINDOW_MS = 50      # flush when the oldest message has waited this long...
+BATCH_MAX_COWS = 2000     # ...or when this many cows are pending, whichever comes first
+STATS_INTERVAL = 60       # seconds between per-stage latency reports
+METRICS_PORT = 9101       # Prometheus text at http://127.0.0.1:9101/metrics, None to disable
+
+# === Inference stage: batches wait here while the worker is busy, merged so each cow keeps its newest reading ===
+# one worker, so batches reach the grid history (and subscribers) in arrival order
+PREDICT_WORKERS = 1
+
+# === Model artifacts ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEIGHT_DIR = os.path.join(BASE_DIR, 'model', 'weight')
+BUNDLE_PATH = os.path.join(WEIGHT_DIR, 'positioning.bundle')  # built by build_artifact_bundle.py
 
 # === Constants ===
 SPECIAL_FILL_VALUE = -106
 GRID_HISTORY_LEN = 5
 
+# === Temporal smoothing of published grids (lib/smoothing.py) ===
+SMOOTHING = True
+SMOOTH_STAY_PROB = 0.9    # chance a cow is still in the same grid at the next reading
+SMOOTH_HIT_PROB = 0.6     # chance the KNN reports the grid the cow is really in
+
 # === RSSI column names (with receiver info) ===
 rssi_cols = ['RSSI_0_0', 'RSSI_0_8', 'RSSI_8_0', 'RSSI_8_8', 'RSSI_16_0', 'RSSI_16_8']
 
-# === Sliding window: recent predicted grids for each device ===
-cow_grid_history = defaultdict(
-    lambda: deque(maxlen=GRID_HISTORY_LEN))  # key: cow_id, value: list of previous predicted grids
+# === Loaded on first use by get_positioning() ===
+_positioning = None
+_positioning_lock = threading.Lock()
+
+# === Sliding window: recent predicted grid ids for each device, with a rolling mode ===
+cow_grid_history = None
+# === Filtered grid belief for each device, rows shared with cow_grid_history ===
+grid_smoother = None
 
-# === Missing value imputation using recent grid or column mean ===
-def fill_missing_with_grid_or_column_mean(rssi_series, cow_id, col_mean_map, grid_mean_map):
-    filled = rssi_series.copy()
-    history = cow_grid_history[cow_id]
-    fallback_grid = Counter(history).most_common(1)[0][0] if history else None
 
-    for col in filled.index:
-        if pd.isna(filled[col]):
-            if fallback_grid and fallback_grid in grid_mean_map.index and col in grid_mean_map.columns:
-                filled[col] = grid_mean_map.at[fallback_grid, col]
-            else:
-                filled[col] = col_mean_map.get(col, SPECIAL_FILL_VALUE)
-    return filled
+def get_positioning():
+    """
+    Model, grid tables and imputation tables, loaded once on first use.
+    The memory-mapped artifact bundle is preferred; the separate pickles are the fallback.
+    """
+    global _positioning, cow_grid_history, grid_smoother
+    if _positioning is None:
+        with _positioning_lock:
+            if _positioning is None:
+                if os.path.exists(BUNDLE_PATH):
+                    positioning = PositioningModel.from_bundle(load_bundle(BUNDLE_PATH))
+                    print(f"Loaded positioning bundle version {positioning.version}")
+                else:
+                    positioning = PositioningModel.from_pickles(WEIGHT_DIR, rssi_cols, SPECIAL_FILL_VALUE)
+                    print("Loaded positioning model from pickles")
+                if list(positioning.rssi_cols) != rssi_cols:
+                    raise ValueError(f"Model expects RSSI columns {positioning.rssi_cols}, not {rssi_cols}")
+                cow_grid_history = GridHistory(n_grids=len(positioning.grid_names), maxlen=GRID_HISTORY_LEN)
+                grid_smoother = GridSmoother(positioning.grid_xy, SMOOTH_STAY_PROB, SMOOTH_HIT_PROB)
+                _positioning = positioning
+    return _positioning
+
+
+# === Missing value imputation using recent grid or column mean (whole batch) ===
+def fill_missing_with_grid_or_column_mean(X, rows):
+    """
+    X: (n_cows, n_cols) float matrix, NaN where a receiver reported nothing.
+    rows: cow_grid_history rows of the cows in X.
+    Missing cells take the mean RSSI of the cow's most frequent recent grid,
+    or the global column mean when the cow has no history.
+    """
+    return get_positioning().imputation.fill(X, cow_grid_history.mode(rows))
 
 
 # === Prediction and MQTT publishing ===
-def predict_and_publish(input_data: dict):
+def predict_batch(input_data: dict):
     """
+    Predict grids for every cow of one message with a single model.predict call.
     input_data: dict, such as {"cow1": [RSSI_0_0, RSSI_0_8, ..., RSSI_16_8]}
+    return: dict, such as {"cow1": [grid_x, grid_y, is_out]}
     """
-    payload = {}
-
+    cow_ids = []
+    vectors = []
     for cow_id, rssi_vector in input_data.items():
-        if len(rssi_vector) != len(rssi_cols):
+        if not isinstance(rssi_vector, (list, tuple, np.ndarray)) or len(rssi_vector) != len(rssi_cols):
             print(f"Skipping {cow_id} due to incorrect vector length")
             continue
-        rssi_series = pd.Series(rssi_vector, index=rssi_cols, dtype=float)
-
-        # === Handle missing values ===
-        if rssi_series.isna().any():
-            print(f"Missing values detected in {cow_id}, filling with history Grid or column mean...")
-            rssi_series = fill_missing_with_grid_or_column_mean(rssi_series, cow_id, col_mean_map, grid_mean_map)
-
-        X_input = rssi_series.values.reshape(1, -1)
-
-        try:
-            pred_grid_encoded = model.predict(X_input)[0]
-            pred_grid = grid_encoder.inverse_transform([pred_grid_encoded])[0]
-            is_out = 1 if label_map.get(pred_grid) == 'out' else 0
-            # === Update sliding window history ===
-            cow_grid_history[cow_id].append(pred_grid)
-            grid_x, grid_y = map(int, pred_grid.split('_'))
-            payload[cow_id] = [grid_x, grid_y, is_out]
-        except Exception as e:
-            print(f"Prediction error for {cow_id}: {e}")
-
-    # === Publish message via MQTT ===
-    client = mqtt.Client()
-    client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
+        cow_ids.append(cow_id)
+        vectors.append(rssi_vector)
+
+    if not cow_ids:
+        return {}
+
+    positioning = get_positioning()
+    try:
+        X = np.array(vectors, dtype=float)
+    except (TypeError, ValueError) as e:
+        print(f"Invalid RSSI values in message: {e}")
+        return {}
+
+    rows = cow_grid_history.rows(cow_ids)
+
+    # === Handle missing values ===
+    if np.isnan(X).any():
+        print(f"Missing values detected in {int(np.isnan(X).any(axis=1).sum())} cows, "
+              f"filling with history Grid or column mean...")
+        X = fill_missing_with_grid_or_column_mean(X, rows)
+
+    try:
+        pred_encoded = np.asarray(positioning.model.predict(X))
+    except Exception as e:
+        print(f"Prediction error for batch of {len(cow_ids)} cows: {e}")
+        return {}
 
-    message = json.dumps(payload)
-    client.publish(PUBLISH_TOPIC, message)
-    print("Published to topic:", PUBLISH_TOPIC)
-    print("Payload:", json.dumps(payload))
-    client.disconnect()
+    # === Update sliding window history (raw predictions, they drive imputation) ===
+    cow_grid_history.push(rows, pred_encoded)
+
+    # === Publish the filtered grid, not every raw jump across a boundary ===
+    if SMOOTHING:
+        pred_encoded = grid_smoother.step(rows, pred_encoded)
+
+    is_out = positioning.grid_is_out[pred_encoded].tolist()
+    xy = positioning.grid_xy[pred_encoded].tolist()
+    return {cow_id: [xy[i][0], xy[i][1], is_out[i]] for i, cow_id in enumerate(cow_ids)}
+
+
+# === Per-stage latency: decode (paho thread) -> batch window -> inference queue -> predict -> publish ===
+decode_hist = metrics.histogram('ble_decode_ms', LATENCY_MS_BUCKETS, 'Decoding one /BLEPublish message')
+predict_hist = metrics.histogram('predict_ms', LATENCY_MS_BUCKETS, 'Inference (with smoothing) of one batch')
+publish_hist = metrics.histogram('publish_ms', LATENCY_MS_BUCKETS, 'Encoding and queueing one /modelPublish')
+ble_messages_total = metrics.counter('ble_messages_total', 'Messages received on /BLEPublish')
+ble_errors_total = metrics.counter('ble_errors_total', 'Messages on /BLEPublish that could not be decoded')
+cows_predicted_total = metrics.counter('cows_predicted_total', 'Cow readings the model predicted a grid for')
+published_total = metrics.counter('model_published_total', 'Payloads queued for /modelPublish')
+publish_failures_total = metrics.counter('model_publish_failures_total', 'Payloads the publisher refused')
+
+
+delta_encoder = DeltaEncoder(KEYFRAME_INTERVAL, expire_after=COW_EXPIRY)
+position_encoder = WireEncoder(KIND_POSITION, dictionary_interval=KEYFRAME_INTERVAL)
+ble_decoder = WireDecoder()  # one dictionary per RSSI publisher (epoch)
+
+
+def predict_and_publish(input_data: dict):
+    """
+    input_data: dict, such as {"cow1": [RSSI_0_0, RSSI_0_8, ..., RSSI_16_8]}
+    """
+    started = time.monotonic()
+    payload = predict_batch(input_data)
+    predicted = time.monotonic()
+    cows_predicted_total.inc(len(payload))  # rows the model ran on; skipped or failed cows are not in it
+    predict_hist.observe((predicted - started) * 1000.0)
+
+    if DELTA_PUBLISHING:
+        payload = delta_encoder.frame(payload)
+        if payload is None:
+            return  # no cow changed grid or out-status, no keyframe due
+
+    # === Publish message via the pooled, long-lived MQTT client ===
+    if PUBLISH_FORMAT == 'binary':
+        if DELTA_PUBLISHING:
+            cows, frame_args = payload['cows'], dict(seq=payload['seq'], keyframe=payload['keyframe'], framed=True,
+                                                     ages=payload.get('ages'))
+        else:
+            cows, frame_args = payload, {}
+        message = f"<binary, {len(cows)} cows>"
+        result = publisher.push_encoded(MQTT_BROKER, MQTT_PORT, USERNAME, PASSWORD, PUBLISH_TOPIC,
+                                        position_encoder, cows, **frame_args)
+    else:
+        message = json.dumps(payload)
+        result = publisher.push_message(MQTT_BROKER, MQTT_PORT, USERNAME, PASSWORD, PUBLISH_TOPIC, message)
+    publish_hist.observe((time.monotonic() - predicted) * 1000.0)
+    if result[0] == mqtt.MQTT_ERR_SUCCESS:
+        published_total.inc()
+        print("Published to topic:", PUBLISH_TOPIC)
+        print("Payload:", message)
+    else:
+        publish_failures_total.inc()
+        print(f"Failed to publish to {PUBLISH_TOPIC}, error code: {result[0]}")
+
+
+def merge_batches(queued: dict, new: dict):
+    queued.update(new)
+    return queued
+
+
+# === Batch window -> inference worker(s) -> one merged /modelPublish payload per batch ===
+# A batch that arrives while inference is still running is merged into the one already waiting
+# (newest reading per cow), so a slow model delays publishing instead of growing a backlog.
+predict_stage = Stage('predict', predict_and_publish, workers=PREDICT_WORKERS, maxsize=1,
+                      merge=merge_batches, overflow='drop_oldest')
+batcher = MicroBatcher(lambda batch: predict_stage.put('herd', batch), max_wait_ms=BATCH_WINDOW_MS,
+                       max_items=BATCH_MAX_COWS, name='ble_batcher')
+predict_stage.register_metrics()
+batcher.register_metrics()
+metrics.counter('smoothing_corrected_total', 'Readings the grid smoother changed',
+                fn=lambda: grid_smoother.corrected if grid_smoother is not None else 0)
+
+
+def pipeline_stats():
+    return {
+        'decode_ms': decode_hist.summary(),
+        'batcher': batcher.stats(),
+        'predict_stage': predict_stage.stats(),
+        'predict_ms': predict_hist.summary(),
+        'smoothing_corrected': grid_smoother.corrected if grid_smoother is not None else 0,
+        'publish_ms': publish_hist.summary(),
+    }
 
 
 # === MQTT Connection and Subscription ===
@@ -96,31 +249,58 @@ def on_connect(client, userdata, flags, rc):
         print(f"Connection failed with code {rc}")
 
 
-# === Handle incoming messages ===
+# === Handle incoming messages: decode and hand over, inference runs on the predict stage workers ===
 def on_message(client, userdata, msg):
+    started = time.monotonic()
+    ble_messages_total.inc()
     try:
-        payload_str = msg.payload.decode('utf-8')
-        input_data = json.loads(payload_str)
+        if is_binary(msg.payload):
+            kind, input_data = ble_decoder.decode(msg.payload)
+            if input_data is None:
+                return  # dictionary frame: cow ids for the frames that follow
+            if kind != KIND_RSSI:
+                print(f"Ignoring binary frame of kind {kind} on {SUBSCRIBE_TOPIC}")
+                return
+        else:
+            payload_str = msg.payload.decode('utf-8')
+            input_data = json.loads(payload_str)
         # {"cow1": [RSSI_0_0, RSSI_0_8, ..., RSSI_16_8]}
-        print("Received message:")
-        print(json.dumps(input_data, indent=2))
-
-        predict_and_publish(input_data)
+        if not isinstance(input_data, dict):
+            print(f"Ignoring message that is not a cow map: {type(input_data).__name__}")
+            return
+        print(f"Received message with {len(input_data)} cows")
+        batcher.submit(input_data)
 
     except Exception as e:
+        ble_errors_total.inc()
         print(f"Error handling message: {e}")
+    finally:
+        decode_hist.observe((time.monotonic() - started) * 1000.0)
 
 
 # === Start MQTT Listener ===
 def start_mqtt_listener():
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        print(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+    predict_stage.start()
+    batcher.start()
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
 
     client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
+    client.loop_start()
     print("MQTT Listener started...")
 
-    client.loop_forever()
+    try:
+        while True:
+            time.sleep(STATS_INTERVAL)
+            print(f"Pipeline stats: {pipeline_stats()}")
+    finally:
+        client.loop_stop()
+        batcher.stop()
+        predict_stage.stop()
 
 
 # === Entry point ===
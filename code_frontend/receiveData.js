@@ -13,6 +13,70 @@ let mqttClient = null;
 // Store latest cow data
 let latestCowData = [];
 
+// Per-cow state built from frames: {seq, keyframe, cows} carries only changed cows unless keyframe is true
+let cowState = {};
+let lastSeq = null;
+
+// Binary frames (code_backend/lib/wire.py, PUBLISH_FORMAT = 'binary'): 16-byte header
+// magic "VF" | version u8 | kind u8 | flags u16 | epoch u32 | seq u32 | 2 pad, little-endian
+const WIRE_HEADER_SIZE = 16;
+const WIRE_KIND_DICTIONARY = 0;
+const WIRE_KIND_POSITION = 2;
+const WIRE_FLAG_FRAMED = 1;
+const WIRE_FLAG_KEYFRAME = 2;
+const WIRE_MAX_EPOCHS = 16;
+// cow id dictionary per publisher epoch, oldest first
+const wireDictionaries = new Map();
+
+function isBinaryFrame(bytes) {
+    return bytes.length >= WIRE_HEADER_SIZE && bytes[0] === 0x56 && bytes[1] === 0x46;  // "VF"
+}
+
+// Returns null for dictionary frames, else the same object the JSON payload would have parsed to
+function decodeBinaryFrame(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const version = view.getUint8(2);
+    const kind = view.getUint8(3);
+    const flags = view.getUint16(4, true);
+    const epoch = view.getUint32(6, true);
+    const seq = view.getUint32(10, true);
+    if (version !== 1 && version !== 2) {
+        throw new Error(`unsupported binary frame version ${version}`);
+    }
+
+    if (kind === WIRE_KIND_DICTIONARY) {
+        const body = new TextDecoder('utf-8').decode(bytes.subarray(WIRE_HEADER_SIZE));
+        wireDictionaries.delete(epoch);
+        wireDictionaries.set(epoch, body ? body.split('\0') : []);
+        while (wireDictionaries.size > WIRE_MAX_EPOCHS) {
+            wireDictionaries.delete(wireDictionaries.keys().next().value);
+        }
+        return null;
+    }
+    if (kind !== WIRE_KIND_POSITION) {
+        throw new Error(`unexpected binary frame kind ${kind}`);
+    }
+
+    // record: cow u16, x i8, y i8, out u8 (+ age u8 from version 2)
+    const recordSize = version === 1 ? 5 : 6;
+    const names = wireDictionaries.get(epoch);
+    const cows = {};
+    let complete = names !== undefined;
+    for (let off = WIRE_HEADER_SIZE; off + recordSize <= bytes.length; off += recordSize) {
+        const index = view.getUint16(off, true);
+        if (names === undefined || index >= names.length) {
+            complete = false;  // dictionary not received yet
+            continue;
+        }
+        cows[names[index]] = [view.getInt8(off + 2), view.getInt8(off + 3), view.getUint8(off + 4)];
+    }
+    if (!(flags & WIRE_FLAG_FRAMED)) {
+        return cows;
+    }
+    // a keyframe missing cows we cannot name yet must not wipe them from the map
+    return { seq: seq, keyframe: Boolean(flags & WIRE_FLAG_KEYFRAME) && complete, cows: cows };
+}
+
 // Initialize MQTT connection
 function initMQTTConnection() {
     const url = `ws://${MQTT_CONFIG.broker}:${MQTT_CONFIG.port}`;
@@ -50,6 +114,20 @@ function initMQTTConnection() {
         console.log('\n Received MQTT Message');
         console.log('Time:', new Date().toLocaleString());
         console.log('Topic:', topic);
+
+        if (isBinaryFrame(message)) {
+            console.log(`Raw Message: <binary, ${message.length} bytes>`);
+            try {
+                const data = decodeBinaryFrame(message);
+                if (data !== null) {
+                    processReceivedData(data);
+                }
+            } catch (e) {
+                console.error('ERROR: Binary frame decoding failed:', e.message);
+            }
+            return;
+        }
+
         console.log('Raw Message:', message.toString());
 
         try {
@@ -81,14 +159,38 @@ function initMQTTConnection() {
     });
 }
 
+// Fold a message into cowState.
+// Frame {"seq": 7, "keyframe": false, "cows": {...}}: a keyframe replaces the state, a delta updates the cows it lists.
+// Plain {"cow1": [x, y, status], ...}: the whole state, as before frames were introduced.
+function applyFrame(data) {
+    const isFrame = data.cows !== undefined && data.keyframe !== undefined;
+    if (!isFrame) {
+        cowState = {};
+        Object.assign(cowState, data);
+        lastSeq = null;
+        return;
+    }
+
+    if (lastSeq !== null && data.seq > lastSeq + 1 && !data.keyframe) {
+        console.warn(`WARNING: Missed ${data.seq - lastSeq - 1} frame(s), map stale until the next keyframe`);
+    }
+    lastSeq = data.seq;
+
+    if (data.keyframe) {
+        cowState = {};
+    }
+    Object.assign(cowState, data.cows);
+}
+
 // Process received data
 function processReceivedData(data) {
     latestCowData = [];
 
     if (typeof data === 'object' && data !== null) {
-        console.log(`Received data for ${Object.keys(data).length} cows:`);
+        applyFrame(data);
+        console.log(`Received data, tracking ${Object.keys(cowState).length} cows:`);
 
-        for (const [cowId, cowArray] of Object.entries(data)) {
+        for (const [cowId, cowArray] of Object.entries(cowState)) {
             // Check if data format is correct [x, y, status]
             if (Array.isArray(cowArray) && cowArray.length >= 3) {
                 const cowObj = {